@@ -0,0 +1,138 @@
+import numpy as np
+
+
+
+from network_motifs.markov.trie import SearchCumulativeProbabilities
+
+
+
+class BackoffPredictor(object):
+    def __init__(self, trie, discount = 0.75):
+        """
+        Interpolated absolute discounting (Kneser-Ney style) over a context
+        trie. Every context gives up discount from each of its successor counts
+        and passes that mass to its parent, down to the order 0 counts at the
+        root. A context that was never seen backs off to its longest seen
+        suffix, so no prediction has incomplete information.
+        @param trie: the ContextTrie from the training iteration
+        @param discount: the amount in (0, 1] subtracted from every count
+        """
+        assert (0 < discount <= 1)
+
+        # the root must have the order 0 counts
+        assert (trie.successor_offsets[1] > 0)
+
+        self.trie = trie
+        self.discount = discount
+
+        offsets = trie.successor_offsets
+        nsuccessors = np.diff(offsets)
+        counts = np.asarray(trie.counts, dtype=np.float64)
+
+        # the root keeps its counts since there is nothing to back off to
+        discounts = np.full(counts.size, discount, dtype=np.float64)
+        discounts[offsets[0]:offsets[1]] = 0.0
+        discounted_counts = counts - discounts
+
+        prefix_counts = np.zeros(counts.size + 1, dtype=np.float64)
+        np.cumsum(counts, out=prefix_counts[1:])
+        totals = prefix_counts[offsets[1:]] - prefix_counts[offsets[:-1]]
+
+        # the probability of backing off to the parent for every context
+        self.backoff_weights = np.zeros(nsuccessors.size, dtype=np.float64)
+        has_successors = totals > 0
+        self.backoff_weights[has_successors] = discount * nsuccessors[has_successors] / totals[has_successors]
+        self.backoff_weights[0] = 0.0
+
+        # cumulative probabilities of the discounted counts within each context
+        prefix_discounted = np.zeros(counts.size + 1, dtype=np.float64)
+        np.cumsum(discounted_counts, out=prefix_discounted[1:])
+        running_counts = prefix_discounted[1:] - np.repeat(prefix_discounted[offsets[:-1]], nsuccessors)
+        discounted_totals = np.repeat(prefix_discounted[offsets[1:]] - prefix_discounted[offsets[:-1]], nsuccessors)
+
+        # contexts where every count is discounted away always back off
+        self.cumulative_probabilities = running_counts / np.where(discounted_totals > 0, discounted_totals, 1.0)
+
+        # most likely successors are computed for the contexts that are used
+        self.most_likely_successors = {}
+
+    def BackoffNodes(self, walk):
+        """
+        Returns the longest seen context for every position and order from
+        the output of ContextTrie.Walk.
+        @param walk: the context node of every order for every position
+        """
+        nodes = walk.copy()
+
+        # unseen contexts of order 1 back off to the root
+        nodes[nodes[:,0] < 0,0] = 0
+        for io in range(1, nodes.shape[1]):
+            unseen = nodes[:,io] < 0
+            nodes[unseen,io] = nodes[unseen,io - 1]
+
+        return nodes
+
+    def SampleSuccessors(self, nodes, random_values):
+        """
+        Returns a successor for every node sampled from the interpolated
+        distribution. Each random value first decides whether to back off to
+        the parent and is rescaled for the next step.
+        @param nodes: array of nodes in the trie
+        @param random_values: array of uniform random values in [0, 1)
+        """
+        nodes = np.array(nodes, dtype=np.int64)
+        random_values = np.array(random_values, dtype=np.float64)
+
+        # each context is at most max_order steps from the root
+        for _ in range(self.trie.max_order):
+            backoff_weights = self.backoff_weights[nodes]
+            backoff = random_values < backoff_weights
+            if not np.any(backoff): break
+
+            random_values[backoff] = random_values[backoff] / backoff_weights[backoff]
+            nodes[backoff] = self.trie.parents[nodes[backoff]]
+
+        # the rest of each random value picks a successor of the context
+        backoff_weights = self.backoff_weights[nodes]
+        random_values = (random_values - backoff_weights) / (1.0 - backoff_weights)
+
+        return SearchCumulativeProbabilities(self.trie.successor_offsets, self.cumulative_probabilities, self.trie.successors, nodes, random_values)
+
+    def MostLikelySuccessor(self, node):
+        """
+        Returns the successor with the highest interpolated probability for
+        this context. Ties go to the successor of the longest context.
+        @param node: the context in the trie
+        """
+        if not node in self.most_likely_successors:
+            probabilities = {}
+
+            weight = 1.0
+            context = node
+            while context >= 0:
+                start, end = self.trie.successor_offsets[context], self.trie.successor_offsets[context + 1]
+                cumulative_probabilities = self.cumulative_probabilities[start:end].tolist()
+
+                previous_probability = 0.0
+                for successor, cumulative_probability in zip(self.trie.successors[start:end].tolist(), cumulative_probabilities):
+                    probability = weight * (1.0 - self.backoff_weights[context]) * (cumulative_probability - previous_probability)
+                    probabilities[successor] = probabilities.get(successor, 0.0) + probability
+                    previous_probability = cumulative_probability
+
+                weight *= self.backoff_weights[context]
+                context = self.trie.parents[context]
+
+            self.most_likely_successors[node] = max(probabilities, key=probabilities.get)
+
+        return self.most_likely_successors[node]
+
+    def Predict(self, nodes, random_values=None, method='sample'):
+        """
+        Returns the predicted successor for every node.
+        @param nodes: array of nodes in the trie
+        @param random_values: array of uniform random values in [0, 1) (not needed for argmax)
+        @param method: sample or argmax
+        """
+        if method == 'sample': return self.SampleSuccessors(nodes, random_values)
+        elif method == 'argmax': return np.array([self.MostLikelySuccessor(node) for node in nodes.tolist()], dtype=np.int64)
+        else: assert (False)
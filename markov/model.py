@@ -0,0 +1,133 @@
+import os
+import struct
+import hashlib
+
+
+
+import numpy as np
+
+
+
+from network_motifs.markov.ngram import Vocabulary
+from network_motifs.markov.trie import ContextTrie
+from network_motifs.utilities.dataIO import ReadTrainingFilenames
+
+
+
+# first value of every model file to identify the layout (2 adds the order 0 counts, 3 the training digest)
+MARKOV_MODEL_VERSION = 3
+
+
+
+def MarkovModelFilename(dataset, request_type, max_order, k):
+    """
+    Returns the model file for this dataset/request type/max order/k.
+    @param dataset: the dataset that contains the training traces
+    @param request_type: the request type for this set of traces
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    """
+    return 'markov/models/{}-{}-max-order-{}-k-{}.model'.format(dataset, request_type, max_order, k)
+
+
+
+def MarkovTrainingHash(dataset, request_type):
+    """
+    Returns a digest of the training filenames and the size and modification
+    time of every training trace for this dataset/request type.
+    @param dataset: the dataset that contains the training traces
+    @param request_type: the request type for this set of traces
+    """
+    digest = hashlib.sha256()
+    for trace_filename in ReadTrainingFilenames(dataset, request_type):
+        stat = os.stat(trace_filename)
+
+        digest.update(trace_filename.encode())
+        digest.update(struct.pack('qq', stat.st_size, stat.st_mtime_ns))
+
+    return digest.digest()
+
+
+
+def WriteMarkovModel(dataset, request_type, trie, training_hash):
+    """
+    Write the context trie as flat arrays so that it can be memory mapped.
+    The file has a header of 8-byte integers and the training digest, the
+    integer arrays, the cumulative probabilities and the names of the labels.
+    @param dataset: the dataset that contains the training traces
+    @param request_type: the request type for this set of traces
+    @param trie: the ContextTrie to save
+    @param training_hash: the digest from MarkovTrainingHash for the traces the trie was trained on
+    """
+    # create the directory for the models if it does not exist
+    if not os.path.exists('markov/models'):
+        os.mkdir('markov/models')
+
+    model_filename = MarkovModelFilename(dataset, request_type, trie.max_order, trie.k)
+
+    names = '\0'.join(trie.vocabulary.names).encode()
+
+    with open(model_filename, 'wb') as fd:
+        fd.write(struct.pack('qqqqqqq32s', MARKOV_MODEL_VERSION, trie.max_order, trie.k, trie.NNodes(), trie.successors.size, trie.vocabulary.Size(), len(names), training_hash))
+
+        # the integer arrays in the order ReadMarkovModel expects
+        for array in [trie.parents, trie.labels, trie.successor_offsets, trie.successors, trie.counts, trie.edge_keys, trie.edge_children, trie.most_likely_successors]:
+            np.asarray(array, dtype=np.int64).tofile(fd)
+        np.asarray(trie.cumulative_probabilities, dtype=np.float64).tofile(fd)
+
+        fd.write(names)
+
+
+
+def ReadMarkovModel(dataset, request_type, max_order, k, training_hash):
+    """
+    Open the model for this dataset/request type/max order/k with every array
+    memory mapped from disk, or return None if it does not exist, was
+    written by an older version, or was trained on different traces.
+    Processes that open the same model share its pages.
+    @param dataset: the dataset that contains the training traces
+    @param request_type: the request type for this set of traces
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    @param training_hash: the digest from MarkovTrainingHash for the current training traces
+    """
+    model_filename = MarkovModelFilename(dataset, request_type, max_order, k)
+    if not os.path.exists(model_filename): return None
+
+    # older versions have a shorter header so only the version is read first
+    with open(model_filename, 'rb') as fd:
+        version, = struct.unpack('q', fd.read(8))
+        if not version == MARKOV_MODEL_VERSION: return None
+
+        header_size = 7 * 8 + 32
+        fd.seek(0)
+        _, max_order, k, nnodes, nsuccessors, nlabels, names_size, file_hash, = struct.unpack('qqqqqqq32s', fd.read(header_size))
+
+    # models of a previous training split are trained again
+    if not file_hash == training_hash: return None
+
+    # the sizes of the integer arrays in the file
+    sizes = [nnodes, nnodes, nnodes + 1, nsuccessors, nsuccessors, nnodes - 1, nnodes - 1, nnodes]
+    nintegers = sum(sizes)
+
+    integers = np.memmap(model_filename, dtype=np.int64, mode='r', offset=header_size, shape=(nintegers,))
+    cumulative_probabilities = np.memmap(model_filename, dtype=np.float64, mode='r', offset=header_size + 8 * nintegers, shape=(nsuccessors,))
+
+    arrays = []
+    offset = 0
+    for size in sizes:
+        arrays.append(integers[offset:offset + size])
+        offset += size
+    parents, labels, successor_offsets, successors, counts, edge_keys, edge_children, most_likely_successors = arrays
+
+    # the names are small compared to the arrays and are read into memory
+    with open(model_filename, 'rb') as fd:
+        fd.seek(header_size + 8 * (nintegers + nsuccessors))
+        names = fd.read(names_size).decode()
+
+    if nlabels: vocabulary = Vocabulary(names.split('\0'))
+    else: vocabulary = Vocabulary()
+
+    lookups = (edge_keys, edge_children, cumulative_probabilities, most_likely_successors)
+
+    return ContextTrie(vocabulary, max_order, k, parents, labels, successor_offsets, successors, counts, lookups)
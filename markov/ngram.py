@@ -0,0 +1,270 @@
+import numpy as np
+
+
+
+class Vocabulary(object):
+    def __init__(self, names=None):
+        """
+        Mapping between node names and integer label ids.
+        @param names: list of names to add in order (optional)
+        """
+        self.names = []
+        self.name_to_id = {}
+
+        if not names == None:
+            for name in names:
+                self.Add(name)
+
+    def Size(self):
+        """
+        Returns the number of labels in the vocabulary.
+        """
+        return len(self.names)
+
+    def Add(self, name):
+        """
+        Returns the id for this name and adds it if it is new.
+        @param name: the name of the node
+        """
+        if not name in self.name_to_id:
+            self.name_to_id[name] = len(self.names)
+            self.names.append(name)
+
+        return self.name_to_id[name]
+
+    def Encode(self, names, extend=True):
+        """
+        Returns the label ids for this list of names. Unknown names get -1
+        unless the vocabulary is extended.
+        @param names: the names to convert
+        @param extend: add unknown names to the vocabulary
+        """
+        if extend: return np.array([self.Add(name) for name in names], dtype=np.int64)
+        else: return np.array([self.name_to_id.get(name, -1) for name in names], dtype=np.int64)
+
+    def Name(self, label):
+        """
+        Returns the name for this label id.
+        @param label: the id of the label
+        """
+        return self.names[label]
+
+
+
+def TraceLabels(trace, vocabulary, extend=True):
+    """
+    Returns the label ids of the nodes of this trace in timestamp order.
+    @param trace: the trace to convert
+    @param vocabulary: the Vocabulary object for the names
+    @param extend: add unknown names to the vocabulary
+    """
+    return vocabulary.Encode([node.Name() for node in trace.ordered_nodes], extend)
+
+
+
+def EncodeTraces(traces, vocabulary, extend=True):
+    """
+    Returns the labels of all traces concatenated into one array and the
+    offsets where each trace starts (with the total length last).
+    @param traces: list of traces to convert
+    @param vocabulary: the Vocabulary object for the names
+    @param extend: add unknown names to the vocabulary
+    """
+    trace_labels = [TraceLabels(trace, vocabulary, extend) for trace in traces]
+
+    offsets = np.zeros(len(trace_labels) + 1, dtype=np.int64)
+    np.cumsum([labels.size for labels in trace_labels], out=offsets[1:])
+
+    # make sure there is at least one array to concatenate
+    labels = np.concatenate(trace_labels + [np.zeros(0, dtype=np.int64)])
+
+    return labels, offsets
+
+
+
+def PredictablePositions(offsets, k):
+    """
+    Returns the positions that have a node k steps in the future within the
+    same trace and the index of each position within its trace.
+    @param offsets: the start of each trace with the total length last
+    @param k: the number of nodes in the future to predict
+    """
+    lengths = np.diff(offsets)
+
+    local_indices = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+    remaining = np.repeat(lengths, lengths) - local_indices
+
+    positions = np.flatnonzero(remaining > k)
+
+    return positions, local_indices[positions]
+
+
+
+class MarkovCounts(object):
+    def __init__(self, vocabulary, max_order, k, context_labels, context_parents, transition_offsets, successors, counts, root_successors, root_counts):
+        """
+        Sparse count table for the Markov chain of every order. A context of
+        order o is its oldest label and its parent context of order o - 1
+        (the parent is -1 for order 1). Successors of each context are stored
+        consecutively in the order they were first seen.
+        All attributes except the vocabulary are lists with one array per order.
+        @param vocabulary: the Vocabulary object for the labels
+        @param max_order: the maximum number of nodes to look at in the past
+        @param k: the number of nodes in the future to predict
+        @param context_labels: the oldest label of each context
+        @param context_parents: the context of one less order for each context
+        @param transition_offsets: start of the successors for each context
+        @param successors: the label of each successor
+        @param counts: how many times each successor follows its context
+        @param root_successors: the label of each successor of the empty context
+        @param root_counts: how many times each label is predicted (order 0)
+        """
+        self.vocabulary = vocabulary
+        self.max_order = max_order
+        self.k = k
+        self.context_labels = context_labels
+        self.context_parents = context_parents
+        self.transition_offsets = transition_offsets
+        self.successors = successors
+        self.counts = counts
+        self.root_successors = root_successors
+        self.root_counts = root_counts
+
+    def NContexts(self, order):
+        """
+        Returns the number of contexts of this order.
+        @param order: the number of nodes in the context
+        """
+        return self.context_labels[order - 1].size
+
+    def Keys(self, order):
+        """
+        Returns the tuple of names for every context of this order.
+        @param order: the number of nodes in the context
+        """
+        keys = [()]
+        for io in range(order):
+            # contexts of order 1 extend the empty context
+            if io: parents = self.context_parents[io].tolist()
+            else: parents = [0] * self.NContexts(1)
+            keys = [(self.vocabulary.Name(label),) + keys[parent] for label, parent in zip(self.context_labels[io].tolist(), parents)]
+
+        return keys
+
+    def Transitions(self):
+        """
+        Returns the transitions in the format of GenerateTransitionMatrix.
+        """
+        transitions = {}
+
+        for io in range(self.max_order):
+            keys = self.Keys(io + 1)
+            offsets = self.transition_offsets[io].tolist()
+            successors = self.successors[io].tolist()
+            counts = self.counts[io].tolist()
+
+            for context, key in enumerate(keys):
+                start, end = offsets[context], offsets[context + 1]
+
+                # how many times was this key seen
+                noccurrences = sum(counts[start:end])
+
+                # keep track of cumulative probabilities
+                transitions[key] = []
+                cumulative_probability = 0.0
+                for successor, count in zip(successors[start:end], counts[start:end]):
+                    cumulative_probability += count / noccurrences
+                    transitions[key].append((cumulative_probability, self.vocabulary.Name(successor)))
+
+        return transitions
+
+
+
+def TrainMarkovCounts(training_traces, max_order, k = 1, vocabulary = None):
+    """
+    Create the count table of a Markov Chain model from the training traces.
+    Every trace is converted to label ids once. The contexts of each order are
+    numbered by combining the contexts of the previous order with one more
+    label, so no context is ever stored as a tuple.
+    @param training_traces: list of traces for model generation
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    @param vocabulary: the Vocabulary object to extend (optional)
+    """
+    # parameter verification
+    assert (len(training_traces))
+    assert (max_order > 0)
+    assert (k > 0)
+
+    if vocabulary == None: vocabulary = Vocabulary()
+
+    labels, offsets = EncodeTraces(training_traces, vocabulary)
+
+    return CountMarkovTransitions(labels, offsets, vocabulary, max_order, k)
+
+
+
+def CountMarkovTransitions(labels, offsets, vocabulary, max_order, k):
+    """
+    Create the count table of a Markov Chain model from encoded traces.
+    @param labels: the label ids of all traces concatenated
+    @param offsets: the start of each trace with the total length last
+    @param vocabulary: the Vocabulary object for the labels
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    """
+    nlabels = max(vocabulary.Size(), 1)
+
+    # only positions with a node k steps in the future are counted
+    positions, local_indices = PredictablePositions(offsets, k)
+    futures = labels[positions + k]
+    contexts = np.zeros(0, dtype=np.int64)
+
+    # the empty context counts every future in the order first seen
+    unique_futures, first_occurrences, future_counts = np.unique(futures, return_index=True, return_counts=True)
+    order_seen = np.argsort(first_occurrences)
+    root_successors = unique_futures[order_seen]
+    root_counts = future_counts[order_seen].astype(np.int64)
+
+    context_labels = []
+    context_parents = []
+    transition_offsets = []
+    successors = []
+    counts = []
+
+    for order in range(1, max_order + 1):
+        # the context of this order needs order - 1 earlier nodes in the trace
+        keep = local_indices >= order - 1
+        positions = positions[keep]
+        local_indices = local_indices[keep]
+        futures = futures[keep]
+        if order > 1: contexts = contexts[keep]
+
+        # extend every context with the next oldest label
+        ancestors = labels[positions - (order - 1)]
+        if order == 1: keys = ancestors
+        else: keys = contexts * nlabels + ancestors
+
+        unique_keys, contexts = np.unique(keys, return_inverse=True)
+        contexts = contexts.reshape(-1)
+
+        if order == 1: context_parents.append(np.full(unique_keys.size, -1, dtype=np.int64))
+        else: context_parents.append(unique_keys // nlabels)
+        context_labels.append(unique_keys % nlabels)
+
+        # count every (context, future) pair
+        pairs = contexts * nlabels + futures
+        unique_pairs, first_occurrences, pair_counts = np.unique(pairs, return_index=True, return_counts=True)
+        pair_contexts = unique_pairs // nlabels
+
+        # keep the successors of each context in the order they were first seen
+        order_seen = np.lexsort((first_occurrences, pair_contexts))
+
+        offsets = np.zeros(unique_keys.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_contexts, minlength=unique_keys.size), out=offsets[1:])
+
+        transition_offsets.append(offsets)
+        successors.append(unique_pairs[order_seen] % nlabels)
+        counts.append(pair_counts[order_seen].astype(np.int64))
+
+    return MarkovCounts(vocabulary, max_order, k, context_labels, context_parents, transition_offsets, successors, counts, root_successors, root_counts)
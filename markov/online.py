@@ -0,0 +1,212 @@
+import numpy as np
+
+
+
+from network_motifs.markov.ngram import TraceLabels, Vocabulary
+
+
+
+# rescale all weights once the increment grows past this value
+max_increment = 1e100
+# weights that are this much smaller than the newest trace are dropped when rescaling
+min_weight = 1 / max_increment
+
+
+
+class OnlineMarkovModel(object):
+    def __init__(self, max_order, k = 1, decay = None, vocabulary = None):
+        """
+        Context trie Markov Chain model that is updated one trace at a time.
+        Every update adds to the counts of the contexts it touches and marks
+        them dirty. The cumulative distribution of a context is only rebuilt
+        when it is next used for a prediction.
+        With decay, every trace counts 1 / decay times as much as the trace
+        before it, which is the same as multiplying all older counts by decay.
+        Counts that decayed below min_weight are forgotten and a context with
+        no counts left has no successors.
+        @param max_order: the maximum number of nodes to look at in the past
+        @param k: the number of nodes in the future to predict
+        @param decay: the factor in (0, 1] for older traces (None for no decay)
+        @param vocabulary: the Vocabulary object for the labels (optional)
+        """
+        assert (max_order > 0)
+        assert (k > 0)
+        assert (decay == None or 0 < decay <= 1)
+
+        if vocabulary == None: vocabulary = Vocabulary()
+
+        self.max_order = max_order
+        self.k = k
+        self.decay = decay
+        self.vocabulary = vocabulary
+
+        # node 0 is the empty context
+        self.parents = [-1]
+        self.labels = [-1]
+        self.children = {}
+        self.weights = [{}]
+
+        # the weight that the next trace adds to each count
+        self.increment = 1.0
+
+        # cumulative distributions are rebuilt lazily for dirty contexts
+        self.distributions = {}
+        self.dirty_nodes = set()
+
+        self.ntraces = 0
+
+    def NNodes(self):
+        """
+        Returns the number of contexts in the model including the root.
+        """
+        return len(self.parents)
+
+    def Child(self, node, label, create = False):
+        """
+        Returns the context that extends this node with an older label or -1
+        if that context was never seen.
+        @param node: the context in the trie (-1 for a missing context)
+        @param label: the older label id (-1 for an unknown label)
+        @param create: add the context if it does not exist
+        """
+        if node == -1 or label == -1: return -1
+
+        child = self.children.get((node, label), -1)
+        if child == -1 and create:
+            child = len(self.parents)
+            self.children[(node, label)] = child
+            self.parents.append(node)
+            self.labels.append(label)
+            self.weights.append({})
+
+        return child
+
+    def AddTransitions(self, labels, weight):
+        """
+        Add every transition in this sequence of labels with the given weight.
+        @param labels: the label ids of a trace in timestamp order
+        @param weight: the weight to add to each count
+        """
+        nnodes = len(labels)
+        for iv in range(nnodes - self.k):
+            # what node in the future are we trying to predict
+            future_node = labels[iv + self.k]
+
+            # the empty context keeps the order 0 counts
+            self.weights[0][future_node] = self.weights[0].get(future_node, 0.0) + weight
+            self.dirty_nodes.add(0)
+
+            # go through all orders that have enough earlier nodes
+            node = 0
+            for io in range(min(self.max_order, iv + 1)):
+                node = self.Child(node, labels[iv - io], create=True)
+
+                weights = self.weights[node]
+                weights[future_node] = weights.get(future_node, 0.0) + weight
+                self.dirty_nodes.add(node)
+
+    def Update(self, trace):
+        """
+        Add the transitions of a newly arriving trace to the model.
+        @param trace: the trace to learn from
+        """
+        labels = TraceLabels(trace, self.vocabulary).tolist()
+        self.AddTransitions(labels, self.increment)
+        self.ntraces += 1
+
+        if not self.decay == None:
+            self.increment /= self.decay
+
+            # rescaling every weight does not change any distribution, but
+            # weights that would underflow to zero after more rescales are dropped
+            if self.increment > max_increment:
+                for node, weights in enumerate(self.weights):
+                    for label in list(weights):
+                        weights[label] /= self.increment
+                        if weights[label] < min_weight:
+                            del weights[label]
+                            self.dirty_nodes.add(node)
+                self.increment = 1.0
+
+    def Walk(self, context):
+        """
+        Returns the context node of every order for the most recent label of
+        this context. Orders without enough earlier labels keep the node of
+        the previous order. Contexts that were never seen are -1.
+        @param context: the most recent label ids in timestamp order
+        """
+        nodes = []
+
+        node = 0
+        for io in range(self.max_order):
+            if io < len(context): node = self.Child(node, context[-1 - io])
+            nodes.append(node)
+
+        return nodes
+
+    def Distribution(self, node):
+        """
+        Returns the successors, cumulative probabilities and the most likely
+        successor of this context, rebuilding them if the context changed.
+        @param node: the context in the trie
+        """
+        if node in self.dirty_nodes or not node in self.distributions:
+            weights = self.weights[node]
+            successors = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+            cumulative_weights = np.cumsum(np.fromiter(weights.values(), dtype=np.float64, count=len(weights)))
+
+            cumulative_probabilities = cumulative_weights / cumulative_weights[-1]
+            most_likely = successors[np.argmax(np.diff(cumulative_weights, prepend=0.0))]
+
+            self.distributions[node] = (successors, cumulative_probabilities, most_likely)
+            self.dirty_nodes.discard(node)
+
+        return self.distributions[node]
+
+    def Predict(self, node, random_value = None, method = 'sample'):
+        """
+        Returns the predicted successor of this context or -1 if the context
+        has no successors.
+        @param node: the context in the trie
+        @param random_value: uniform random value in [0, 1) (not needed for argmax)
+        @param method: sample or argmax
+        """
+        if node == -1 or not len(self.weights[node]): return -1
+
+        successors, cumulative_probabilities, most_likely = self.Distribution(node)
+
+        if method == 'sample':
+            index = np.searchsorted(cumulative_probabilities, random_value, side='right')
+            return successors[min(index, successors.size - 1)]
+        elif method == 'argmax':
+            return most_likely
+        else: assert (False)
+
+
+
+def OnlineMarkovModelFromTrie(trie, decay = None):
+    """
+    Create an online model that starts from the counts of a trained trie.
+    @param trie: the ContextTrie from the training iteration
+    @param decay: the factor in (0, 1] for older traces (None for no decay)
+    """
+    model = OnlineMarkovModel(trie.max_order, trie.k, decay, Vocabulary(trie.vocabulary.names))
+
+    parents = trie.parents.tolist()
+    labels = trie.labels.tolist()
+    offsets = trie.successor_offsets.tolist()
+    successors = trie.successors.tolist()
+    counts = trie.counts.tolist()
+
+    # parents always come before their children in the trie
+    nodes = [0]
+    for node in range(1, len(parents)):
+        nodes.append(model.Child(nodes[parents[node]], labels[node], create=True))
+
+    for node in range(len(parents)):
+        weights = model.weights[nodes[node]]
+        for successor, count in zip(successors[offsets[node]:offsets[node + 1]], counts[offsets[node]:offsets[node + 1]]):
+            weights[successor] = float(count)
+        if len(weights): model.dirty_nodes.add(nodes[node])
+
+    return model
@@ -2,6 +2,15 @@ import random
 
 
 
+import numpy as np
+
+
+
+from network_motifs.markov.backoff import BackoffPredictor
+from network_motifs.markov.ngram import EncodeTraces, PredictablePositions, TrainMarkovCounts
+
+
+
 def ToOrdinal(value):
     """
     Convert a numerical value into an ordinal number.
@@ -64,39 +73,8 @@ def TrainMarkovChain(training_traces, max_order, k = 1):
     assert (max_order > 0)
     assert (k > 0)
 
-    # next estimates are aggregated over all training_traces
-    counts = {}
-
-    # train the Markov model
-    for trace in training_traces:
-        # go through every node in the trace in timestamp order
-        nnodes = len(trace.nodes)
-        for iv in range(nnodes):
-            # what node in the future are we trying to predict
-            future_node = trace.KthNode(iv + k)
-            if future_node == None: continue
-            future_node = future_node.Name()
-
-            key = ()
-            # go through all orders sequentially
-            for io in range(max_order):
-                ancestor_node = trace.KthNode(iv - io)
-                if ancestor_node == None: continue
-
-                key = (ancestor_node.Name(),) + key
-
-                # has this key been seen before?
-                if not key in counts:
-                    counts[key] = {}
-                # has  this future node been seen before?
-                if not future_node in counts[key]:
-                    counts[key][future_node] = 1
-                else:
-                    counts[key][future_node] += 1
-
-
-    # convert the counts from above to transitions from a given key
-    transitions = GenerateTransitionMatrix(counts)
+    # the counts are built over label arrays and converted to transitions
+    transitions = TrainMarkovCounts(training_traces, max_order, k).Transitions()
 
     return transitions
 
@@ -160,6 +138,20 @@ def TestMarkovChain(traces, transitions, max_order, k = 1, print_verbose = False
                     nincorrect_transitions[io] += 1
                     previous_result = 0
 
+    return MarkovAccuracies(ncorrect_transitions, nincorrect_transitions, nincomplete_information, max_order, k, print_verbose)
+
+
+
+def MarkovAccuracies(ncorrect_transitions, nincorrect_transitions, nincomplete_information, max_order, k, print_verbose = False):
+    """
+    Calculate the accuracy for each order from the prediction counts.
+    @param ncorrect_transitions: the number of correct predictions per order
+    @param nincorrect_transitions: the number of incorrect predictions per order
+    @param nincomplete_information: the number of unseen contexts per order
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    @param: print_verbose: print out the results for each order
+    """
     # calculate the accuracy for each order
     accuracies = []
 
@@ -177,3 +169,161 @@ def TestMarkovChain(traces, transitions, max_order, k = 1, print_verbose = False
         accuracies.append(accuracy)
 
     return accuracies
+
+
+
+def TraceBatches(offsets, batch_size):
+    """
+    Returns ranges of traces (first, last + 1) with about batch_size nodes each.
+    Every batch has at least one trace.
+    @param offsets: the start of each trace with the total length last
+    @param batch_size: the number of nodes per batch
+    """
+    ntraces = offsets.size - 1
+
+    batches = []
+    start = 0
+    while start < ntraces:
+        end = int(np.searchsorted(offsets, offsets[start] + batch_size, side='right')) - 1
+        end = min(max(end, start + 1), ntraces)
+        batches.append((start, end))
+        start = end
+
+    return batches
+
+
+
+def MarkovPredictionCounts(labels, offsets, trie, max_order, k, method, rng, backoff = None):
+    """
+    Returns the number of correct, incorrect and incomplete predictions for
+    every order over these encoded traces as a (3, max_order) array.
+    @param labels: the label ids of the traces concatenated
+    @param offsets: the start of each trace with the total length last
+    @param trie: the ContextTrie from the training iteration
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    @param method: sample, alias or argmax (see ContextTrie.Predict)
+    @param rng: the NumPy random number generator
+    @param backoff: the BackoffPredictor for unseen contexts (None to count them as incomplete)
+    """
+    prediction_counts = np.zeros((3, max_order), dtype=np.int64)
+
+    # only nodes with a node k steps in the future are predicted
+    positions, local_indices = PredictablePositions(offsets, k)
+    if not positions.size: return prediction_counts
+
+    walk = trie.Walk(labels, max_order, positions, local_indices)
+    if not backoff == None:
+        # the same walk gives the longest seen context for every order
+        walk = backoff.BackoffNodes(walk)
+        trie = backoff
+    future_nodes = labels[positions + k]
+    if not method == 'argmax': random_values = rng.random((positions.size, max_order))
+
+    # what was the result from the previous order (2 for incomplete)
+    previous_results = np.full(positions.size, 2, dtype=np.int64)
+
+    # go through all orders sequentially
+    for io in range(max_order):
+        nodes = walk[:,io]
+        seen = nodes >= 0
+
+        if method == 'argmax': predictions = trie.Predict(nodes[seen], method=method)
+        else: predictions = trie.Predict(nodes[seen], random_values[seen,io], method)
+
+        # unseen contexts keep the result of the previous order
+        results = previous_results.copy()
+        results[seen] = (predictions == future_nodes[seen])
+
+        # results are 0 (incorrect), 1 (correct) or 2 (incomplete)
+        nresults = np.bincount(results, minlength=3)
+        prediction_counts[0,io] += nresults[1]
+        prediction_counts[1,io] += nresults[0]
+        prediction_counts[2,io] += nresults[2]
+
+        previous_results = results
+
+    return prediction_counts
+
+
+
+def MarkovEvaluationCounts(traces, tries, max_order, method = 'sample', seed = None, batch_size = 1 << 20, discount = None):
+    """
+    Predict future nodes for every k and every order over all testing traces.
+    The traces are encoded once and evaluated in batches of nodes. Returns a
+    dictionary from k to the (3, max_order) array of correct, incorrect and
+    incomplete predictions.
+    @param traces: list of traces for prediction
+    @param tries: dictionary from k to the ContextTrie from the training iteration
+    @param max_order: the maximum number of nodes to look at in the past
+    @param method: sample, alias or argmax (see ContextTrie.Predict)
+    @param seed: seed for the random number generator (None for a random seed)
+    @param batch_size: the number of nodes to evaluate at once
+    @param discount: back off to shorter contexts with this discount (None for no back off)
+    """
+    ks = sorted(tries.keys())
+
+    # labels that were never seen in training cannot be predicted
+    vocabulary = tries[ks[0]].vocabulary
+    labels, offsets = EncodeTraces(traces, vocabulary, extend=False)
+
+    rng = np.random.default_rng(seed)
+
+    evaluation_counts = {}
+    for k in ks:
+        # all of the tries must use the same label ids
+        assert (tries[k].vocabulary.names == vocabulary.names)
+
+        if discount == None: backoff = None
+        else: backoff = BackoffPredictor(tries[k], discount)
+
+        prediction_counts = np.zeros((3, max_order), dtype=np.int64)
+        for start, end in TraceBatches(offsets, batch_size):
+            batch_labels = labels[offsets[start]:offsets[end]]
+            batch_offsets = offsets[start:end + 1] - offsets[start]
+            prediction_counts += MarkovPredictionCounts(batch_labels, batch_offsets, tries[k], max_order, k, method, rng, backoff)
+
+        evaluation_counts[k] = prediction_counts
+
+    return evaluation_counts
+
+
+
+def EvaluateMarkovTries(traces, tries, max_order, method = 'sample', seed = None, batch_size = 1 << 20, print_verbose = False, discount = None):
+    """
+    Returns a dictionary from k to the accuracy of each order over all testing
+    traces (see MarkovEvaluationCounts and VisualizeAccuracyCurves).
+    @param traces: list of traces for prediction
+    @param tries: dictionary from k to the ContextTrie from the training iteration
+    @param max_order: the maximum number of nodes to look at in the past
+    @param method: sample, alias or argmax (see ContextTrie.Predict)
+    @param seed: seed for the random number generator (None for a random seed)
+    @param batch_size: the number of nodes to evaluate at once
+    @param: print_verbose: print out the results for each order
+    @param discount: back off to shorter contexts with this discount (None for no back off)
+    """
+    evaluation_counts = MarkovEvaluationCounts(traces, tries, max_order, method, seed, batch_size, discount)
+
+    accuracies = {}
+    for k, prediction_counts in evaluation_counts.items():
+        ncorrect_transitions, nincorrect_transitions, nincomplete_information = prediction_counts.tolist()
+        accuracies[k] = MarkovAccuracies(ncorrect_transitions, nincorrect_transitions, nincomplete_information, max_order, k, print_verbose)
+
+    return accuracies
+
+
+
+def TestMarkovTrie(traces, trie, max_order, k = 1, print_verbose = False, method = 'sample', seed = None):
+    """
+    Predict future nodes based on max_order previous nodes with a context
+    trie. The contexts for every order come from one walk down the trie and
+    the predictions for each order are made for all traces at once.
+    @param traces: list of traces for prediction
+    @param trie: the ContextTrie from the training iteration
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    @param: print_verbose: print out the results for each node
+    @param method: sample, alias or argmax (see ContextTrie.Predict)
+    @param seed: seed for the random number generator (None for a random seed)
+    """
+    return EvaluateMarkovTries(traces, { k: trie }, max_order, method, seed, print_verbose=print_verbose)[k]
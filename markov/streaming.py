@@ -0,0 +1,174 @@
+import time
+import collections
+
+
+
+import numpy as np
+
+
+
+class StreamingPredictor(object):
+    def __init__(self, trie, method = 'argmax', seed = None):
+        """
+        Predict the node k steps ahead for requests that are still running.
+        Each request keeps the label ids of its last max_order nodes. Every
+        prediction uses the longest context of the request that was seen in
+        training.
+        @param trie: the ContextTrie (or memory mapped model) to predict with
+        @param method: sample, alias or argmax (see ContextTrie.Predict)
+        @param seed: seed for the random number generator (None for a random seed)
+        """
+        self.trie = trie
+        self.method = method
+        self.rng = np.random.default_rng(seed)
+
+        # the rolling context for every request in flight
+        self.contexts = {}
+
+    def NRequests(self):
+        """
+        Returns the number of requests in flight.
+        """
+        return len(self.contexts)
+
+    def Start(self, request_id):
+        """
+        Start tracking a new request.
+        @param request_id: unique identifier of the request
+        """
+        self.contexts[request_id] = collections.deque(maxlen=self.trie.max_order)
+
+    def Finish(self, request_id):
+        """
+        Stop tracking a request that completed.
+        @param request_id: unique identifier of the request
+        """
+        del self.contexts[request_id]
+
+    def Observe(self, request_id, name):
+        """
+        Add the newest node of a request to its context.
+        @param request_id: unique identifier of the request
+        @param name: the name of the node (see TraceNode.Name)
+        """
+        self.contexts[request_id].append(self.trie.vocabulary.name_to_id.get(name, -1))
+
+    def ContextNode(self, context):
+        """
+        Returns the longest seen context in the trie for these labels.
+        @param context: the most recent label ids in timestamp order
+        """
+        node = 0
+        for label in reversed(context):
+            child = self.trie.Child(node, label)
+            if child == -1: break
+            node = child
+
+        return node
+
+    def Predict(self, request_id):
+        """
+        Returns the name of the node predicted k steps after the newest node of
+        this request or None if no context of the request was seen.
+        @param request_id: unique identifier of the request
+        """
+        node = self.ContextNode(self.contexts[request_id])
+        if not node: return None
+
+        if self.method == 'argmax':
+            successor = self.trie.most_likely_successors[node]
+        elif self.method == 'sample':
+            # a single binary search within the successors of this context
+            start, end = self.trie.successor_offsets[node], self.trie.successor_offsets[node + 1]
+            index = int(np.searchsorted(self.trie.cumulative_probabilities[start:end], self.rng.random(), side='right'))
+            successor = self.trie.successors[start + min(index, end - start - 1)]
+        else:
+            successor = self.trie.Predict(np.array([node]), self.rng.random(1), self.method)[0]
+
+        return self.trie.vocabulary.Name(successor)
+
+    def PredictBatch(self, request_ids):
+        """
+        Returns the predictions for many requests at once by walking the trie
+        for all of them together.
+        @param request_ids: the requests to predict for
+        """
+        nrequests = len(request_ids)
+        max_order = self.trie.max_order
+
+        # most recent label first with -1 past the start of each request
+        contexts = np.full((nrequests, max_order), -1, dtype=np.int64)
+        lengths = np.zeros(nrequests, dtype=np.int64)
+        for iv, request_id in enumerate(request_ids):
+            context = self.contexts[request_id]
+            lengths[iv] = len(context)
+            contexts[iv,:len(context)] = list(reversed(context))
+
+        # keep the deepest node that was seen for every request
+        nodes = np.zeros(nrequests, dtype=np.int64)
+        current = np.zeros(nrequests, dtype=np.int64)
+        for io in range(max_order):
+            extend = lengths > io
+            current[extend] = self.trie.Children(current[extend], contexts[extend,io])
+            nodes = np.where(current >= 0, current, nodes)
+
+        predictions = [None for _ in range(nrequests)]
+
+        seen = np.flatnonzero(nodes > 0)
+        successors = self.trie.Predict(nodes[seen], self.rng.random(seen.size), self.method)
+        for iv, successor in zip(seen.tolist(), successors.tolist()):
+            predictions[iv] = self.trie.vocabulary.Name(successor)
+
+        return predictions
+
+
+
+def BenchmarkStreamingPredictor(trie, traces, nconcurrent = 1000, method = 'argmax', seed = None):
+    """
+    Replay the traces as concurrent requests whose nodes arrive interleaved and
+    predict after every arrival. Prints the predictions per second and the
+    latency percentiles and returns the latencies in seconds.
+    @param trie: the ContextTrie (or memory mapped model) to predict with
+    @param traces: the traces to replay
+    @param nconcurrent: the number of requests in flight at once
+    @param method: sample, alias or argmax (see ContextTrie.Predict)
+    @param seed: seed for the random number generator (None for a random seed)
+    """
+    predictor = StreamingPredictor(trie, method, seed)
+
+    # the node names of every trace in timestamp order
+    pending = collections.deque([(iv, [node.Name() for node in trace.ordered_nodes]) for iv, trace in enumerate(traces)])
+    in_flight = collections.deque()
+
+    latencies = []
+    start_time = time.time()
+
+    while len(pending) or len(in_flight):
+        # keep nconcurrent requests in flight
+        while len(pending) and len(in_flight) < nconcurrent:
+            request_id, names = pending.popleft()
+            predictor.Start(request_id)
+            in_flight.append((request_id, names, 0))
+
+        # the next node of the oldest request arrives
+        request_id, names, index = in_flight.popleft()
+
+        prediction_time = time.perf_counter()
+        predictor.Observe(request_id, names[index])
+        predictor.Predict(request_id)
+        latencies.append(time.perf_counter() - prediction_time)
+
+        if index + 1 < len(names): in_flight.append((request_id, names, index + 1))
+        else: predictor.Finish(request_id)
+
+    total_time = time.time() - start_time
+    latencies = np.array(latencies, dtype=np.float64)
+
+    # print statistics
+    print ('Streamed {} predictions for {} requests ({} concurrent) in {:0.2f} seconds.'.format(latencies.size, len(traces), nconcurrent, total_time))
+    if latencies.size:
+        print ('  Predictions per second: {:0.2f}'.format(latencies.size / total_time))
+        print ('  Median latency: {:0.2f} us'.format(1e6 * np.percentile(latencies, 50)))
+        print ('  P99 latency: {:0.2f} us'.format(1e6 * np.percentile(latencies, 99)))
+
+    return latencies
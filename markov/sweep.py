@@ -0,0 +1,110 @@
+import os
+import time
+import multiprocessing
+
+
+
+from network_motifs.markov.model import MarkovTrainingHash, ReadMarkovModel, WriteMarkovModel
+from network_motifs.markov.predict import MarkovEvaluationCounts
+from network_motifs.markov.trie import TrainContextTries
+from network_motifs.utilities.constants import request_types_per_dataset
+from network_motifs.utilities.dataIO import ReadTestingTraces, ReadTrainingTraces
+
+
+
+def SweepRequestType(arguments):
+    """
+    Evaluate every order and k for one request type. Runs in a worker process.
+    One model is trained (or read from disk) per k at the maximum order since
+    every lower order is a prefix of the same walk down the trie.
+    Returns the request type, the result rows, and the training and testing time.
+    @params arguments: tuple of (dataset, request_type, max_order, ks, method, seed, discount)
+    """
+    dataset, request_type, max_order, ks, method, seed, discount = arguments
+
+    # start statistics
+    start_time = time.time()
+
+    # reuse the models that were already written to disk for these training traces
+    training_hash = MarkovTrainingHash(dataset, request_type)
+    tries = {}
+    for k in ks:
+        trie = ReadMarkovModel(dataset, request_type, max_order, k, training_hash)
+        if not trie == None: tries[k] = trie
+
+    # the tries are evaluated together and must share one vocabulary, so all are trained again if any is missing
+    if not len(tries) == len(ks) or any(not trie.vocabulary.names == tries[ks[0]].vocabulary.names for trie in tries.values()):
+        tries = TrainContextTries(ReadTrainingTraces(dataset, request_type), max_order, ks)
+        for k in ks:
+            WriteMarkovModel(dataset, request_type, tries[k], training_hash)
+
+    training_time = time.time() - start_time
+
+    # every k and order is evaluated in one pass over the testing traces
+    evaluation_counts = MarkovEvaluationCounts(ReadTestingTraces(dataset, request_type), tries, max_order, method, seed, discount=discount)
+
+    rows = []
+    for k in ks:
+        for io in range(max_order):
+            ncorrect, nincorrect, nincomplete = evaluation_counts[k][:,io].tolist()
+            rows.append((request_type, k, io + 1, ncorrect, nincorrect, nincomplete))
+
+    return request_type, rows, training_time, time.time() - start_time - training_time
+
+
+
+def SweepMarkovChains(dataset, max_order, ks, nprocesses = None, method = 'sample', seed = None, discount = None):
+    """
+    Evaluate the Markov Chains of every order up to max_order and every k for
+    all request types in this dataset. Request types are spread over a process
+    pool and the results are written to one table.
+    Returns a dictionary from request type to the accuracies for each k (see
+    VisualizeAccuracyCurves).
+    @param dataset: the dataset to evaluate
+    @param max_order: the maximum number of nodes to look at in the past
+    @param ks: the numbers of nodes in the future to predict
+    @param nprocesses: the number of worker processes (None for all cores)
+    @param method: sample, alias or argmax (see ContextTrie.Predict)
+    @param seed: seed for the random number generator (None for a random seed)
+    @param discount: back off to shorter contexts with this discount (None for no back off)
+    """
+    # start statistics
+    start_time = time.time()
+
+    request_types = request_types_per_dataset[dataset]
+
+    # every request type gets its own reproducible stream of random numbers
+    arguments = []
+    for iv, request_type in enumerate(request_types):
+        request_seed = None if seed == None else seed + iv
+        arguments.append((dataset, request_type, max_order, ks, method, request_seed, discount))
+
+    rows_per_request_type = {}
+    with multiprocessing.Pool(nprocesses) as pool:
+        for request_type, rows, training_time, testing_time in pool.imap_unordered(SweepRequestType, arguments):
+            rows_per_request_type[request_type] = rows
+            print ('Swept {} {} in {:0.2f} seconds ({:0.2f} training, {:0.2f} testing).'.format(dataset, request_type, training_time + testing_time, training_time, testing_time))
+
+    accuracies_per_request_type = {}
+
+    # create the directory for the results if it does not exist
+    if not os.path.exists('markov/results'):
+        os.mkdir('markov/results')
+
+    results_filename = 'markov/results/{}-max-order-{}-sweep.txt'.format(dataset, max_order)
+    with open(results_filename, 'w') as fd:
+        fd.write('request_type k order correct incorrect incomplete accuracy\n')
+
+        # write the rows in the same order every time
+        for request_type in request_types:
+            accuracies_per_request_type[request_type] = {}
+            for (_, k, order, ncorrect, nincorrect, nincomplete) in rows_per_request_type[request_type]:
+                accuracy = 100 * ncorrect / (ncorrect + nincorrect + nincomplete)
+                accuracies_per_request_type[request_type].setdefault(k, []).append(accuracy)
+
+                fd.write('{} {} {} {} {} {} {:0.2f}\n'.format(request_type, k, order, ncorrect, nincorrect, nincomplete, accuracy))
+
+    # print statistics
+    print ('Swept {} request types, {} values of k and {} orders for {} in {:0.2f} seconds.'.format(len(request_types), len(ks), max_order, dataset, time.time() - start_time))
+
+    return accuracies_per_request_type
@@ -0,0 +1,357 @@
+import numpy as np
+
+
+
+from network_motifs.markov.ngram import CountMarkovTransitions, EncodeTraces, TrainMarkovCounts, Vocabulary
+
+
+
+def CumulativeProbabilities(offsets, counts):
+    """
+    Returns the cumulative probability of every successor within its context.
+    The last successor of every context has probability exactly one.
+    @param offsets: start of the successors for each context
+    @param counts: how many times each successor follows its context
+    """
+    nsuccessors = np.diff(offsets)
+
+    # running counts within each context from the prefix sums over all contexts
+    prefix_counts = np.zeros(counts.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=prefix_counts[1:])
+    running_counts = prefix_counts[1:] - np.repeat(prefix_counts[offsets[:-1]], nsuccessors)
+    totals = prefix_counts[offsets[1:]] - prefix_counts[offsets[:-1]]
+
+    return running_counts / np.repeat(totals, nsuccessors)
+
+
+
+def SearchCumulativeProbabilities(offsets, cumulative_probabilities, successors, contexts, random_values):
+    """
+    Returns the first successor of every context with a cumulative
+    probability larger than its random value using a vectorized binary
+    search. The search ends on the last successor if rounding leaves no
+    larger value.
+    @param offsets: start of the successors for each context
+    @param cumulative_probabilities: the cumulative probability of every successor
+    @param successors: the label of each successor
+    @param contexts: array of contexts that have successors
+    @param random_values: array of uniform random values in [0, 1)
+    """
+    lows = offsets[contexts]
+    highs = offsets[contexts + 1] - 1
+
+    active = lows < highs
+    while np.any(active):
+        middles = (lows + highs) // 2
+        larger = cumulative_probabilities[middles] <= random_values
+        lows = np.where(active & larger, middles + 1, lows)
+        highs = np.where(active & ~larger, middles, highs)
+        active = lows < highs
+
+    return successors[lows]
+
+
+
+def MostLikelySuccessors(offsets, successors, counts):
+    """
+    Returns the most frequent successor of every context (-1 for contexts
+    without successors). Ties go to the successor that was seen first.
+    @param offsets: start of the successors for each context
+    @param successors: the label of each successor
+    @param counts: how many times each successor follows its context
+    """
+    nsuccessors = np.diff(offsets)
+    contexts = np.repeat(np.arange(nsuccessors.size), nsuccessors)
+
+    # within each context the most frequent successor moves to the front
+    order = np.lexsort((np.arange(counts.size), -counts, contexts))
+
+    most_likely = np.full(nsuccessors.size, -1, dtype=np.int64)
+    most_likely[nsuccessors > 0] = successors[order[offsets[:-1][nsuccessors > 0]]]
+
+    return most_likely
+
+
+
+def AliasTables(offsets, counts):
+    """
+    Returns the alias probability and the alias (relative to the start of the
+    context) for every successor using Vose's method.
+    @param offsets: start of the successors for each context
+    @param counts: how many times each successor follows its context
+    """
+    alias_probabilities = np.ones(counts.size, dtype=np.float64)
+    alias_indices = np.zeros(counts.size, dtype=np.int64)
+
+    offsets_list = offsets.tolist()
+    counts_list = counts.tolist()
+
+    for context in range(len(offsets_list) - 1):
+        start, end = offsets_list[context], offsets_list[context + 1]
+        nsuccessors = end - start
+        if nsuccessors < 2: continue
+
+        total = sum(counts_list[start:end])
+        probabilities = [count * nsuccessors / total for count in counts_list[start:end]]
+
+        small = [iv for iv in range(nsuccessors) if probabilities[iv] < 1.0]
+        large = [iv for iv in range(nsuccessors) if probabilities[iv] >= 1.0]
+
+        while len(small) and len(large):
+            less = small.pop()
+            more = large.pop()
+
+            alias_probabilities[start + less] = probabilities[less]
+            alias_indices[start + less] = more
+
+            # the large column gives away the rest of the small column
+            probabilities[more] = probabilities[more] + probabilities[less] - 1.0
+            if probabilities[more] < 1.0: small.append(more)
+            else: large.append(more)
+
+        # the remaining columns are full up to rounding
+        for iv in small + large:
+            alias_probabilities[start + iv] = 1.0
+            alias_indices[start + iv] = iv
+
+    return alias_probabilities, alias_indices
+
+
+
+class ContextTrie(object):
+    def __init__(self, vocabulary, max_order, k, parents, labels, successor_offsets, successors, counts, lookups=None):
+        """
+        Context trie (prediction suffix tree) for a variable order Markov chain.
+        Node 0 is the empty context and its successors are the order 0 counts.
+        Every other node extends the context of its parent with one older
+        label, so all orders share their nodes.
+        Successors of each node are stored consecutively in flat arrays.
+        @param vocabulary: the Vocabulary object for the labels
+        @param max_order: the maximum number of nodes to look at in the past
+        @param k: the number of nodes in the future to predict
+        @param parents: the parent of every node (-1 for the root)
+        @param labels: the label that every node adds to its parent's context
+        @param successor_offsets: start of the successors for each node
+        @param successors: the label of each successor
+        @param counts: how many times each successor follows its context
+        @param lookups: precomputed (edge keys, edge children, cumulative probabilities, most likely successors) (optional)
+        """
+        self.vocabulary = vocabulary
+        self.max_order = max_order
+        self.k = k
+        self.parents = parents
+        self.labels = labels
+        self.successor_offsets = successor_offsets
+        self.successors = successors
+        self.counts = counts
+
+        # the number of labels is needed to combine parents and labels into keys
+        self.nlabels = max(vocabulary.Size(), 1)
+
+        if lookups == None:
+            # sort the edges by (parent, label) for child lookups
+            children = np.flatnonzero(parents >= 0)
+            edge_keys = parents[children] * self.nlabels + labels[children]
+            edge_order = np.argsort(edge_keys, kind='stable')
+            self.edge_keys = edge_keys[edge_order]
+            self.edge_children = children[edge_order]
+
+            # cumulative probabilities of the successors for each node
+            self.cumulative_probabilities = CumulativeProbabilities(successor_offsets, counts)
+            self.most_likely_successors = MostLikelySuccessors(successor_offsets, successors, counts)
+        else:
+            self.edge_keys, self.edge_children, self.cumulative_probabilities, self.most_likely_successors = lookups
+
+        # alias tables are only built when needed
+        self.alias_probabilities = None
+        self.alias_indices = None
+
+    def NNodes(self):
+        """
+        Returns the number of contexts in the trie including the root.
+        """
+        return self.parents.size
+
+    def Children(self, nodes, labels):
+        """
+        Returns the child of every node for the corresponding label or -1 if
+        that context was never seen.
+        @param nodes: array of nodes in the trie (-1 for missing nodes)
+        @param labels: array of label ids (-1 for unknown labels)
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64)
+
+        keys = nodes * self.nlabels + labels
+        indices = np.minimum(np.searchsorted(self.edge_keys, keys), max(self.edge_keys.size - 1, 0))
+
+        children = np.full(keys.shape, -1, dtype=np.int64)
+        if not self.edge_keys.size: return children
+
+        found = (nodes >= 0) & (labels >= 0) & (self.edge_keys[indices] == keys)
+        children[found] = self.edge_children[indices[found]]
+
+        return children
+
+    def Child(self, node, label):
+        """
+        Returns the child of this node for the label or -1 if that context was
+        never seen. Scalar version of Children for single lookups.
+        @param node: the context in the trie (-1 for a missing context)
+        @param label: the older label id (-1 for an unknown label)
+        """
+        if node < 0 or label < 0: return -1
+
+        key = node * self.nlabels + label
+        index = int(np.searchsorted(self.edge_keys, key))
+        if index < self.edge_keys.size and self.edge_keys[index] == key: return int(self.edge_children[index])
+
+        return -1
+
+    def Walk(self, labels, max_order, positions=None, local_indices=None):
+        """
+        Returns the context node of every order for every position in this
+        sequence of labels in a single traversal. Orders without enough
+        earlier labels keep the node of the previous order. Contexts that were
+        never seen are -1.
+        @param labels: the label ids of one or more traces in timestamp order
+        @param max_order: the maximum number of nodes to look at in the past
+        @param positions: the positions to walk from (None for every position of one trace)
+        @param local_indices: the index of every position within its trace
+        """
+        if positions is None:
+            positions = np.arange(labels.size, dtype=np.int64)
+            local_indices = positions
+
+        nodes = np.zeros((positions.size, max_order), dtype=np.int64)
+        current = np.zeros(positions.size, dtype=np.int64)
+        for io in range(max_order):
+            # extend the context of every position with an older label
+            extend = local_indices >= io
+            current[extend] = self.Children(current[extend], labels[positions[extend] - io])
+            nodes[:,io] = current
+
+        return nodes
+
+    def BuildAliasTables(self):
+        """
+        Build the alias tables for constant time sampling from every node.
+        """
+        self.alias_probabilities, self.alias_indices = AliasTables(self.successor_offsets, self.counts)
+
+    def SampleSuccessors(self, nodes, random_values):
+        """
+        Returns a successor for every node sampled from its distribution. Each
+        random value selects the first successor with a larger cumulative
+        probability, found by a binary search within the node's successors.
+        @param nodes: array of nodes in the trie that have successors
+        @param random_values: array of uniform random values in [0, 1)
+        """
+        return SearchCumulativeProbabilities(self.successor_offsets, self.cumulative_probabilities, self.successors, nodes, random_values)
+
+    def AliasSuccessors(self, nodes, random_values):
+        """
+        Returns a successor for every node sampled with the alias method. The
+        integer part of the scaled random value picks a column and the
+        fraction picks between the column and its alias.
+        @param nodes: array of nodes in the trie that have successors
+        @param random_values: array of uniform random values in [0, 1)
+        """
+        if self.alias_probabilities is None: self.BuildAliasTables()
+
+        starts = self.successor_offsets[nodes]
+        nsuccessors = self.successor_offsets[nodes + 1] - starts
+
+        scaled_values = random_values * nsuccessors
+        columns = np.minimum(scaled_values.astype(np.int64), nsuccessors - 1)
+        fractions = scaled_values - columns
+
+        indices = starts + columns
+        indices = np.where(fractions < self.alias_probabilities[indices], indices, starts + self.alias_indices[indices])
+
+        return self.successors[indices]
+
+    def Predict(self, nodes, random_values=None, method='sample'):
+        """
+        Returns the predicted successor for every node.
+        @param nodes: array of nodes in the trie that have successors
+        @param random_values: array of uniform random values in [0, 1) (not needed for argmax)
+        @param method: sample (binary search), alias (alias tables) or argmax (most likely)
+        """
+        if method == 'sample': return self.SampleSuccessors(nodes, random_values)
+        elif method == 'alias': return self.AliasSuccessors(nodes, random_values)
+        elif method == 'argmax': return self.most_likely_successors[nodes]
+        else: assert (False)
+
+    def Successors(self, node):
+        """
+        Returns the successors and cumulative probabilities for this node.
+        @param node: the context in the trie
+        """
+        start, end = self.successor_offsets[node], self.successor_offsets[node + 1]
+
+        return self.successors[start:end], self.cumulative_probabilities[start:end]
+
+
+
+def BuildContextTrie(markov_counts):
+    """
+    Convert the count table of every order into one context trie.
+    @param markov_counts: the MarkovCounts object to convert
+    """
+    # the root is the empty context and the orders follow in sequence
+    node_offsets = [1]
+    for io in range(markov_counts.max_order):
+        node_offsets.append(node_offsets[-1] + markov_counts.NContexts(io + 1))
+
+    parents = [np.array([-1], dtype=np.int64)]
+    labels = [np.array([-1], dtype=np.int64)]
+    nsuccessors = [np.array([markov_counts.root_successors.size], dtype=np.int64)]
+    successors = [markov_counts.root_successors]
+    counts = [markov_counts.root_counts]
+
+    for io in range(markov_counts.max_order):
+        # contexts of order 1 hang off the root
+        if io: parents.append(markov_counts.context_parents[io] + node_offsets[io - 1])
+        else: parents.append(np.zeros(markov_counts.NContexts(1), dtype=np.int64))
+        labels.append(markov_counts.context_labels[io])
+        nsuccessors.append(np.diff(markov_counts.transition_offsets[io]))
+        successors.append(markov_counts.successors[io])
+        counts.append(markov_counts.counts[io])
+
+    nsuccessors = np.concatenate(nsuccessors)
+    successor_offsets = np.zeros(nsuccessors.size + 1, dtype=np.int64)
+    np.cumsum(nsuccessors, out=successor_offsets[1:])
+
+    return ContextTrie(markov_counts.vocabulary, markov_counts.max_order, markov_counts.k, np.concatenate(parents), np.concatenate(labels),
+                       successor_offsets, np.concatenate(successors), np.concatenate(counts))
+
+
+
+def TrainContextTrie(training_traces, max_order, k = 1):
+    """
+    Create a context trie Markov Chain model from the training traces.
+    @param training_traces: list of traces for model generation
+    @param max_order: the maximum number of nodes to look at in the past
+    @param k: the number of nodes in the future to predict
+    """
+    return BuildContextTrie(TrainMarkovCounts(training_traces, max_order, k))
+
+
+
+def TrainContextTries(training_traces, max_order, ks):
+    """
+    Create a context trie for every k from the training traces. The traces
+    are encoded once and all tries share one vocabulary.
+    @param training_traces: list of traces for model generation
+    @param max_order: the maximum number of nodes to look at in the past
+    @param ks: the numbers of nodes in the future to predict
+    """
+    vocabulary = Vocabulary()
+    labels, offsets = EncodeTraces(training_traces, vocabulary)
+
+    tries = {}
+    for k in ks:
+        tries[k] = BuildContextTrie(CountMarkovTransitions(labels, offsets, vocabulary, max_order, k))
+
+    return tries
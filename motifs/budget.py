@@ -0,0 +1,152 @@
+import os
+import time
+import resource
+
+
+
+# possible outcomes of querying one pattern in one trace
+QUERY_COMPLETE = 0
+QUERY_MAX_EMBEDDINGS = 1
+QUERY_MAX_SECONDS = 2
+QUERY_MAX_MEMORY = 3
+# a resumed query that reached a limit again without finding a new embedding
+QUERY_NO_PROGRESS = 4
+
+query_status_names = {
+    QUERY_COMPLETE: 'complete',
+    QUERY_MAX_EMBEDDINGS: 'max-embeddings',
+    QUERY_MAX_SECONDS: 'max-seconds',
+    QUERY_MAX_MEMORY: 'max-memory',
+    QUERY_NO_PROGRESS: 'no-progress',
+}
+
+
+
+def ResidentMemory(pid=None):
+    """
+    Returns the number of bytes currently resident for a process. Falls back
+    to the peak resident size of this process when /proc is not available.
+    @params pid: the process to measure (None for this process)
+    """
+    if pid == None: statm_filename = '/proc/self/statm'
+    else: statm_filename = '/proc/{}/statm'.format(pid)
+
+    if os.path.exists(statm_filename):
+        try:
+            with open(statm_filename, 'r') as fd:
+                resident_pages = int(fd.read().split()[1])
+        # the process exited between the check and the read
+        except (OSError, IndexError, ValueError):
+            return 0
+        return resident_pages * resource.getpagesize()
+    elif pid == None:
+        # ru_maxrss is reported in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    else:
+        # other processes cannot be measured without /proc
+        return 0
+
+
+
+class QueryBudget(object):
+    def __init__(self, max_embeddings=None, max_seconds=None, max_memory=None, poll_seconds=0.1):
+        """
+        Limits for a single subgraph isomorphism call. A limit of None means
+        that the call is unbounded in that dimension. Bounded calls run in a
+        worker process that is checked every poll_seconds, so the time and
+        memory limits hold even while no embedding is found.
+        @params max_embeddings: the maximum number of embeddings to enumerate
+        @params max_seconds: the maximum wall clock time for the call
+        @params max_memory: the maximum resident memory in bytes for the worker
+        @params poll_seconds: how often to check the time and memory of the worker
+        """
+        self.max_embeddings = max_embeddings
+        self.max_seconds = max_seconds
+        self.max_memory = max_memory
+        self.poll_seconds = poll_seconds
+
+        self.start_time = None
+
+    def Unbounded(self):
+        """
+        Returns True if no limits are set for this budget.
+        """
+        return self.max_embeddings == None and self.max_seconds == None and self.max_memory == None
+
+    def Start(self):
+        """
+        Start the clock for a new call. Resumed calls start it again once the
+        embeddings found by an earlier call are skipped.
+        """
+        self.start_time = time.time()
+
+    def ElapsedTime(self):
+        """
+        Returns the number of seconds since the call started.
+        """
+        return time.time() - self.start_time
+
+    def PollTimeout(self):
+        """
+        Returns how long to wait for the worker before checking the limits again.
+        """
+        if self.max_seconds == None: return self.poll_seconds
+        else: return max(0.0, min(self.poll_seconds, self.max_seconds - self.ElapsedTime()))
+
+    def Status(self, nembeddings, pid=None):
+        """
+        Returns which limit (if any) is reached after enumerating nembeddings.
+        The embedding limit is only reached by finding more embeddings than
+        allowed, so a search with exactly max_embeddings results is complete.
+        @params nembeddings: the number of embeddings found so far in this call
+        @params pid: the process doing the search (None for this process)
+        """
+        if not self.max_embeddings == None and nembeddings > self.max_embeddings:
+            return QUERY_MAX_EMBEDDINGS
+        if not self.max_seconds == None and self.ElapsedTime() >= self.max_seconds:
+            return QUERY_MAX_SECONDS
+        if not self.max_memory == None and ResidentMemory(pid) >= self.max_memory:
+            return QUERY_MAX_MEMORY
+
+        return QUERY_COMPLETE
+
+
+
+class QueryLimitRecord(object):
+    def __init__(self, base_id, motif_index, status, nembeddings, seconds):
+        """
+        Record of one trace/pattern pair that reached a query limit.
+        @params base_id: the trace that was queried
+        @params motif_index: the pattern that was queried
+        @params status: which limit was reached
+        @params nembeddings: the number of embeddings kept as a partial result
+        @params seconds: the time spent on the call
+        """
+        self.base_id = base_id
+        self.motif_index = motif_index
+        self.status = status
+        self.nembeddings = nembeddings
+        self.seconds = seconds
+
+
+
+def WriteQueryLimitReport(dataset, request_type, suffix, records):
+    """
+    Write every trace/pattern pair that reached a query limit to a report.
+    @params dataset: the dataset that was queried
+    @params request_type: the request type for this set of traces
+    @params suffix: the motif method that created these motifs
+    @params records: list of QueryLimitRecord objects
+    """
+    report_filename = 'motifs/subgraphs/{}/{}-{}-query-limits.txt'.format(dataset, request_type, suffix)
+
+    with open(report_filename, 'w') as fd:
+        fd.write('base_id motif_index limit nembeddings seconds\n')
+        for record in records:
+            fd.write('{} {} {} {} {:0.2f}\n'.format(record.base_id, record.motif_index, query_status_names[record.status], record.nembeddings, record.seconds))
+
+    # print statistics
+    print ('{} trace/pattern pairs reached a query limit for {} {} ({}).'.format(len(records), dataset, request_type, suffix))
+    for status in [QUERY_MAX_EMBEDDINGS, QUERY_MAX_SECONDS, QUERY_MAX_MEMORY, QUERY_NO_PROGRESS]:
+        nrecords = len([record for record in records if record.status == status])
+        if nrecords: print ('  {}: {}'.format(query_status_names[status], nrecords))
@@ -0,0 +1,156 @@
+import os
+import struct
+import hashlib
+
+
+
+from network_motifs.motifs.budget import QUERY_NO_PROGRESS, QueryLimitRecord
+
+
+
+class QueryCache(object):
+    def __init__(self, trace_hash, pattern_hashes, motif_indices, limit_records=None):
+        """
+        Record of which trace contents and which patterns produced a motif file.
+        @params trace_hash: digest of the trace file that was queried
+        @params pattern_hashes: list of digests for the queried patterns
+        @params motif_indices: the motif index for each queried pattern
+        @params limit_records: QueryLimitRecords for patterns with partial results keyed by digest
+        """
+        if limit_records == None: limit_records = {}
+
+        assert (len(pattern_hashes) == len(motif_indices))
+
+        self.trace_hash = trace_hash
+        self.pattern_hashes = pattern_hashes
+        self.motif_indices = motif_indices
+        self.limit_records = limit_records
+
+        # needed for quick lookups when merging results
+        self.pattern_to_motif_index = {}
+        for pattern_hash, motif_index in zip(pattern_hashes, motif_indices):
+            self.pattern_to_motif_index[pattern_hash] = motif_index
+
+    def PatternSetHash(self):
+        """
+        Returns the digest for the set of patterns in this cache entry.
+        """
+        return PatternSetHash(self.pattern_hashes)
+
+    def TruncatedPatterns(self):
+        """
+        Returns the set of pattern digests whose query reached a limit and can
+        be resumed. Patterns whose last resume made no progress are left out.
+        """
+        return set(pattern_hash for pattern_hash, record in self.limit_records.items() if not record.status == QUERY_NO_PROGRESS)
+
+
+
+def TraceHash(trace):
+    """
+    Returns a digest of the contents of the file for this trace.
+    @params trace: the trace to hash
+    """
+    with open(trace.Filename(), 'rb') as fd:
+        return hashlib.sha256(fd.read()).digest()
+
+
+
+def PatternHash(subgraph):
+    """
+    Returns a digest for the canonical form of this pattern. The digest does
+    not depend on the position of the pattern in the pattern file or on how
+    the miner numbered its vertices.
+    @params subgraph: the pattern to hash
+    """
+    ordered_labels, edges = subgraph.CanonicalForm()
+    pattern = 'v {} e {}'.format(list(ordered_labels), list(edges))
+
+    return hashlib.sha256(pattern.encode()).digest()
+
+
+
+def PatternSetHash(pattern_hashes):
+    """
+    Returns a digest for a set of patterns regardless of their order.
+    @params pattern_hashes: the digests for every pattern in the set
+    """
+    digest = hashlib.sha256()
+    for pattern_hash in sorted(pattern_hashes):
+        digest.update(pattern_hash)
+
+    return digest.digest()
+
+
+
+def QueryCacheFilename(dataset, base_id, suffix):
+    """
+    Returns the file that records how the motifs for this trace were created.
+    @params dataset: the dataset that contains the trace
+    @params base_id: the unique identifier for the trace
+    @params suffix: the motif method that created these motifs
+    """
+    return 'motifs/subgraphs/{}/{}-motifs-{}.cache'.format(dataset, base_id, suffix)
+
+
+
+def ReadQueryCache(dataset, base_id, suffix):
+    """
+    Read the cache entry for this trace if it exists.
+    @params dataset: the dataset that contains the trace
+    @params base_id: the unique identifier for the trace
+    @params suffix: the motif method that created these motifs
+    """
+    cache_filename = QueryCacheFilename(dataset, base_id, suffix)
+    if not os.path.exists(cache_filename): return None
+
+    pattern_hashes = []
+    motif_indices = []
+    limit_records = {}
+
+    with open(cache_filename, 'rb') as fd:
+        trace_hash, pattern_set_hash, = struct.unpack('32s32s', fd.read(64))
+        npatterns, = struct.unpack('q', fd.read(8))
+        for _ in range(npatterns):
+            pattern_hash, motif_index, = struct.unpack('32sq', fd.read(40))
+            pattern_hashes.append(pattern_hash)
+            motif_indices.append(motif_index)
+
+        # read the patterns that only have partial results (files from before query limits end here)
+        trailer = fd.read(8)
+        if len(trailer) == 8: nlimit_records, = struct.unpack('q', trailer)
+        else: nlimit_records = 0
+        for _ in range(nlimit_records):
+            pattern_hash, motif_index, status, nembeddings, seconds, = struct.unpack('32sqqqd', fd.read(64))
+            limit_records[pattern_hash] = QueryLimitRecord(base_id, motif_index, status, nembeddings, seconds)
+
+    cache = QueryCache(trace_hash, pattern_hashes, motif_indices, limit_records)
+    assert (cache.PatternSetHash() == pattern_set_hash)
+
+    return cache
+
+
+
+def WriteQueryCache(dataset, base_id, suffix, cache):
+    """
+    Write the cache entry for this trace to disk.
+    @params dataset: the dataset that contains the trace
+    @params base_id: the unique identifier for the trace
+    @params suffix: the motif method that created these motifs
+    @params cache: the QueryCache object to save
+    """
+    cache_filename = QueryCacheFilename(dataset, base_id, suffix)
+
+    with open(cache_filename, 'wb') as fd:
+        # the pattern set hash identifies which patterns produced the motifs
+        fd.write(struct.pack('32s32s', cache.trace_hash, cache.PatternSetHash()))
+        npatterns = len(cache.pattern_hashes)
+        fd.write(struct.pack('q', npatterns))
+        for pattern_hash, motif_index in zip(cache.pattern_hashes, cache.motif_indices):
+            fd.write(struct.pack('32sq', pattern_hash, motif_index))
+
+        # write the patterns that only have partial results
+        nlimit_records = len(cache.limit_records)
+        fd.write(struct.pack('q', nlimit_records))
+        for pattern_hash, record in cache.limit_records.items():
+            fd.write(struct.pack('32sqqqd', pattern_hash, record.motif_index, record.status, record.nembeddings, record.seconds))
@@ -0,0 +1,319 @@
+import os
+import time
+import struct
+
+
+
+import numpy as np
+
+
+
+from network_motifs.motifs.motif import MotifSourceSignature, ReadMotifs
+from network_motifs.motifs.store import max_base_id_bytes
+
+
+
+class InvertedIndex(object):
+    def __init__(self, base_ids, motif_indices, trace_ids, occurrences, minimum_timestamps, maximum_timestamps, signatures=None):
+        """
+        Index from each motif type to every occurrence of it across traces.
+        Entries are sorted by motif index, then by trace, then by occurrence.
+        @params base_ids: the traces that are covered by this index
+        @params motif_indices: the subgraph type of each entry
+        @params trace_ids: the position in base_ids of the trace for each entry
+        @params occurrences: the position of the motif in its trace's motif file
+        @params minimum_timestamps: the earliest node timestamp of each motif
+        @params maximum_timestamps: the latest node timestamp of each motif
+        @params signatures: the MotifSourceSignature of every trace when it was indexed (None for unknown)
+        """
+        if signatures == None: signatures = [(-1, -1) for _ in base_ids]
+
+        self.base_ids = base_ids
+        self.signatures = [tuple(signature) for signature in signatures]
+        self.base_id_to_trace_id = {}
+        for trace_id, base_id in enumerate(base_ids):
+            self.base_id_to_trace_id[base_id] = trace_id
+
+        order = np.lexsort((occurrences, trace_ids, motif_indices))
+        self.motif_indices = np.asarray(motif_indices, dtype=np.int64)[order]
+        self.trace_ids = np.asarray(trace_ids, dtype=np.int64)[order]
+        self.occurrences = np.asarray(occurrences, dtype=np.int64)[order]
+        self.minimum_timestamps = np.asarray(minimum_timestamps, dtype=np.int64)[order]
+        self.maximum_timestamps = np.asarray(maximum_timestamps, dtype=np.int64)[order]
+        self.durations = self.maximum_timestamps - self.minimum_timestamps
+
+    def NEntries(self):
+        """
+        Returns the number of motif occurrences in this index.
+        """
+        return self.motif_indices.size
+
+    def Contains(self, base_id):
+        """
+        Returns True if the motifs of this trace are in the index.
+        @params base_id: the unique identifier of the trace
+        """
+        return base_id in self.base_id_to_trace_id
+
+    def Current(self, dataset, suffix, base_id):
+        """
+        Returns True if the index has the entries for the motifs of this trace
+        that are on disk now.
+        @params dataset: the tracing utility that created these motifs
+        @params suffix: the motif method that created these motifs
+        @params base_id: the unique identifier of the trace
+        """
+        if not base_id in self.base_id_to_trace_id: return False
+
+        return self.signatures[self.base_id_to_trace_id[base_id]] == MotifSourceSignature(dataset, base_id, suffix)
+
+    def Covers(self, dataset, suffix, base_ids):
+        """
+        Returns True if the index is current for every one of these traces.
+        @params dataset: the tracing utility that created these motifs
+        @params suffix: the motif method that created these motifs
+        @params base_ids: the traces to check
+        """
+        return all(self.Current(dataset, suffix, base_id) for base_id in base_ids)
+
+    def Lookup(self, motif_index):
+        """
+        Returns the range of entries for this motif type.
+        @params motif_index: the subgraph type to look up
+        """
+        start = np.searchsorted(self.motif_indices, motif_index, side='left')
+        end = np.searchsorted(self.motif_indices, motif_index, side='right')
+
+        return slice(start, end)
+
+    def Traces(self, motif_index):
+        """
+        Returns the traces that contain this motif type.
+        @params motif_index: the subgraph type to look up
+        """
+        trace_ids = np.unique(self.trace_ids[self.Lookup(motif_index)])
+
+        return [self.base_ids[trace_id] for trace_id in trace_ids]
+
+    def TraceEntries(self, base_ids):
+        """
+        Returns a mask of the entries that belong to these traces.
+        @params base_ids: the traces to select
+        """
+        trace_ids = [self.base_id_to_trace_id[base_id] for base_id in base_ids if base_id in self.base_id_to_trace_id]
+
+        return np.isin(self.trace_ids, trace_ids)
+
+    def TraceTimestamps(self, dataset, suffix):
+        """
+        Returns a dictionary from base id to the minimum and maximum timestamps
+        of the motifs in that trace, ordered by occurrence. Only traces whose
+        entries are current (see Current) are included.
+        @params dataset: the tracing utility that created these motifs
+        @params suffix: the motif method that created these motifs
+        """
+        order = np.lexsort((self.occurrences, self.trace_ids))
+        trace_offsets = np.zeros(len(self.base_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.trace_ids, minlength=len(self.base_ids)), out=trace_offsets[1:])
+
+        minimum_timestamps = self.minimum_timestamps[order]
+        maximum_timestamps = self.maximum_timestamps[order]
+
+        trace_timestamps = {}
+        for trace_id, base_id in enumerate(self.base_ids):
+            if not self.Current(dataset, suffix, base_id): continue
+            start, end = trace_offsets[trace_id], trace_offsets[trace_id + 1]
+            trace_timestamps[base_id] = (minimum_timestamps[start:end], maximum_timestamps[start:end])
+
+        return trace_timestamps
+
+    def DurationStatistics(self, base_ids=None):
+        """
+        Returns the average and standard deviation of the duration for each
+        motif type as dictionaries keyed by motif index.
+        @params base_ids: only consider occurrences in these traces (None for all)
+        """
+        if base_ids == None: entries = np.ones(self.NEntries(), dtype=bool)
+        else: entries = self.TraceEntries(base_ids)
+
+        motif_indices = self.motif_indices[entries]
+        durations = self.durations[entries].astype(np.float64)
+
+        unique_motifs, inverse = np.unique(motif_indices, return_inverse=True)
+        noccurrences = np.bincount(inverse)
+
+        # two passes avoid cancellation for large timestamps
+        averages = np.bincount(inverse, weights=durations) / noccurrences
+        deviations = durations - averages[inverse]
+        stddevs = np.sqrt(np.bincount(inverse, weights=deviations * deviations) / noccurrences)
+
+        average_durations = {}
+        stddev_durations = {}
+        for iv, motif_index in enumerate(unique_motifs.tolist()):
+            average_durations[motif_index] = float(averages[iv])
+            stddev_durations[motif_index] = float(stddevs[iv])
+
+        return average_durations, stddev_durations
+
+
+
+def InvertedIndexFilename(dataset, suffix):
+    """
+    Returns the inverted index file for this dataset/suffix.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    """
+    return 'motifs/subgraphs/{}/motifs-{}.inverted'.format(dataset, suffix)
+
+
+
+def TraceOccurrences(trace, arrays):
+    """
+    Returns the index entries for the motifs of one trace as a tuple of
+    (motif indices, occurrences, minimum timestamps, maximum timestamps).
+    @params trace: the trace that contains all of the motifs
+    @params arrays: the MotifArrays object for this trace
+    """
+    timestamps = np.array([node.timestamp for node in trace.nodes], dtype=np.int64)
+    minimum_timestamps, maximum_timestamps = arrays.TimestampExtremes(timestamps)
+    occurrences = np.arange(arrays.NMotifs(), dtype=np.int64)
+
+    return (arrays.motif_indices, occurrences, minimum_timestamps, maximum_timestamps)
+
+
+
+# first bytes of every index file that records the motif signatures
+inverted_index_magic = b'INVIDX02'
+
+
+
+def ReadInvertedIndex(dataset, suffix):
+    """
+    Read the inverted index for this dataset/suffix or return None if it does
+    not exist.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    """
+    index_filename = InvertedIndexFilename(dataset, suffix)
+    if not os.path.exists(index_filename): return None
+
+    with open(index_filename, 'rb') as fd:
+        # indices from before the signatures were stored start with the number of traces
+        header = fd.read(8)
+        has_signatures = header == inverted_index_magic
+        if has_signatures: header = fd.read(8)
+
+        base_ids = []
+        signatures = []
+        ntraces, = struct.unpack('q', header)
+        for _ in range(ntraces):
+            base_id_bytes, = struct.unpack('%ds' % max_base_id_bytes, fd.read(max_base_id_bytes))
+            base_ids.append(base_id_bytes.decode().strip('\0'))
+            if has_signatures: signatures.append(struct.unpack('qq', fd.read(16)))
+            else: signatures.append((-1, -1))
+
+        nentries, = struct.unpack('q', fd.read(8))
+        columns = np.fromfile(fd, dtype=np.int64, count=5 * nentries).reshape(5, nentries)
+
+    return InvertedIndex(base_ids, columns[0], columns[1], columns[2], columns[3], columns[4], signatures)
+
+
+
+def WriteInvertedIndex(dataset, suffix, index):
+    """
+    Write the inverted index for this dataset/suffix to disk.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    @params index: the InvertedIndex object to save
+    """
+    index_filename = InvertedIndexFilename(dataset, suffix)
+
+    with open(index_filename, 'wb') as fd:
+        fd.write(inverted_index_magic)
+
+        ntraces = len(index.base_ids)
+        fd.write(struct.pack('q', ntraces))
+        for base_id, signature in zip(index.base_ids, index.signatures):
+            base_id_bytes = base_id.encode()
+            assert (len(base_id_bytes) <= max_base_id_bytes)
+            fd.write(struct.pack('%ds' % max_base_id_bytes, base_id_bytes))
+            fd.write(struct.pack('qq', *signature))
+
+        nentries = index.NEntries()
+        fd.write(struct.pack('q', nentries))
+        columns = np.stack((index.motif_indices, index.trace_ids, index.occurrences, index.minimum_timestamps, index.maximum_timestamps))
+        columns.tofile(fd)
+
+
+
+def UpdateInvertedIndex(dataset, suffix, trace_occurrences):
+    """
+    Replace the entries for these traces in the inverted index with new ones.
+    Entries for every other trace are kept. Call this after the motifs of
+    these traces are on disk so their signatures are recorded.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    @params trace_occurrences: dictionary from base id to the output of TraceOccurrences
+    """
+    base_ids = []
+    signatures = []
+    columns = [[] for _ in range(5)]
+
+    # keep the entries of the traces that did not change
+    index = ReadInvertedIndex(dataset, suffix)
+    if not index == None:
+        entries = ~index.TraceEntries(trace_occurrences.keys())
+        kept_base_ids = [base_id for base_id in index.base_ids if not base_id in trace_occurrences]
+
+        # renumber the kept traces
+        trace_id_mapping = np.full(len(index.base_ids), -1, dtype=np.int64)
+        for trace_id, base_id in enumerate(kept_base_ids):
+            trace_id_mapping[index.base_id_to_trace_id[base_id]] = trace_id
+        base_ids += kept_base_ids
+        signatures += [index.signatures[index.base_id_to_trace_id[base_id]] for base_id in kept_base_ids]
+
+        columns[0].append(index.motif_indices[entries])
+        columns[1].append(trace_id_mapping[index.trace_ids[entries]])
+        columns[2].append(index.occurrences[entries])
+        columns[3].append(index.minimum_timestamps[entries])
+        columns[4].append(index.maximum_timestamps[entries])
+
+    for base_id, (motif_indices, occurrences, minimum_timestamps, maximum_timestamps) in trace_occurrences.items():
+        trace_id = len(base_ids)
+        base_ids.append(base_id)
+        # the motifs were just read or written so their signature matches these entries
+        signatures.append(MotifSourceSignature(dataset, base_id, suffix))
+
+        columns[0].append(motif_indices)
+        columns[1].append(np.full(motif_indices.size, trace_id, dtype=np.int64))
+        columns[2].append(occurrences)
+        columns[3].append(minimum_timestamps)
+        columns[4].append(maximum_timestamps)
+
+    # make sure each column has at least one array to concatenate
+    for column in columns:
+        column.append(np.zeros(0, dtype=np.int64))
+    columns = [np.concatenate(column) for column in columns]
+
+    WriteInvertedIndex(dataset, suffix, InvertedIndex(base_ids, *columns, signatures=signatures))
+
+
+
+def BuildInvertedIndex(dataset, suffix, traces):
+    """
+    Add the motifs of these traces to the inverted index for this dataset/suffix.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    @params traces: the traces to index
+    """
+    # start statistics
+    start_time = time.time()
+
+    trace_occurrences = {}
+    for trace in traces:
+        trace_occurrences[trace.base_id] = TraceOccurrences(trace, ReadMotifs(dataset, trace, suffix, arrays=True))
+
+    UpdateInvertedIndex(dataset, suffix, trace_occurrences)
+
+    # print statistics
+    print ('Indexed motifs for {} traces in {} ({}) in {:0.2f} seconds.'.format(len(traces), dataset, suffix, time.time() - start_time))
@@ -1,12 +1,189 @@
 import os
-import struct
+import glob
+import time
+
+
+
+import numpy as np
+
+
+
+from network_motifs.motifs.store import CompactMotifStore, MotifStore, NoteMotifFileWritten, OpenMotifStore, open_motif_stores
+
+
+
+# marks files that use the array layout
+MOTIF_FILE_VERSION = -1
 
 
 
 class SubGraph(object):
-    def __init__(self, vertices, edges):
+    def __init__(self, vertices, edges, support=None, index=-1):
+        """
+        Initialize a subgraph (pattern) found by a frequent subgraph miner.
+        @params vertices: a list of (vertex_id, vertex_label) tuples
+        @params edges: a list of (source_index, destination_index) tuples
+        @params support: the number of graphs that contain this pattern (if known)
+        @params index: the position of this pattern in the pattern file
+        """
         self.vertices = vertices
         self.edges = edges
+        self.support = support
+        self.index = index
+        # computed on the first call to CanonicalForm
+        self.canonical_form = None
+
+    def size(self):
+        """
+        Return the size of this subgraph based only on the number of vertices
+        """
+        return len(self.vertices)
+
+    def CanonicalForm(self):
+        """
+        Return a form of this subgraph that does not depend on the vertex
+        ordering chosen by the miner. Two subgraphs share the same form if and
+        only if they are isomorphic (with labels). The form is found with
+        individualization-refinement: vertices are split into ordered cells by
+        label and the cells of their neighbors, then one vertex of the first
+        cell with several vertices is fixed at a time and the cells are refined
+        again. Branches that an automorphism maps onto a branch that was
+        already searched are skipped, so symmetric patterns stay cheap. The
+        form is computed once and kept in canonical_form.
+        """
+        if not self.canonical_form == None: return self.canonical_form
+
+        labels = {}
+        neighbors = {}
+        for (vertex_id, vertex_label) in self.vertices:
+            labels[vertex_id] = vertex_label
+            neighbors[vertex_id] = []
+
+        # edges are undirected
+        for (source_index, destination_index) in self.edges:
+            neighbors[source_index].append(destination_index)
+            neighbors[destination_index].append(source_index)
+
+        def Refine(colors):
+            # the color of a vertex is the first position of its cell so cells only split in place
+            while True:
+                cells = {}
+                for vertex_id, color in colors.items():
+                    cells.setdefault(color, []).append(vertex_id)
+
+                refined_colors = {}
+                for start, cell in cells.items():
+                    signatures = {}
+                    for vertex_id in cell:
+                        signatures[vertex_id] = tuple(sorted(colors[neighbor] for neighbor in neighbors[vertex_id]))
+
+                    offset = start
+                    for signature in sorted(set(signatures.values())):
+                        part = [vertex_id for vertex_id in cell if signatures[vertex_id] == signature]
+                        for vertex_id in part:
+                            refined_colors[vertex_id] = offset
+                        offset += len(part)
+
+                if len(set(refined_colors.values())) == len(cells): return refined_colors
+                colors = refined_colors
+
+        def TargetCell(colors):
+            # the first cell with more than one vertex (None if every vertex has its own position)
+            cells = {}
+            for vertex_id, color in colors.items():
+                cells.setdefault(color, []).append(vertex_id)
+            for color in sorted(cells):
+                if len(cells[color]) > 1: return sorted(cells[color])
+
+            return None
+
+        def Individualize(colors, vertex):
+            # the fixed vertex takes the first position of its cell
+            start = colors[vertex]
+            individualized_colors = {}
+            for vertex_id, color in colors.items():
+                if color == start and not vertex_id == vertex: individualized_colors[vertex_id] = start + 1
+                else: individualized_colors[vertex_id] = color
+
+            return individualized_colors
+
+        best_encoding = [None]
+        automorphisms = []
+
+        def Leaf(colors):
+            order = sorted(colors, key=lambda vertex_id: colors[vertex_id])
+
+            encoding = []
+            for (source_index, destination_index) in self.edges:
+                source_position, destination_position = colors[source_index], colors[destination_index]
+                encoding.append((min(source_position, destination_position), max(source_position, destination_position)))
+            encoding = (tuple(labels[vertex_id] for vertex_id in order), tuple(sorted(encoding)))
+
+            if best_encoding[0] == None or encoding < best_encoding[0]: best_encoding[0] = encoding
+
+            return encoding, order
+
+        def FirstLeaf(colors):
+            # follow the first vertex of every target cell down to a leaf
+            colors = Refine(colors)
+            cell = TargetCell(colors)
+            while not cell == None:
+                colors = Refine(Individualize(colors, cell[0]))
+                cell = TargetCell(colors)
+
+            return Leaf(colors)
+
+        def Orbit(vertices, fixed):
+            # the vertices reachable with the automorphisms that keep every fixed vertex in place
+            generators = [automorphism for automorphism in automorphisms if all(automorphism[vertex_id] == vertex_id for vertex_id in fixed)]
+
+            orbit = set(vertices)
+            stack = list(vertices)
+            while len(stack):
+                vertex_id = stack.pop()
+                for automorphism in generators:
+                    if not automorphism[vertex_id] in orbit:
+                        orbit.add(automorphism[vertex_id])
+                        stack.append(automorphism[vertex_id])
+
+            return orbit
+
+        def Search(colors, fixed):
+            # returns the encoding and order of the first leaf below these colors
+            colors = Refine(colors)
+            cell = TargetCell(colors)
+            if cell == None: return Leaf(colors)
+
+            first_leaf = None
+            searched = []
+            for vertex in cell:
+                if vertex in Orbit(searched, fixed): continue
+                individualized_colors = Individualize(colors, vertex)
+
+                # a branch whose first leaf matches the first branch is its image under an automorphism
+                if not first_leaf == None:
+                    encoding, order = FirstLeaf(individualized_colors)
+                    if encoding == first_leaf[0]:
+                        automorphisms.append(dict(zip(first_leaf[1], order)))
+                        searched.append(vertex)
+                        continue
+
+                leaf = Search(individualized_colors, fixed + [vertex])
+                if first_leaf == None: first_leaf = leaf
+                searched.append(vertex)
+
+            return first_leaf
+
+        # the initial cells order the vertices by label
+        sorted_labels = sorted(labels.values())
+        colors = {}
+        for vertex_id, vertex_label in labels.items():
+            colors[vertex_id] = sorted_labels.index(vertex_label)
+
+        Search(colors, [])
+        self.canonical_form = best_encoding[0]
+
+        return self.canonical_form
 
 
 
@@ -56,48 +233,341 @@ class Motif(object):
 
 
 
-def ReadMotifs(dataset, trace, suffix):
+class MotifArrays(object):
+    def __init__(self, counts, nodes, motif_indices):
+        """
+        Array form of the motifs in a trace. The nodes of every motif are stored
+        back to back in one flat array of node indices.
+        @params counts: the number of nodes in each motif
+        @params nodes: the node indices of every motif concatenated together
+        @params motif_indices: the subgraph type of each motif
+        """
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.nodes = np.asarray(nodes, dtype=np.int64)
+        self.motif_indices = np.asarray(motif_indices, dtype=np.int64)
+
+        assert (self.counts.size == self.motif_indices.size)
+        assert (np.sum(self.counts) == self.nodes.size)
+
+        # the nodes for motif iv are nodes[offsets[iv]:offsets[iv + 1]]
+        self.offsets = np.zeros(self.counts.size + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+    def NMotifs(self):
+        """
+        Return the number of motifs in these arrays
+        """
+        return self.counts.size
+
+    def Nodes(self, iv):
+        """
+        Return the node indices for the motif at position iv
+        @params iv: the position of the motif
+        """
+        return self.nodes[self.offsets[iv]:self.offsets[iv + 1]]
+
+    def Subset(self, indices):
+        """
+        Return a new MotifArrays object with only the motifs at these positions.
+        @params indices: the positions of the motifs to keep (in order)
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = self.counts[indices]
+
+        # gather the node ranges for the kept motifs
+        nodes = GatherRanges(self.nodes, self.offsets[indices], counts)
+
+        return MotifArrays(counts, nodes, self.motif_indices[indices])
+
+    def TimestampExtremes(self, timestamps):
+        """
+        Return the minimum and maximum timestamp of every motif.
+        @params timestamps: the timestamp of every node in the trace (by node index)
+        """
+        if not self.NMotifs(): return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        node_timestamps = np.asarray(timestamps)[self.nodes]
+        minimum_timestamps = np.minimum.reduceat(node_timestamps, self.offsets[:-1])
+        maximum_timestamps = np.maximum.reduceat(node_timestamps, self.offsets[:-1])
+
+        return minimum_timestamps, maximum_timestamps
+
+
+
+def GatherRanges(values, starts, counts):
     """
-    Read this motif file for this dataset and trace.
+    Returns the concatenation of values[start:start + count] for every range.
+    @params values: the array to gather from
+    @params starts: the first position of each range
+    @params counts: the length of each range
+    """
+    # position of every gathered element within its own range
+    within = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    return values[np.repeat(starts, counts) + within]
+
+
+
+def MotifFilename(dataset, base_id, suffix):
+    """
+    Returns the motif file for this dataset and trace.
     @params dataset: the tracing utility that created these motifs
-    @params trace: the trace that contains all of the motifs
+    @params base_id: the unique identifier of the trace
     @params suffix: the motif method that created these motifs
     """
+    return 'motifs/subgraphs/{}/{}-motifs-{}.motifs'.format(dataset, base_id, suffix)
+
+
+
+def ParseMotifFilename(motif_filename):
+    """
+    Returns the dataset, base id, and suffix of this motif file.
+    @params motif_filename: a filename from MotifFilename
+    """
+    dataset = os.path.basename(os.path.dirname(motif_filename))
+    base_id, suffix = os.path.basename(motif_filename)[:-len('.motifs')].split('-motifs-', 1)
+
+    return dataset, base_id, suffix
+
+
+
+def MotifArraysFromMotifs(motifs):
+    """
+    Convert a list of motif objects into array form.
+    @params motifs: a list of motif objects
+    """
+    counts = [len(motif.nodes) for motif in motifs]
+    nodes = [node.index for motif in motifs for node in motif.nodes]
+    motif_indices = [motif.motif_index for motif in motifs]
+
+    return MotifArrays(counts, nodes, motif_indices)
+
+
+
+def MotifsFromMotifArrays(trace, arrays):
+    """
+    Convert motifs in array form into a list of motif objects for this trace.
+    @params trace: the trace that contains all of the motifs
+    @params arrays: the MotifArrays object to convert
+    """
     motifs = []
-    # read this motif file
-    motif_filename = 'motifs/subgraphs/{}/{}-motifs-{}.motifs'.format(dataset, trace.base_id, suffix)
-    if not os.path.exists(motif_filename): return motifs
-
-    with open(motif_filename, 'rb') as fd:
-        # find the number of motifs in this dataset
-        nmotifs, = struct.unpack('q', fd.read(8))
-        # iterate over all found motifs
-        for _ in range(nmotifs):
-            # read all of the nodes in this motif
-            nnodes, = struct.unpack('q', fd.read(8))
-            nodes = []
-            for _ in range(nnodes):
-                node_index, = struct.unpack('q', fd.read(8))
-                nodes.append(trace.nodes[node_index])
-            motif_index, = struct.unpack('q', fd.read(8))
-            motifs.append(Motif(trace, nodes, motif_index))
+    for iv in range(arrays.NMotifs()):
+        nodes = [trace.nodes[node_index] for node_index in arrays.Nodes(iv).tolist()]
+        motifs.append(Motif(trace, nodes, int(arrays.motif_indices[iv])))
 
     return motifs
 
 
 
+def ParseMotifArrays(values):
+    """
+    Parse the 8-byte integers of a motif file into array form. The current
+    layout is a header (-1, nmotifs, nnodes) followed by the counts, offsets,
+    motif indices, and node indices. Older files without the header store
+    each motif as (nnodes, node indices..., motif index).
+    @params values: all of the integers in the motif file
+    """
+    if not values.size: return MotifArrays([], [], [])
+
+    # older files start with the number of motifs
+    if values[0] >= 0:
+        nmotifs = int(values[0])
+        counts = np.zeros(nmotifs, dtype=np.int64)
+        starts = np.zeros(nmotifs, dtype=np.int64)
+        motif_indices = np.zeros(nmotifs, dtype=np.int64)
+
+        position = 1
+        for iv in range(nmotifs):
+            counts[iv] = values[position]
+            starts[iv] = position + 1
+            position += counts[iv] + 1
+            motif_indices[iv] = values[position]
+            position += 1
+
+        nodes = GatherRanges(values, starts, counts)
+
+        return MotifArrays(counts, nodes, motif_indices)
+
+    assert (values[0] == MOTIF_FILE_VERSION)
+    nmotifs = int(values[1])
+    nnodes = int(values[2])
+
+    position = 3
+    counts = values[position:position + nmotifs]
+    position += nmotifs
+    # the offsets are recomputed from the counts
+    position += nmotifs + 1
+    motif_indices = values[position:position + nmotifs]
+    position += nmotifs
+    nodes = values[position:position + nnodes]
+
+    return MotifArrays(counts, nodes, motif_indices)
+
+
+
+def ReadMotifArrays(motif_filename):
+    """
+    Read the motifs in this file in array form with a single read.
+    @params motif_filename: the file that contains the motifs
+    """
+    if not os.path.exists(motif_filename): return MotifArrays([], [], [])
+
+    return ParseMotifArrays(np.fromfile(motif_filename, dtype=np.int64))
+
+
+
+def MotifArraysValues(arrays):
+    """
+    Returns the 8-byte integers that represent these motifs on disk.
+    @params arrays: the MotifArrays object to convert
+    """
+    header = np.array([MOTIF_FILE_VERSION, arrays.NMotifs(), arrays.nodes.size], dtype=np.int64)
+
+    return np.concatenate((header, arrays.counts, arrays.offsets, arrays.motif_indices, arrays.nodes))
+
+
+
+def WriteMotifArrays(motif_filename, arrays):
+    """
+    Write motifs in array form with a single write.
+    @params motif_filename: the file to store the motifs
+    @params arrays: the MotifArrays object to save to disk
+    """
+    MotifArraysValues(arrays).tofile(motif_filename)
+
+
+
+def WriteTraceMotifs(dataset, base_id, suffix, motifs):
+    """
+    Write the motifs for this trace to its motif file. An open store is told
+    so that its block does not shadow the new file.
+    @params dataset: the tracing utility that created these motifs
+    @params base_id: the unique identifier of the trace
+    @params suffix: the motif method that created these motifs
+    @params motifs: a list of motif objects or a MotifArrays object to save to disk
+    """
+    WriteMotifs(MotifFilename(dataset, base_id, suffix), motifs)
+
+    NoteMotifFileWritten(dataset, base_id, suffix)
+
+
+
+def MotifsExist(dataset, base_id, suffix):
+    """
+    Returns True if motifs for this trace are on disk as a file or in the store.
+    @params dataset: the tracing utility that created these motifs
+    @params base_id: the unique identifier of the trace
+    @params suffix: the motif method that created these motifs
+    """
+    store = OpenMotifStore(dataset, suffix)
+    if not store == None and store.Contains(base_id): return True
+
+    return os.path.exists(MotifFilename(dataset, base_id, suffix))
+
+
+
+def MotifSourceSignature(dataset, base_id, suffix):
+    """
+    Returns the (size in bytes, modification time in ns) of the motifs for
+    this trace. Regenerated motifs get a new signature.
+    @params dataset: the tracing utility that created these motifs
+    @params base_id: the unique identifier of the trace
+    @params suffix: the motif method that created these motifs
+    """
+    motif_filename = MotifFilename(dataset, base_id, suffix)
+    if os.path.exists(motif_filename):
+        stat = os.stat(motif_filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    # consolidated blocks keep the size and time of the file they came from
+    store = OpenMotifStore(dataset, suffix)
+    if not store == None and store.Contains(base_id):
+        return (8 * store.blocks[base_id][1], store.source_mtimes[base_id])
+
+    return (0, 0)
+
+
+
+def ReadTraceMotifArrays(dataset, base_id, suffix):
+    """
+    Read the motifs for this trace in array form. The per-trace motif file is
+    only read when the store has no block for the trace or the file is newer
+    than the block.
+    @params dataset: the tracing utility that created these motifs
+    @params base_id: the unique identifier of the trace
+    @params suffix: the motif method that created these motifs
+    """
+    store = OpenMotifStore(dataset, suffix)
+
+    if store == None or not store.Contains(base_id) or store.FileIsNewer(base_id):
+        return ReadMotifArrays(MotifFilename(dataset, base_id, suffix))
+    else:
+        return ParseMotifArrays(store.Lookup(base_id))
+
+
+
+def ReadMotifs(dataset, trace, suffix, arrays=False):
+    """
+    Read this motif file for this dataset and trace.
+    @params dataset: the tracing utility that created these motifs
+    @params trace: the trace that contains all of the motifs
+    @params suffix: the motif method that created these motifs
+    @params arrays: return a MotifArrays object instead of a list of motifs
+    """
+    motif_arrays = ReadTraceMotifArrays(dataset, trace.base_id, suffix)
+
+    if arrays: return motif_arrays
+    else: return MotifsFromMotifArrays(trace, motif_arrays)
+
+
+
 def WriteMotifs(filename, motifs):
     """
     Write all of the found motifs for this trace to file.
     @params filename: the file to store the motifs
-    @params motifs: a list of motif objects to save to disk
-    """
-    with open(filename, 'wb') as fd:
-        nmotifs = len(motifs)
-        fd.write(struct.pack('q', nmotifs))
-        for motif in motifs:
-            nnodes = len(motif.nodes)
-            fd.write(struct.pack('q', nnodes))
-            for node in motif.nodes:
-                fd.write(struct.pack('q', node.index))
-            fd.write(struct.pack('q', motif.motif_index))
+    @params motifs: a list of motif objects or a MotifArrays object to save to disk
+    """
+    if not isinstance(motifs, MotifArrays):
+        motifs = MotifArraysFromMotifs(motifs)
+
+    WriteMotifArrays(filename, motifs)
+
+
+
+def ConsolidateMotifs(dataset, suffix, remove_files=False):
+    """
+    Append the motif files for every trace of this dataset/suffix to the
+    consolidated store. Only files that are newer than their block (or have
+    no block) are appended. Replaced blocks stay in the data file until
+    CompactMotifStore is run.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    @params remove_files: delete the motif files after they are stored
+    """
+    # start statistics
+    start_time = time.time()
+
+    # stores without modification times are rewritten once before appending
+    store = MotifStore(dataset, suffix)
+    if store.Legacy():
+        CompactMotifStore(dataset, suffix)
+        store = MotifStore(dataset, suffix)
+
+    motif_filenames = sorted(glob.glob(MotifFilename(dataset, '*', suffix)))
+    nappended = 0
+    for motif_filename in motif_filenames:
+        _, base_id, _ = ParseMotifFilename(motif_filename)
+
+        if not store.Contains(base_id) or store.FileIsNewer(base_id):
+            # always store the array layout even for older files
+            source_mtime = os.stat(motif_filename).st_mtime_ns
+            store.Append(base_id, MotifArraysValues(ReadMotifArrays(motif_filename)), source_mtime)
+            nappended += 1
+
+        if remove_files: os.remove(motif_filename)
+
+    # the next open reads the new blocks
+    open_motif_stores.pop((dataset, suffix), None)
+
+    # print statistics
+    print ('Consolidated {} of {} motif files for {} ({}) in {:0.2f} seconds.'.format(nappended, len(motif_filenames), dataset, suffix, time.time() - start_time))
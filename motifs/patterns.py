@@ -0,0 +1,124 @@
+import heapq
+
+
+
+from network_motifs.motifs.motif import SubGraph
+
+
+
+def PatternFilename(dataset, request_type, collapsed, fuzzy):
+    """
+    Returns the filename of the GASTON patterns for this dataset/request type.
+    @params dataset: the dataset that was mined for frequent sub graphs
+    @params request_type: the request type for this set of traces
+    @params collapsed: were the sequences collapsed before mining
+    @params fuzzy: were the collapsed sequences fuzzy
+    """
+    if not collapsed: return 'motifs/patterns/{}/{}-gaston-patterns.txt'.format(dataset, request_type)
+    elif fuzzy: return 'motifs/patterns/{}/{}-fuzzy-collapsed-gaston-patterns.txt'.format(dataset, request_type)
+    else: return 'motifs/patterns/{}/{}-collapsed-gaston-patterns.txt'.format(dataset, request_type)
+
+
+
+def PatternSubGraph(vertices, edges, support, index):
+    """
+    Returns the SubGraph for one parsed pattern with its canonical form.
+    @params vertices: a list of (vertex_id, vertex_label) tuples
+    @params edges: a list of (source_index, destination_index) tuples
+    @params support: the number of graphs that contain this pattern
+    @params index: the position of this pattern in the pattern file
+    """
+    subgraph = SubGraph(vertices, edges, support, index)
+    subgraph.CanonicalForm()
+
+    return subgraph
+
+
+
+def ParseGastonPatterns(pattern_filename):
+    """
+    Lazily yield every pattern in a GASTON output file one at a time. Each
+    pattern starts with a '# <support>' line followed by its vertices and edges.
+    Patterns come with their support, size and canonical form. Patterns
+    without any edges are skipped and do not receive an index.
+    @params pattern_filename: the GASTON output file to parse
+    """
+    # the position of the next pattern in the file
+    index = 0
+
+    # keep track of the current pattern
+    support = 0
+    vertices = []
+    edges = []
+
+    with open(pattern_filename, 'r') as fd:
+        for line in fd:
+            # this indicates the start of a new subgraph
+            if line[0] == '#':
+                if len(vertices) and len(edges):
+                    yield PatternSubGraph(vertices, edges, support, index)
+                    index += 1
+
+                # reset the vertices and edges arrays
+                support = int(line[1:].strip())
+                vertices = []
+                edges = []
+            # skip the subgraph counter
+            elif line[0] == 't': continue
+            # add this vertex to the list of vertices
+            elif line[0] == 'v':
+                _, vertex_id, vertex_label = line.split()
+                vertices.append((int(vertex_id), int(vertex_label)))
+            # add this edge to the list of edges
+            elif line[0] == 'e':
+                _, source_index, destination_index, _ = line.split()
+                edges.append((int(source_index), int(destination_index)))
+
+    # the final pattern is not followed by another '#' line
+    if len(vertices) and len(edges):
+        yield PatternSubGraph(vertices, edges, support, index)
+
+
+
+def ReadGastonPatterns(pattern_filename, minimum_support=0, minimum_size=0):
+    """
+    Lazily yield the patterns in a GASTON output file that are frequent and
+    large enough. Patterns keep their index in the file so motif indices do
+    not change when filtering.
+    @params pattern_filename: the GASTON output file to parse
+    @params minimum_support: skip patterns that occur in fewer graphs
+    @params minimum_size: skip patterns with fewer vertices
+    """
+    for subgraph in ParseGastonPatterns(pattern_filename):
+        if subgraph.support < minimum_support: continue
+        if subgraph.size() < minimum_size: continue
+
+        yield subgraph
+
+
+
+def PatternUsefulness(subgraph):
+    """
+    Returns how useful this pattern is for explaining the traces. Patterns that
+    are both large and frequent cover the most nodes across the dataset.
+    @params subgraph: the pattern to score
+    """
+    return subgraph.support * subgraph.size()
+
+
+
+def ReadTopPatterns(pattern_filename, npatterns, minimum_support=0, minimum_size=0):
+    """
+    Returns the npatterns most useful patterns in file order. Only npatterns
+    patterns are kept in memory at any time.
+    @params pattern_filename: the GASTON output file to parse
+    @params npatterns: the number of patterns to keep
+    @params minimum_support: skip patterns that occur in fewer graphs
+    @params minimum_size: skip patterns with fewer vertices
+    """
+    patterns = ReadGastonPatterns(pattern_filename, minimum_support, minimum_size)
+
+    # ties are broken in favor of patterns earlier in the file
+    top_patterns = heapq.nlargest(npatterns, patterns, key=lambda x: (PatternUsefulness(x), -x.index))
+
+    return sorted(top_patterns, key=lambda x: x.index)
@@ -1,60 +1,392 @@
 import time
+import multiprocessing
 
 
 
-from network_motifs.motifs.motif import ReadMotifs, WriteMotifs
-from network_motifs.utilities.dataIO import ReadTraces
+import numpy as np
 
 
 
-def PruneMotifs(dataset, suffix):
+from network_motifs.motifs.inverted import ReadInvertedIndex, UpdateInvertedIndex
+from network_motifs.motifs.motif import ReadTraceMotifArrays, WriteTraceMotifs
+from network_motifs.utilities.dataIO import ReadTrace, ReadTraceIndex, TraceFilename
+
+
+
+def PriorityOrder(arrays, minimum_timestamps):
+    """
+    Returns the positions of the motifs sorted by size and start timestamp.
+    Larger motifs come first and the order is stable for equal motifs.
+    @params arrays: the MotifArrays object for this trace
+    @params minimum_timestamps: the start timestamp of every motif
+    """
+    return np.lexsort((np.arange(arrays.NMotifs()), minimum_timestamps, -arrays.counts))
+
+
+
+def SelectMotifsGreedy(arrays, minimum_timestamps, nnodes):
+    """
+    Greedily select motifs so that each node belongs to at most one motif.
+    Larger motifs come first and ties go to the motif that starts earlier.
+    Returns the positions of the selected motifs in selection order.
+    @params arrays: the MotifArrays object for this trace
+    @params minimum_timestamps: the start timestamp of every motif
+    @params nnodes: the number of nodes in the trace
+    """
+    order = PriorityOrder(arrays, minimum_timestamps)
+
+    # all nodes start as uncovered
+    nodes_covered = bytearray(nnodes)
+
+    nodes = arrays.nodes.tolist()
+    offsets = arrays.offsets.tolist()
+
+    selected_motifs = []
+    for iv in order.tolist():
+        motif_nodes = nodes[offsets[iv]:offsets[iv + 1]]
+
+        # if any node belongs to another motif remove this one
+        if any(nodes_covered[node] for node in motif_nodes): continue
+
+        # all the nodes in this motif are now covered
+        for node in motif_nodes:
+            nodes_covered[node] = 1
+
+        selected_motifs.append(iv)
+
+    return np.array(selected_motifs, dtype=np.int64)
+
+
+
+
+def SelectMotifsInterval(arrays, starts, ends):
+    """
+    Select the non-overlapping motifs that cover the most nodes when every
+    motif covers a contiguous range of node ranks. This is weighted interval
+    scheduling, solved exactly with dynamic programming.
+    Returns the positions of the selected motifs.
+    @params arrays: the MotifArrays object for this trace
+    @params starts: the first node rank of every motif
+    @params ends: the last node rank of every motif
+    """
+    nmotifs = arrays.NMotifs()
+
+    # sort the intervals by their end and find the last compatible interval
+    by_end = np.argsort(ends, kind='stable')
+    sorted_ends = ends[by_end]
+    compatible = np.searchsorted(sorted_ends, starts[by_end], side='left').tolist()
+    weights = arrays.counts[by_end].tolist()
+
+    # best[j] is the most nodes covered with the first j intervals
+    best = [0] * (nmotifs + 1)
+    for j in range(nmotifs):
+        best[j + 1] = max(best[j], weights[j] + best[compatible[j]])
+
+    selected_motifs = []
+    j = nmotifs
+    while j > 0:
+        if weights[j - 1] + best[compatible[j - 1]] > best[j - 1]:
+            selected_motifs.append(by_end[j - 1])
+            j = compatible[j - 1]
+        else:
+            j -= 1
+
+    return np.array(selected_motifs, dtype=np.int64)
+
+
+
+def ImproveSelection(arrays, order, selected_motifs, nnodes, deadline):
+    """
+    Improve a selection of non-overlapping motifs with local search. A motif
+    replaces the motifs it overlaps if it covers more nodes than they do.
+    Every accepted move increases the coverage so the search terminates. It
+    also stops once the deadline passes.
+    Returns the positions of the selected motifs.
+    @params arrays: the MotifArrays object for this trace
+    @params order: the positions of the motifs in the order to consider them
+    @params selected_motifs: the starting selection
+    @params nnodes: the number of nodes in the trace
+    @params deadline: the time at which to return the current selection
+    """
+    nodes = arrays.nodes.tolist()
+    offsets = arrays.offsets.tolist()
+    counts = arrays.counts.tolist()
+
+    # the selected motif that covers each node
+    owners = [-1] * nnodes
+    selected = set()
+    for iv in selected_motifs.tolist():
+        for node in nodes[offsets[iv]:offsets[iv + 1]]:
+            owners[node] = iv
+        selected.add(iv)
+
+    improved = True
+    while improved:
+        improved = False
+        for iv in order.tolist():
+            if iv in selected: continue
+            if time.time() > deadline: return np.array(sorted(selected), dtype=np.int64)
+
+            motif_nodes = nodes[offsets[iv]:offsets[iv + 1]]
+            conflicts = set(owners[node] for node in motif_nodes if owners[node] >= 0)
+
+            # only swap if more nodes are covered afterwards
+            if counts[iv] <= sum(counts[conflict] for conflict in conflicts): continue
+
+            for conflict in conflicts:
+                for node in nodes[offsets[conflict]:offsets[conflict + 1]]:
+                    owners[node] = -1
+                selected.remove(conflict)
+            for node in motif_nodes:
+                owners[node] = iv
+            selected.add(iv)
+
+            improved = True
+
+    return np.array(sorted(selected), dtype=np.int64)
+
+
+
+def SelectMotifsWeighted(arrays, minimum_timestamps, timestamps, time_budget):
+    """
+    Select non-overlapping motifs to maximize the number of covered nodes.
+    If every motif covers consecutive nodes in time the selection is exact.
+    Otherwise the greedy selection is improved with local search until the
+    time budget runs out.
+    Returns the positions of the selected motifs in greedy priority order.
+    @params arrays: the MotifArrays object for this trace
+    @params minimum_timestamps: the start timestamp of every motif
+    @params timestamps: the timestamp of every node in the trace (by node index)
+    @params time_budget: the maximum number of seconds for the local search
+    """
+    deadline = time.time() + time_budget
+
+    nnodes = timestamps.size
+    order = PriorityOrder(arrays, minimum_timestamps)
+    if not arrays.NMotifs(): return order
+
+    # rank the nodes the same way as the ordered nodes of the trace
+    ranks = np.empty(nnodes, dtype=np.int64)
+    ranks[np.lexsort((np.arange(nnodes), timestamps))] = np.arange(nnodes)
+
+    node_ranks = ranks[arrays.nodes]
+    starts = np.minimum.reduceat(node_ranks, arrays.offsets[:-1])
+    ends = np.maximum.reduceat(node_ranks, arrays.offsets[:-1])
+
+    # motifs that span exactly their own nodes are intervals over the ranks
+    if np.all(ends - starts + 1 == arrays.counts):
+        selected_motifs = SelectMotifsInterval(arrays, starts, ends)
+    else:
+        selected_motifs = SelectMotifsGreedy(arrays, minimum_timestamps, nnodes)
+        selected_motifs = ImproveSelection(arrays, order, selected_motifs, nnodes, deadline)
+
+    # return the selection in the same order as the greedy method
+    priorities = np.empty(arrays.NMotifs(), dtype=np.int64)
+    priorities[order] = np.arange(arrays.NMotifs())
+
+    return selected_motifs[np.argsort(priorities[selected_motifs])]
+
+
+
+def NodeTimestamps(dataset, base_id, node_timestamps=None):
+    """
+    Returns the timestamp of every node in this trace by node index.
+    @params dataset: the dataset that contains this trace
+    @params base_id: the unique identifier of the trace
+    @params node_timestamps: dictionary that caches node timestamps read from traces (optional)
+    """
+    if not node_timestamps == None and base_id in node_timestamps:
+        return node_timestamps[base_id]
+
+    trace = ReadTrace(dataset, TraceFilename(dataset, base_id))
+    timestamps = np.array([node.timestamp for node in trace.nodes], dtype=np.int64)
+    if not node_timestamps == None: node_timestamps[base_id] = timestamps
+
+    return timestamps
+
+
+def MotifTimestamps(dataset, base_id, arrays, trace_timestamps, node_timestamps=None):
+    """
+    Returns the minimum and maximum timestamp of every motif in this trace.
+    Uses the inverted index when its entries match the motif file on disk
+    (trace_timestamps only has those traces) and the trace otherwise.
+    @params dataset: the dataset that contains this trace
+    @params base_id: the unique identifier of the trace
+    @params arrays: the MotifArrays object for this trace
+    @params trace_timestamps: the output of InvertedIndex.TraceTimestamps (or None)
+    @params node_timestamps: dictionary that caches node timestamps read from traces (optional)
+    """
+    if not trace_timestamps == None and base_id in trace_timestamps:
+        minimum_timestamps, maximum_timestamps = trace_timestamps[base_id]
+        if minimum_timestamps.size == arrays.NMotifs():
+            return minimum_timestamps, maximum_timestamps
+
+    return arrays.TimestampExtremes(NodeTimestamps(dataset, base_id, node_timestamps))
+
+
+
+def PruneTrace(dataset, base_id, suffix, nnodes, trace_timestamps, node_timestamps=None, method='greedy', time_budget=1.0):
+    """
+    Prune the motifs of one trace and save them with the pruned suffix.
+    Returns the number of motifs before pruning and the inverted index entries
+    for the pruned motifs.
+    @params dataset: the dataset that contains this trace
+    @params base_id: the unique identifier of the trace
+    @params suffix: the motif method that created these motifs
+    @params nnodes: the number of nodes in the trace
+    @params trace_timestamps: the output of InvertedIndex.TraceTimestamps (or None)
+    @params node_timestamps: dictionary that caches node timestamps read from traces (optional)
+    @params method: greedy or weighted selection of the non-overlapping motifs
+    @params time_budget: the maximum number of seconds for weighted selection
+    """
+    # read the motifs for this trace dataset
+    arrays = ReadTraceMotifArrays(dataset, base_id, suffix)
+    minimum_timestamps, maximum_timestamps = MotifTimestamps(dataset, base_id, arrays, trace_timestamps, node_timestamps)
+
+    if method == 'greedy':
+        selected_motifs = SelectMotifsGreedy(arrays, minimum_timestamps, nnodes)
+    elif method == 'weighted':
+        # weighted selection needs the order of the nodes in the trace
+        timestamps = NodeTimestamps(dataset, base_id, node_timestamps)
+        selected_motifs = SelectMotifsWeighted(arrays, minimum_timestamps, timestamps, time_budget)
+    else: assert (False)
+    pruned_motifs = arrays.Subset(selected_motifs)
+
+    # save the motifs as pruned
+    WriteTraceMotifs(dataset, base_id, suffix.replace('complete', 'pruned'), pruned_motifs)
+
+    # index the pruned motifs as a byproduct of pruning
+    occurrences = np.arange(pruned_motifs.NMotifs(), dtype=np.int64)
+    trace_occurrences = (pruned_motifs.motif_indices, occurrences, minimum_timestamps[selected_motifs], maximum_timestamps[selected_motifs])
+
+    return arrays.NMotifs(), trace_occurrences
+
+
+
+def PruneMotifs(dataset, suffix, method='greedy', time_budget=1.0):
     """
     Prune all the motifs in this dataset so that each node can belong to at
     most one motif. Motifs with earlier start indices and larger spans are
-    prioritized.
+    prioritized. The weighted method instead maximizes the covered nodes.
+    @params dataset: the dataset that contains all of the traces
+    @params suffix: the motif method that created these motifs
+    @params method: greedy or weighted selection of the non-overlapping motifs
+    @params time_budget: the maximum number of seconds per trace for weighted selection
     """
     # start statistics
     start_time = time.time()
 
-    # read all of the traces for this dataset
-    traces = ReadTraces(dataset, None, None)
+    # only the number of nodes is needed from every trace
+    trace_index = ReadTraceIndex(dataset)
+
+    # the start of every motif comes from the inverted index if it exists
+    index = ReadInvertedIndex(dataset, suffix)
+    if index == None: trace_timestamps = None
+    else: trace_timestamps = index.TraceTimestamps(dataset, suffix)
+
+    # index the pruned motifs for every trace
+    trace_occurrences = {}
+    output_suffix = suffix.replace('complete', 'pruned')
 
     # iterate over all traces
-    for trace in traces:
-        # read the motifs for this trace dataset
-        motifs = ReadMotifs(dataset, trace, suffix)
+    for base_id, entry in trace_index.items():
+        _, trace_occurrences[base_id] = PruneTrace(dataset, base_id, suffix, entry.nnodes, trace_timestamps, method=method, time_budget=time_budget)
+
+    UpdateInvertedIndex(dataset, output_suffix, trace_occurrences)
+
+    # print statistics
+    print ('Pruned motifs for {} in {:0.2f} seconds.'.format(dataset, time.time() - start_time))
+
+
+
+# the motif methods that produce exhaustive motifs to prune
+complete_suffixes = ['complete', 'collapsed-complete', 'fuzzy-collapsed-complete']
+
+
+
+def PruneTraceMotifs(arguments):
+    """
+    Prune the motifs of every suffix for one trace. Runs in a worker process.
+    Returns the base id, and per suffix the number of motifs before and after
+    pruning, the time spent, and the inverted index entries of the output.
+    @params arguments: tuple of (dataset, base_id, nnodes, timestamps per suffix, method, time budget)
+    """
+    dataset, base_id, nnodes, timestamps_per_suffix, method, time_budget = arguments
+
+    # the trace is read at most once across all suffixes
+    node_timestamps = {}
+
+    results = {}
+    for suffix in complete_suffixes:
+        # start statistics
+        start_time = time.time()
+
+        nmotifs, trace_occurrences = PruneTrace(dataset, base_id, suffix, nnodes, timestamps_per_suffix[suffix], node_timestamps, method, time_budget)
+
+        results[suffix] = (nmotifs, trace_occurrences[0].size, time.time() - start_time, trace_occurrences)
+
+    return base_id, results
 
-        pruned_motifs = []
 
-        # all nodes start as uncovered
-        nnodes = len(trace.nodes)
-        nodes_covered = [False for _ in range(nnodes)]
 
-        # sort the motifs by size and start timestamp
-        motifs = sorted(motifs, reverse=True)
+def PruneAllMotifs(dataset, nprocesses=None, method='greedy', time_budget=1.0):
+    """
+    Prune the motifs of every complete suffix for all traces in one pass over
+    a process pool. Each trace is handled by one worker that prunes all of its
+    suffixes.
+    @params dataset: the dataset that contains all of the traces
+    @params nprocesses: the number of worker processes (None for all cores)
+    @params method: greedy or weighted selection of the non-overlapping motifs
+    @params time_budget: the maximum number of seconds per trace and suffix for weighted selection
+    """
+    # start statistics
+    start_time = time.time()
+
+    # read the metadata for every trace once
+    trace_index = ReadTraceIndex(dataset)
 
-        # go through the motifs to identify valid ones
-        for motif in motifs:
-            prune_this_motif = False
-            for node in motif.nodes:
-                # if this node belongs to another motif remove it
-                if nodes_covered[node.index]:
-                    prune_this_motif = True
-                    break
-            if prune_this_motif: continue
+    # the start of every motif comes from the inverted indices if they exist
+    timestamps_per_suffix = {}
+    for suffix in complete_suffixes:
+        index = ReadInvertedIndex(dataset, suffix)
+        if index == None: timestamps_per_suffix[suffix] = None
+        else: timestamps_per_suffix[suffix] = index.TraceTimestamps(dataset, suffix)
 
-            # all the nodes in this motif are now covered
-            for node in motif.nodes:
-                nodes_covered[node.index] = True
+    arguments = []
+    for base_id, entry in trace_index.items():
+        trace_timestamps = {}
+        for suffix in complete_suffixes:
+            # only send the timestamps for this trace to the worker
+            if timestamps_per_suffix[suffix] == None or not base_id in timestamps_per_suffix[suffix]:
+                trace_timestamps[suffix] = None
+            else:
+                trace_timestamps[suffix] = { base_id: timestamps_per_suffix[suffix][base_id] }
+        arguments.append((dataset, base_id, entry.nnodes, trace_timestamps, method, time_budget))
 
-            # add the motif to the list of motifs
-            pruned_motifs.append(motif)
+    # keep track of the totals for each suffix
+    nmotifs = {}
+    npruned_motifs = {}
+    prune_time = {}
+    trace_occurrences = {}
+    for suffix in complete_suffixes:
+        nmotifs[suffix] = 0
+        npruned_motifs[suffix] = 0
+        prune_time[suffix] = 0.0
+        trace_occurrences[suffix] = {}
 
-        # save the motifs as pruned
-        output_suffix = suffix.replace('complete', 'pruned')
-        output_filename = 'motifs/subgraphs/{}/{}-motifs-{}.motifs'.format(dataset, trace.base_id, output_suffix)
+    with multiprocessing.Pool(nprocesses) as pool:
+        for base_id, results in pool.imap_unordered(PruneTraceMotifs, arguments, chunksize=16):
+            for suffix in complete_suffixes:
+                nmotifs[suffix] += results[suffix][0]
+                npruned_motifs[suffix] += results[suffix][1]
+                prune_time[suffix] += results[suffix][2]
+                trace_occurrences[suffix][base_id] = results[suffix][3]
 
-        WriteMotifs(output_filename, pruned_motifs)
+    # index the pruned motifs as a byproduct of pruning
+    for suffix in complete_suffixes:
+        UpdateInvertedIndex(dataset, suffix.replace('complete', 'pruned'), trace_occurrences[suffix])
 
     # print statistics
-    print ('Pruned motifs for {} in {:0.2f} seconds.'.format(dataset, time.time() - start_time))
+    print ('Pruned motifs for {} traces in {} in {:0.2f} seconds.'.format(len(arguments), dataset, time.time() - start_time))
+    for suffix in complete_suffixes:
+        print ('  {}: {} of {} motifs kept ({:0.2f} seconds of worker time)'.format(suffix, npruned_motifs[suffix], nmotifs[suffix], prune_time[suffix]))
@@ -1,5 +1,7 @@
 import os
 import time
+import signal
+import multiprocessing
 
 
 
@@ -8,65 +10,335 @@ import graph_tool.all as gt
 
 
 from network_motifs.transforms.convert import ConvertTrace2GraphTool, ConvertSubGraph2GraphTool, ConvertCollapsedGraph2GraphTool
-from network_motifs.motifs.motif import Motif, SubGraph, WriteMotifs
+from network_motifs.motifs.budget import QUERY_COMPLETE, QUERY_MAX_EMBEDDINGS, QUERY_MAX_MEMORY, QUERY_NO_PROGRESS, QueryBudget, QueryLimitRecord, WriteQueryLimitReport
+from network_motifs.motifs.cache import QueryCache, PatternHash, PatternSetHash, ReadQueryCache, TraceHash, WriteQueryCache
+from network_motifs.motifs.inverted import ReadInvertedIndex, TraceOccurrences, UpdateInvertedIndex
+from network_motifs.motifs.motif import Motif, MotifsExist, ReadMotifs, WriteTraceMotifs
+from network_motifs.motifs.patterns import PatternFilename, ReadGastonPatterns, ReadTopPatterns
 from network_motifs.utilities.dataIO import ReadTraces
 
 
 
-def IdentifyFrequentSubgraphs(dataset, request_type, collapsed, fuzzy):
+# the maximum number of embeddings per message from a search worker
+embedding_batch_size = 1024
+
+
+
+def IdentifyFrequentSubgraphs(dataset, request_type, collapsed, fuzzy, minimum_support=0, minimum_size=0, npatterns=None):
     """
     Populate an array of frequent subgraphs found using the GASTON algorithm.
     @params dataset: the dataset to mine for frequent sub graphs
     @params request_type: the request type for this set of traces
+    @params collapsed: were the sequences collapsed before mining
+    @params fuzzy: were the collapsed sequences fuzzy
+    @params minimum_support: skip patterns that occur in fewer graphs
+    @params minimum_size: skip patterns with fewer vertices
+    @params npatterns: only keep this many of the most useful patterns (None for all)
     """
-    # create a list of subgraphs to mine for
-    subgraphs = []
-
     # read the subgraphs generated from GASTON
-    if not collapsed: subgraph_filename = 'motifs/patterns/{}/{}-gaston-patterns.txt'.format(dataset, request_type)
-    elif fuzzy: subgraph_filename = 'motifs/patterns/{}/{}-fuzzy-collapsed-gaston-patterns.txt'.format(dataset, request_type)
-    else: subgraph_filename = 'motifs/patterns/{}/{}-collapsed-gaston-patterns.txt'.format(dataset, request_type)
-
-    with open(subgraph_filename, 'r') as fd:
-        # read all of the lines in the file
-        lines = fd.readlines()
-
-        # keep track of vertices and edges for each subgraph
-        vertices = []
-        edges = []
-
-        # parse the graph
-        for line in lines:
-            # this indicates the start of a new subgraph
-            if line[0] == '#' and len(vertices) and len(edges):
-                subgraphs.append(SubGraph(vertices, edges))
-                # reset the vertices and edges arrays
-                vertices = []
-                edges = []
-            # skip the subgraph counter
-            elif line[0] == 't': continue
-            # add this vertex to the list of vertices
-            elif line[0] == 'v':
-                _, vertex_id, vertex_label = line.split()
-                vertex_id = int(vertex_id.strip())
-                vertex_label = int(vertex_label.strip())
-                vertices.append((vertex_id, vertex_label))
-            # add this edge to the list of edges
-            elif line[0] == 'e':
-                _, source_index, destination_index, _ = line.split()
-                source_index = int(source_index.strip())
-                destination_index = int(destination_index.strip())
-                edges.append((source_index, destination_index))
-
-    return subgraphs
-
-
-
-def QueryTraces(dataset, request_type):
+    subgraph_filename = PatternFilename(dataset, request_type, collapsed, fuzzy)
+
+    if npatterns == None:
+        return list(ReadGastonPatterns(subgraph_filename, minimum_support, minimum_size))
+    else:
+        return ReadTopPatterns(subgraph_filename, npatterns, minimum_support, minimum_size)
+
+
+
+def EnumerateEmbeddings(motif, graph, max_n=0, nskip=0):
+    """
+    Yields the graph vertices of every embedding of the motif as a list. The
+    order is the same every time for the same motif and graph.
+    @params motif: the graph tool version of the pattern
+    @params graph: the graph tool object to search for motifs
+    @params max_n: stop after this many embeddings including skipped ones (0 for all)
+    @params nskip: skip the first nskip embeddings (found by an earlier call)
+    """
+    vertex_maps = gt.subgraph_isomorphism(motif, graph, max_n=max_n, vertex_label=(motif.vp.label, graph.vp.label), generator=True)
+
+    for iv, vertex_map in enumerate(vertex_maps):
+        if iv < nskip: continue
+        yield list(vertex_map)
+
+
+
+def SendEmbeddings(connection, motif, graph, max_n, nskip):
+    """
+    Send the embeddings of the motif in batches followed by None. When
+    embeddings are skipped, the number skipped is sent once they are passed.
+    Runs in a worker process so that the search can be stopped at any time.
+    @params connection: the pipe to the parent process
+    @params motif: the graph tool version of the pattern
+    @params graph: the graph tool object to search for motifs
+    @params max_n: stop after this many embeddings including skipped ones (0 for all)
+    @params nskip: skip the first nskip embeddings (found by an earlier call)
+    """
+    vertex_maps = gt.subgraph_isomorphism(motif, graph, max_n=max_n, vertex_label=(motif.vp.label, graph.vp.label), generator=True)
+
+    batch = []
+    send_time = time.time()
+    for iv, vertex_map in enumerate(vertex_maps):
+        if iv < nskip:
+            # the parent starts the clock for this call once the earlier embeddings are passed
+            if iv == nskip - 1: connection.send(nskip)
+            continue
+
+        batch.append(list(vertex_map))
+
+        # send often enough that a limit keeps most of the found embeddings
+        if len(batch) == embedding_batch_size or time.time() - send_time > 0.05:
+            connection.send(batch)
+            batch = []
+            send_time = time.time()
+
+    connection.send(batch)
+    connection.send(None)
+    connection.close()
+
+
+
+def BoundedEmbeddings(motif, graph, budget, nskip=0):
+    """
+    Returns the embeddings of the motif found within the budget and which limit
+    (if any) was reached. The search runs in a forked worker that is stopped
+    as soon as the time or memory limit is reached, even if it has not found
+    any embedding yet. Skipping the embeddings of an earlier call has its own
+    allowance of max_seconds and the clock starts again once they are passed.
+    The worker looks for one embedding more than the limit so that a search
+    with exactly max_embeddings results is complete.
+    @params motif: the graph tool version of the pattern
+    @params graph: the graph tool object to search for motifs
+    @params budget: the QueryBudget for this call (already started)
+    @params nskip: skip the first nskip embeddings (found by an earlier call)
+    """
+    if budget.max_embeddings == None: max_n = 0
+    else: max_n = nskip + budget.max_embeddings + 1
+
+    # forked workers share the graphs without pickling them
+    context = multiprocessing.get_context('fork')
+    connection, worker_connection = context.Pipe(duplex=False)
+    worker = context.Process(target=SendEmbeddings, args=(worker_connection, motif, graph, max_n, nskip), daemon=True)
+    worker.start()
+    worker_connection.close()
+
+    embeddings = []
+
+    def Receive(message):
+        # returns True once the worker finished the search
+        if message == None: return True
+
+        if isinstance(message, int): budget.Start()
+        else: embeddings.extend(message)
+
+        return False
+
+    finished = False
+    status = QUERY_COMPLETE
+    while not finished:
+        status = budget.Status(len(embeddings), worker.pid)
+        if not status == QUERY_COMPLETE: break
+
+        if not connection.poll(budget.PollTimeout()): continue
+
+        try:
+            finished = Receive(connection.recv())
+        except EOFError:
+            # the kernel kills workers that run out of memory
+            worker.join()
+            if worker.exitcode == -signal.SIGKILL:
+                status = QUERY_MAX_MEMORY
+                break
+            raise RuntimeError('subgraph isomorphism worker exited with code {}'.format(worker.exitcode))
+
+    if worker.is_alive(): worker.terminate()
+    worker.join()
+
+    # the search may have finished just as a limit was reached
+    while not finished and connection.poll(0):
+        try:
+            finished = Receive(connection.recv())
+        # a worker stopped while sending leaves a partial message
+        except (EOFError, OSError):
+            break
+    connection.close()
+
+    if not budget.max_embeddings == None and len(embeddings) > budget.max_embeddings:
+        embeddings = embeddings[:budget.max_embeddings]
+        status = QUERY_MAX_EMBEDDINGS
+    elif finished:
+        status = QUERY_COMPLETE
+
+    return embeddings, status
+
+
+
+def FindMotifs(trace, graph, subgraphs, reduced_nodes_to_nodes=None, budget=None, skip_embeddings=None):
+    """
+    Find all occurrences of each subgraph in the graph tool version of this trace.
+    Returns the motifs and the QueryLimitRecords for patterns that reached a
+    limit of the budget. The motifs found before reaching a limit are kept.
+    @params trace: the trace that corresponds to the graph
+    @params graph: the graph tool object to search for motifs
+    @params subgraphs: the patterns to find in the graph
+    @params reduced_nodes_to_nodes: mapping from collapsed vertices to trace nodes (None if not collapsed)
+    @params budget: the QueryBudget for each subgraph isomorphism call (None for unbounded)
+    @params skip_embeddings: the number of embeddings already found per motif index to continue after
+    """
+    if budget == None: budget = QueryBudget()
+    if skip_embeddings == None: skip_embeddings = {}
+
+    motifs = []
+    records = []
+
+    for subgraph in subgraphs:
+        motif_index = subgraph.index
+        motif = ConvertSubGraph2GraphTool(subgraph)
+        nskip = skip_embeddings.get(motif_index, 0)
+
+        # use graph tool to find all motif occurrences
+        budget.Start()
+        if budget.Unbounded():
+            embeddings = EnumerateEmbeddings(motif, graph, 0, nskip)
+            status = QUERY_COMPLETE
+        else:
+            embeddings, status = BoundedEmbeddings(motif, graph, budget, nskip)
+
+        # go through all of the found motif patterns
+        nembeddings = nskip
+        for vertex_map in embeddings:
+            nodes = []
+            if reduced_nodes_to_nodes == None:
+                for node in vertex_map:
+                    nodes.append(trace.nodes[node])
+            else:
+                # add all of the nodes that belong to each vertex (collapsed nodes)
+                for reduced_node in vertex_map:
+                    for node in reduced_nodes_to_nodes[reduced_node]:
+                        assert (not trace.nodes[node] in nodes)
+                        nodes.append(trace.nodes[node])
+
+            motifs.append(Motif(trace, nodes, motif_index))
+            nembeddings += 1
+
+        # the record counts every embedding kept for this pattern so a resume can continue after them
+        if not status == QUERY_COMPLETE:
+            # resuming again would repeat a call that found nothing new
+            if motif_index in skip_embeddings and nembeddings == nskip: status = QUERY_NO_PROGRESS
+            records.append(QueryLimitRecord(trace.base_id, motif_index, status, nembeddings, budget.ElapsedTime()))
+
+    return motifs, records
+
+
+
+def QueryTrace(dataset, trace, subgraphs, collapsed, fuzzy, budget=None, resume=False):
+    """
+    Find the motifs in this trace and save them to file. Results are cached by
+    the contents of the trace and the hash of every pattern, so only patterns
+    that were not queried before are searched for when the trace is unchanged.
+    Returns the number of patterns that were queried and the QueryLimitRecords
+    for every pattern in this trace that only has partial results.
+    @params dataset: the dataset that contains this trace
+    @params trace: the trace to find the motifs in
+    @params subgraphs: the patterns to find in the trace
+    @params collapsed: search the graph with collapsed node sequences
+    @params fuzzy: can this motif be fuzzy?
+    @params budget: the QueryBudget for each subgraph isomorphism call (None for unbounded)
+    @params resume: continue patterns that previously reached a limit after the embeddings they found
+    """
+    if not collapsed: suffix = 'complete'
+    elif fuzzy: suffix = 'fuzzy-collapsed-complete'
+    else: suffix = 'collapsed-complete'
+
+    trace_hash = TraceHash(trace)
+    pattern_hashes = [PatternHash(subgraph) for subgraph in subgraphs]
+    motif_indices = [subgraph.index for subgraph in subgraphs]
+
+    # results are only reusable if they came from this exact trace
+    cache = ReadQueryCache(dataset, trace.base_id, suffix)
+    if cache == None or not cache.trace_hash == trace_hash or not MotifsExist(dataset, trace.base_id, suffix):
+        cache = QueryCache(trace_hash, [], [])
+
+    pattern_to_motif_index = {}
+    for pattern_hash, motif_index in zip(pattern_hashes, motif_indices):
+        pattern_to_motif_index[pattern_hash] = motif_index
+
+    # partial results are continued when resuming
+    if resume: requery_patterns = cache.TruncatedPatterns()
+    else: requery_patterns = set()
+
+    # nothing to do if this set of patterns was already queried with the same indices
+    if not len(requery_patterns) and cache.PatternSetHash() == PatternSetHash(pattern_hashes) and cache.pattern_to_motif_index == pattern_to_motif_index:
+        return 0, list(cache.limit_records.values())
+
+    # keep previous results for patterns that remain, updating their motif index
+    previous_to_current_index = {}
+    limit_records = {}
+    skip_embeddings = {}
+    for pattern_hash, motif_index in zip(cache.pattern_hashes, cache.motif_indices):
+        if not pattern_hash in pattern_to_motif_index: continue
+
+        previous_to_current_index[motif_index] = pattern_to_motif_index[pattern_hash]
+        # resumed patterns continue after the embeddings they already found
+        if pattern_hash in requery_patterns:
+            skip_embeddings[pattern_to_motif_index[pattern_hash]] = cache.limit_records[pattern_hash].nembeddings
+        # partial results stay partial
+        elif pattern_hash in cache.limit_records:
+            record = cache.limit_records[pattern_hash]
+            record.motif_index = pattern_to_motif_index[pattern_hash]
+            limit_records[pattern_hash] = record
+
+    motifs = []
+    if len(previous_to_current_index):
+        for motif in ReadMotifs(dataset, trace, suffix):
+            if not motif.motif_index in previous_to_current_index: continue
+            motif.motif_index = previous_to_current_index[motif.motif_index]
+            motifs.append(motif)
+
+    # only query the patterns that have not been seen for this trace
+    new_subgraphs = []
+    for pattern_hash, subgraph in zip(pattern_hashes, subgraphs):
+        if pattern_hash in requery_patterns or not pattern_hash in cache.pattern_to_motif_index:
+            new_subgraphs.append(subgraph)
+
+    if len(new_subgraphs):
+        # reduced nodes to nodes is a funciton to go from the reduced node space to the original
+        if not collapsed:
+            graph = ConvertTrace2GraphTool(dataset, trace)
+            reduced_nodes_to_nodes = None
+        else:
+            graph, reduced_nodes_to_nodes = ConvertCollapsedGraph2GraphTool(trace, fuzzy)
+
+        new_motifs, records = FindMotifs(trace, graph, new_subgraphs, reduced_nodes_to_nodes, budget, skip_embeddings)
+        motifs += new_motifs
+
+        # record which patterns have partial results
+        motif_index_to_pattern = {}
+        for pattern_hash, motif_index in zip(pattern_hashes, motif_indices):
+            motif_index_to_pattern[motif_index] = pattern_hash
+        for record in records:
+            limit_records[motif_index_to_pattern[record.motif_index]] = record
+
+    # keep the motifs in the same order as a query from scratch
+    motifs = sorted(motifs, key=lambda x: x.motif_index)
+
+    # write the motifs to disk along with the patterns that created them
+    WriteTraceMotifs(dataset, trace.base_id, suffix, motifs)
+    WriteQueryCache(dataset, trace.base_id, suffix, QueryCache(trace_hash, pattern_hashes, motif_indices, limit_records))
+
+    return len(new_subgraphs), list(limit_records.values())
+
+
+
+def QueryTraces(dataset, request_type, minimum_support=0, minimum_size=0, npatterns=None, budget=None, resume=False):
     """
     Find all occurrences for each motif for this dataset/request_type comboination.
     @params dataset: the dataset to mine for frequent sub graphs
     @params request_type: the request type for this set of traces
+    @params minimum_support: skip patterns that occur in fewer graphs
+    @params minimum_size: skip patterns with fewer vertices
+    @params npatterns: only query this many of the most useful patterns (None for all)
+    @params budget: the QueryBudget for each subgraph isomorphism call (None for unbounded)
+    @params resume: continue patterns that previously reached a limit after the embeddings they found
     """
     # create the directory structure
     if not os.path.exists('motifs'):
@@ -76,54 +348,50 @@ def QueryTraces(dataset, request_type):
     if not os.path.exists('motifs/subgraphs/{}'.format(dataset)):
         os.mkdir('motifs/subgraphs/{}'.format(dataset))
 
-    # start statistics
-    start_time = time.time()
-
     # read the frequent subgraphs for this dataset/request type
-    subgraphs = IdentifyFrequentSubgraphs(dataset, request_type, False, False)
+    subgraphs = IdentifyFrequentSubgraphs(dataset, request_type, False, False, minimum_support, minimum_size, npatterns)
 
     # read all of the traces and mine the graph
     traces = ReadTraces(dataset, request_type, None)
 
+    # keep track of all trace/pattern pairs that reach a limit
+    limit_records = []
+    # index the motifs of every trace as a byproduct of querying
+    trace_occurrences = {}
+    index = ReadInvertedIndex(dataset, 'complete')
+
     for iv, trace in enumerate(traces):
         # start statistics
         start_time = time.time()
 
-        # skip over the file if it already exists
-        output_filename = 'motifs/subgraphs/{}/{}-motifs-complete.motifs'.format(dataset, trace.base_id)
-        if os.path.exists(output_filename): continue
-
-        graph = ConvertTrace2GraphTool(dataset, trace)
-        motifs = []
-
-        for motif_index, subgraph in enumerate(subgraphs):
-            motif = ConvertSubGraph2GraphTool(subgraph)
-
-            # use graph tool to find all motif occurrences
-            vertex_maps = gt.subgraph_isomorphism(motif, graph, vertex_label=(motif.vp.label, graph.vp.label))
-
-            # go through all of the found motif patterns
-            for vertex_map in vertex_maps:
-                nodes = []
-                for node in vertex_map:
-                    nodes.append(trace.nodes[node])
-                motifs.append(Motif(trace, nodes, motif_index))
-
-        # write the motifs to disk
-        WriteMotifs(output_filename, motifs)
+        # skip over the trace if every pattern was already queried
+        npatterns_queried, records = QueryTrace(dataset, trace, subgraphs, False, False, budget, resume)
+        limit_records += records
+        # skipped traces are only read if the index does not have their current motifs
+        if npatterns_queried or index == None or not index.Current(dataset, 'complete', trace.base_id):
+            trace_occurrences[trace.base_id] = TraceOccurrences(trace, ReadMotifs(dataset, trace, 'complete', arrays=True))
+        if not npatterns_queried: continue
 
         # print statistics
-        print ('Mined traces for {} in {:0.2f} seconds.'.format(trace.base_id, time.time() - start_time))
+        print ('Mined {} patterns for {} in {:0.2f} seconds.'.format(npatterns_queried, trace.base_id, time.time() - start_time))
+
+    UpdateInvertedIndex(dataset, 'complete', trace_occurrences)
+    WriteQueryLimitReport(dataset, request_type, 'complete', limit_records)
 
 
 
-def QueryCollapsedGraphs(dataset, request_type, fuzzy):
+def QueryCollapsedGraphs(dataset, request_type, fuzzy, minimum_support=0, minimum_size=0, npatterns=None, budget=None, resume=False):
     """
     Find motifs in the graphs with collapsed node sequences. Saves the motifs to
     file
     @params dataset: dataset to find motifs in the collapsed sequences
     @params request_type: request for this particular set of traces
     @params fuzzy: can this motif be fuzzy?
+    @params minimum_support: skip patterns that occur in fewer graphs
+    @params minimum_size: skip patterns with fewer vertices
+    @params npatterns: only query this many of the most useful patterns (None for all)
+    @params budget: the QueryBudget for each subgraph isomorphism call (None for unbounded)
+    @params resume: continue patterns that previously reached a limit after the embeddings they found
     """
     # create the directory structure
     if not os.path.exists('motifs'):
@@ -133,42 +401,34 @@ def QueryCollapsedGraphs(dataset, request_type, fuzzy):
     if not os.path.exists('motifs/subgraphs/{}'.format(dataset)):
         os.mkdir('motifs/subgraphs/{}'.format(dataset))
 
+    if fuzzy: suffix = 'fuzzy-collapsed-complete'
+    else: suffix = 'collapsed-complete'
+
     # read the frequent subgraphs for this dataset/request type
-    subgraphs = IdentifyFrequentSubgraphs(dataset, request_type, True, fuzzy)
+    subgraphs = IdentifyFrequentSubgraphs(dataset, request_type, True, fuzzy, minimum_support, minimum_size, npatterns)
     # read all of the traces
     traces = ReadTraces(dataset, request_type, None)
 
+    # keep track of all trace/pattern pairs that reach a limit
+    limit_records = []
+    # index the motifs of every trace as a byproduct of querying
+    trace_occurrences = {}
+    index = ReadInvertedIndex(dataset, suffix)
+
     for iv, trace in enumerate(traces):
         # start statistics
         start_time = time.time()
 
-        # write the motifs to disk
-        if fuzzy: output_filename = 'motifs/subgraphs/{}/{}-motifs-fuzzy-collapsed-complete.motifs'.format(dataset, trace.base_id)
-        else: output_filename = 'motifs/subgraphs/{}/{}-motifs-collapsed-complete.motifs'.format(dataset, trace.base_id)
-        if os.path.exists(output_filename): continue
-
-        # reduced nodes to nodes is a funciton to go from the reduced node space to the original
-        graph, reduced_nodes_to_nodes = ConvertCollapsedGraph2GraphTool(trace, fuzzy)
-        motifs = []
-
-        for motif_index, subgraph in enumerate(subgraphs):
-            motif = ConvertSubGraph2GraphTool(subgraph)
-
-            # use graph tool to find all motif occurrences
-            vertex_maps = gt.subgraph_isomorphism(motif, graph, vertex_label=(motif.vp.label, graph.vp.label))
-
-            # go through all of the found motif patterns
-            for vertex_map in vertex_maps:
-                nodes = []
-                # add all of the nodes that belong to each vertex (collapsed nodes)
-                for reduced_node in vertex_map:
-                    for node in reduced_nodes_to_nodes[reduced_node]:
-                        assert (not trace.nodes[node] in nodes)
-                        nodes.append(trace.nodes[node])
-
-                motifs.append(Motif(trace, nodes, motif_index))
-
-        WriteMotifs(output_filename, motifs)
+        # skip over the trace if every pattern was already queried
+        npatterns_queried, records = QueryTrace(dataset, trace, subgraphs, True, fuzzy, budget, resume)
+        limit_records += records
+        # skipped traces are only read if the index does not have their current motifs
+        if npatterns_queried or index == None or not index.Current(dataset, suffix, trace.base_id):
+            trace_occurrences[trace.base_id] = TraceOccurrences(trace, ReadMotifs(dataset, trace, suffix, arrays=True))
+        if not npatterns_queried: continue
 
         # print statistics
-        print ('Mined traces for {} in {:0.2f} seconds.'.format(trace.base_id, time.time() - start_time))
+        print ('Mined {} patterns for {} in {:0.2f} seconds.'.format(npatterns_queried, trace.base_id, time.time() - start_time))
+
+    UpdateInvertedIndex(dataset, suffix, trace_occurrences)
+    WriteQueryLimitReport(dataset, request_type, suffix, limit_records)
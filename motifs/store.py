@@ -0,0 +1,293 @@
+import os
+import time
+import struct
+
+
+
+import numpy as np
+
+
+
+# maximum size for the trace identifiers in the index
+max_base_id_bytes = 64
+
+# first bytes of every index file that records the source modification times
+motif_store_magic = b'MOTIFIDX'
+
+
+
+class MotifStore(object):
+    def __init__(self, dataset, suffix):
+        """
+        Append-friendly store that keeps the motif files of every trace in one
+        contiguous file of 8-byte integers. An index file maps each trace to
+        its block and the modification time of the motif file it came from.
+        Later blocks for the same trace replace earlier ones until the store is
+        compacted. The store and the motif directory are checked once when the
+        store is opened. Per-trace motif files that are newer than their block
+        take precedence.
+        @params dataset: the tracing utility that created these motifs
+        @params suffix: the motif method that created these motifs
+        """
+        self.dataset = dataset
+        self.suffix = suffix
+
+        _, self.index_filename = MotifStoreFilenames(dataset, suffix)
+
+        # map each trace to the (offset, length) of its block in integers
+        self.blocks = {}
+        # map each trace to the modification time (ns) of the file its block came from
+        self.source_mtimes = {}
+        # traces with a motif file that is newer than their block
+        self.newer_files = set()
+        self.generation = None
+        self.data = None
+
+        self.Reload()
+
+    def Reload(self):
+        """
+        Read the index from disk and find the motif files that are newer than
+        the store. The data file is mapped on the first lookup.
+        """
+        self.blocks = {}
+        self.source_mtimes = {}
+        self.newer_files = set()
+        self.generation = None
+        self.data = None
+
+        if not os.path.exists(self.index_filename): return
+
+        with open(self.index_filename, 'rb') as fd:
+            index_bytes = fd.read()
+
+        # indices from before the modification times were stored have no header
+        if index_bytes[:len(motif_store_magic)] == motif_store_magic:
+            _, self.generation, = struct.unpack('8sq', index_bytes[:16])
+            index_bytes = index_bytes[16:]
+            record_format = '%dsqqq' % max_base_id_bytes
+        else:
+            record_format = '%dsqq' % max_base_id_bytes
+
+        # ignore a partially written final record
+        record_size = struct.calcsize(record_format)
+        nrecords = len(index_bytes) // record_size
+        for iv in range(nrecords):
+            record = struct.unpack(record_format, index_bytes[iv * record_size:(iv + 1) * record_size])
+            base_id = record[0].decode().strip('\0')
+            self.blocks[base_id] = (record[1], record[2])
+            # any motif file is newer than a block without a modification time
+            if len(record) == 4: self.source_mtimes[base_id] = record[3]
+            else: self.source_mtimes[base_id] = -1
+
+        self.data_filename, _ = MotifStoreFilenames(self.dataset, self.suffix, self.generation)
+
+        # one pass over the directory instead of a stat for every read
+        directory = os.path.dirname(self.index_filename)
+        file_suffix = '-motifs-{}.motifs'.format(self.suffix)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(file_suffix): continue
+                base_id = entry.name[:-len(file_suffix)]
+                if base_id in self.blocks and entry.stat().st_mtime_ns > self.source_mtimes[base_id]:
+                    self.newer_files.add(base_id)
+
+    def Legacy(self):
+        """
+        Returns True if the index is from before the modification times were
+        stored. Such a store must be compacted before blocks are appended.
+        """
+        return os.path.exists(self.index_filename) and self.generation == None
+
+    def Contains(self, base_id):
+        """
+        Returns True if the store has a block for this trace.
+        @params base_id: the unique identifier of the trace
+        """
+        return base_id in self.blocks
+
+    def FileIsNewer(self, base_id):
+        """
+        Returns True if the motif file for this trace is newer than its block.
+        @params base_id: the unique identifier of the trace
+        """
+        return base_id in self.newer_files
+
+    def NoteFileWritten(self, base_id):
+        """
+        Record that the motif file for this trace was just written.
+        @params base_id: the unique identifier of the trace
+        """
+        if base_id in self.blocks: self.newer_files.add(base_id)
+
+    def Lookup(self, base_id):
+        """
+        Returns a memory mapped view of the block for this trace.
+        @params base_id: the unique identifier of the trace
+        """
+        offset, length = self.blocks[base_id]
+
+        # map the data file again if it grew since it was last mapped
+        if self.data is None or self.data.size < offset + length:
+            self.data = np.memmap(self.data_filename, dtype=np.int64, mode='r')
+
+        return self.data[offset:offset + length]
+
+    def Append(self, base_id, values, source_mtime):
+        """
+        Append the block for this trace to the end of the store. The block
+        replaces any earlier block for the trace.
+        @params base_id: the unique identifier of the trace
+        @params values: the 8-byte integers to store for this trace
+        @params source_mtime: the modification time (ns) of the motif file the block came from
+        """
+        assert (not self.Legacy())
+
+        values = np.asarray(values, dtype=np.int64)
+
+        base_id_bytes = base_id.encode()
+        assert (len(base_id_bytes) <= max_base_id_bytes)
+
+        # a new store starts at the first generation
+        if not os.path.exists(self.index_filename):
+            with open(self.index_filename, 'wb') as fd:
+                fd.write(struct.pack('8sq', motif_store_magic, 0))
+            self.generation = 0
+            self.data_filename, _ = MotifStoreFilenames(self.dataset, self.suffix, self.generation)
+
+        with open(self.data_filename, 'ab') as fd:
+            offset = fd.tell() // 8
+            values.tofile(fd)
+
+        # the index is written last so readers never see an incomplete block
+        with open(self.index_filename, 'ab') as fd:
+            fd.write(struct.pack('%dsqqq' % max_base_id_bytes, base_id_bytes, offset, values.size, source_mtime))
+
+        self.blocks[base_id] = (offset, values.size)
+        self.source_mtimes[base_id] = source_mtime
+        self.newer_files.discard(base_id)
+
+
+
+def MotifStoreFilenames(dataset, suffix, generation=None):
+    """
+    Returns the data and index filenames for the store of this dataset/suffix.
+    Every consolidation writes a new generation of the data file so readers
+    of the previous generation are not disturbed.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    @params generation: the generation of the data file (None for the original layout)
+    """
+    if generation == None: data_filename = 'motifs/subgraphs/{}/motifs-{}.store'.format(dataset, suffix)
+    else: data_filename = 'motifs/subgraphs/{}/motifs-{}-{}.store'.format(dataset, suffix, generation)
+    index_filename = 'motifs/subgraphs/{}/motifs-{}.index'.format(dataset, suffix)
+
+    return data_filename, index_filename
+
+
+
+def WriteMotifStore(dataset, suffix, blocks, previous_generation=None):
+    """
+    Write a new generation of the store with exactly these blocks and replace
+    the index in one step. The previous data file is removed afterwards (open
+    memory maps keep it readable).
+    Returns the number of integers in the new data file.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    @params blocks: iterable of (base_id, values, source_mtime) for every trace
+    @params previous_generation: the generation that is replaced (None for the original layout)
+    """
+    if previous_generation == None: generation = 0
+    else: generation = previous_generation + 1
+
+    data_filename, index_filename = MotifStoreFilenames(dataset, suffix, generation)
+    previous_data_filename, _ = MotifStoreFilenames(dataset, suffix, previous_generation)
+    temporary_index_filename = '{}.tmp'.format(index_filename)
+
+    offset = 0
+    with open(data_filename, 'wb') as data_fd, open(temporary_index_filename, 'wb') as index_fd:
+        index_fd.write(struct.pack('8sq', motif_store_magic, generation))
+
+        for base_id, values, source_mtime in blocks:
+            values = np.asarray(values, dtype=np.int64)
+
+            base_id_bytes = base_id.encode()
+            assert (len(base_id_bytes) <= max_base_id_bytes)
+
+            values.tofile(data_fd)
+            index_fd.write(struct.pack('%dsqqq' % max_base_id_bytes, base_id_bytes, offset, values.size, source_mtime))
+            offset += values.size
+
+    # readers see either the old index and data or the new ones
+    os.replace(temporary_index_filename, index_filename)
+    if os.path.exists(previous_data_filename) and not previous_data_filename == data_filename:
+        os.remove(previous_data_filename)
+
+    # the next open reads the new generation
+    open_motif_stores.pop((dataset, suffix), None)
+
+    return offset
+
+
+
+def CompactMotifStore(dataset, suffix):
+    """
+    Rewrite the store for this dataset/suffix as a new generation that only
+    keeps the newest block of every trace.
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    """
+    # start statistics
+    start_time = time.time()
+
+    store = MotifStore(dataset, suffix)
+    if not os.path.exists(store.index_filename): return
+
+    nintegers = os.path.getsize(store.data_filename) // 8
+
+    def Blocks():
+        for base_id in sorted(store.blocks):
+            yield base_id, store.Lookup(base_id), store.source_mtimes[base_id]
+
+    ncompacted_integers = WriteMotifStore(dataset, suffix, Blocks(), store.generation)
+
+    # print statistics
+    print ('Compacted the motif store for {} ({}) from {} to {} integers in {:0.2f} seconds.'.format(dataset, suffix, nintegers, ncompacted_integers, time.time() - start_time))
+
+
+
+# keep the stores open between reads
+open_motif_stores = {}
+
+
+
+def OpenMotifStore(dataset, suffix):
+    """
+    Returns the store for this dataset/suffix or None if it does not exist.
+    The store is read once per process (see MotifStore.Reload).
+    @params dataset: the tracing utility that created these motifs
+    @params suffix: the motif method that created these motifs
+    """
+    key = (dataset, suffix)
+
+    if not key in open_motif_stores:
+        _, index_filename = MotifStoreFilenames(dataset, suffix)
+        if os.path.exists(index_filename): open_motif_stores[key] = MotifStore(dataset, suffix)
+        else: open_motif_stores[key] = None
+
+    store = open_motif_stores[key]
+    if store == None or not len(store.blocks): return None
+
+    return store
+
+
+
+def NoteMotifFileWritten(dataset, base_id, suffix):
+    """
+    Tell an open store that this process wrote a newer motif file for a trace.
+    @params dataset: the tracing utility that created these motifs
+    @params base_id: the unique identifier of the trace
+    @params suffix: the motif method that created these motifs
+    """
+    store = open_motif_stores.get((dataset, suffix), None)
+    if not store == None: store.NoteFileWritten(base_id)
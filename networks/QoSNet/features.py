@@ -2,81 +2,100 @@ import os
 import math
 import time
 import struct
-import statistics
+import hashlib
+import multiprocessing
 
 
 import numpy as np
 
 
 
-from network_motifs.motifs.motif import ReadMotifs
-from network_motifs.utilities.dataIO import ReadTrainingTraces, ReadValidationTraces, ReadTestingTraces
+from network_motifs.motifs.inverted import ReadInvertedIndex
+from network_motifs.motifs.motif import MotifSourceSignature, ReadMotifs
+from network_motifs.utilities.dataIO import ReadTrace, ReadTrainingFilenames, ReadValidationFilenames, ReadTestingFilenames, ReadTrainingTraces
 from network_motifs.utilities.constants import request_types_per_dataset
 
 
 
+def GroupStatistics(groups, values, ngroups):
+    """
+    Returns the average and population standard deviation of the values in
+    every group. Groups without values have an average and stddev of zero.
+    @param groups: the group of every value
+    @param values: the values to summarize
+    @param ngroups: the number of groups
+    """
+    values = np.asarray(values, dtype=np.float64)
+
+    noccurrences = np.bincount(groups, minlength=ngroups)
+    divisors = np.maximum(noccurrences, 1)
+
+    # two passes avoid cancellation for large timestamps
+    averages = np.bincount(groups, weights=values, minlength=ngroups) / divisors
+    deviations = values - averages[groups]
+    stddevs = np.sqrt(np.bincount(groups, weights=deviations * deviations, minlength=ngroups) / divisors)
+
+    return averages, stddevs
+
+
+
 def GenerateStatistics(dataset, traces):
+    """
+    Returns the duration, size, time until every node index, and duration per
+    motif statistics of these (training) traces.
+    @param dataset: the dataset that contains these traces
+    @param traces: the traces to summarize
+    """
     trace_statistics = {}
 
     # keep track of durations and nodes
-    durations = []
-    nnodes = []
-    for trace in traces:
-        durations.append(trace.duration)
-        nnodes.append(len(trace.nodes))
+    durations = np.array([trace.duration for trace in traces], dtype=np.float64)
+    nnodes = np.array([len(trace.nodes) for trace in traces], dtype=np.int64)
 
     # add to the list of trace_statistics
-    trace_statistics['average-duration'] = statistics.mean(durations)
-    trace_statistics['stddev-duration'] = statistics.pstdev(durations)
-    trace_statistics['average-nnodes'] = statistics.mean(nnodes)
-    trace_statistics['stddev-nnodes'] = statistics.pstdev(nnodes)
+    (average_duration,), (stddev_duration,) = GroupStatistics(np.zeros(durations.size, dtype=np.int64), durations, 1)
+    (average_nnodes,), (stddev_nnodes,) = GroupStatistics(np.zeros(nnodes.size, dtype=np.int64), nnodes, 1)
+    trace_statistics['average-duration'] = float(average_duration)
+    trace_statistics['stddev-duration'] = float(stddev_duration)
+    trace_statistics['average-nnodes'] = float(average_nnodes)
+    trace_statistics['stddev-nnodes'] = float(stddev_nnodes)
     # give some standard deviation
     if trace_statistics['stddev-nnodes'] == 0.0:
         trace_statistics['stddev-nnodes'] = 1e-6
 
-    # get distributions until start times
-    max_nodes = max(nnodes)
-    durations_until_time = [[] for _ in range(max_nodes)]
-    for trace in traces:
-        for iv, node in enumerate(trace.ordered_nodes):
-            # get the amount of time from the start for this node
-            time_from_start = node.timestamp - trace.minimum_timestamp
-            durations_until_time[iv].append(time_from_start)
-
-    # get distribution information at each node index
-    average_time_until_node = []
-    stddev_time_until_node = []
-    for iv in range(max_nodes):
-        average_time_until_node.append(statistics.mean(durations_until_time[iv]))
-        stddev_time_until_node.append(statistics.pstdev(durations_until_time[iv]))
+    # get distributions until start times at each node index
+    max_nodes = int(np.max(nnodes))
+    node_indices = np.concatenate([np.arange(len(trace.ordered_nodes), dtype=np.int64) for trace in traces])
+    times_from_start = np.concatenate([np.array([node.timestamp for node in trace.ordered_nodes], dtype=np.int64) - trace.minimum_timestamp for trace in traces])
+    average_time_until_node, stddev_time_until_node = GroupStatistics(node_indices, times_from_start, max_nodes)
 
     # add to the list of trace_statistics
-    trace_statistics['average-time-until-node'] = average_time_until_node
-    trace_statistics['stddev-time-until-node'] = stddev_time_until_node
+    trace_statistics['average-time-until-node'] = average_time_until_node.tolist()
+    trace_statistics['stddev-time-until-node'] = stddev_time_until_node.tolist()
 
-    motif_occurrences = {}
+    # use the inverted index if it is current for all of the traces
+    index = ReadInvertedIndex(dataset, 'fuzzy-collapsed-complete')
+    base_ids = [trace.base_id for trace in traces]
+    if not index == None and index.Covers(dataset, 'fuzzy-collapsed-complete', base_ids):
+        average_motifs_durations, stddev_motif_durations = index.DurationStatistics(base_ids)
+    else:
+        motif_indices = []
+        motif_durations = []
 
-    # go through all traces and read the motifs
-    for trace in traces:
-        motifs = ReadMotifs(dataset, trace, 'fuzzy-collapsed-complete')
+        # go through all traces and read the motifs
+        for trace in traces:
+            motif_arrays = ReadMotifs(dataset, trace, 'fuzzy-collapsed-complete', arrays=True)
+            minimum_timestamps, maximum_timestamps = motif_arrays.TimestampExtremes([node.timestamp for node in trace.nodes])
 
-        for motif in motifs:
-            motif_index = motif.motif_index
-            motif_duration = motif.duration
+            motif_indices.append(motif_arrays.motif_indices)
+            motif_durations.append(maximum_timestamps - minimum_timestamps)
 
-            # add to the list of motifs
-            if not motif_index in motif_occurrences:
-                motif_occurrences[motif_index] = []
-            motif_occurrences[motif_index].append(motif_duration)
+        # calculate statistics for all motifs that occur
+        unique_motifs, inverse = np.unique(np.concatenate(motif_indices), return_inverse=True)
+        averages, stddevs = GroupStatistics(inverse, np.concatenate(motif_durations), unique_motifs.size)
 
-    # calculate statistics for all motifs
-    average_motifs_durations = {}
-    stddev_motif_durations = {}
-
-    # get the average duration and standard deviation
-    for motif_index in motif_occurrences:
-        average_motifs_durations[motif_index] = statistics.mean(motif_occurrences[motif_index])
-        stddev_motif_durations[motif_index] = statistics.pstdev(motif_occurrences[motif_index])
+        average_motifs_durations = dict(zip(unique_motifs.tolist(), averages.tolist()))
+        stddev_motif_durations = dict(zip(unique_motifs.tolist(), stddevs.tolist()))
 
     # add to the list of trace statistics
     trace_statistics['average-duration-per-motif'] = average_motifs_durations
@@ -86,10 +105,181 @@ def GenerateStatistics(dataset, traces):
 
 
 
-def PopulateFeatureVectors(dataset, trace, trace_statistics):
-    # go through every node in the trace
-    request_type = trace.request_type
-    motifs = ReadMotifs(dataset, trace, 'fuzzy-collapsed-pruned')
+# first value of every statistics file to identify the layout
+STATISTICS_VERSION = 1
+
+
+
+def StatisticsFilename(dataset, request_type):
+    """
+    Returns the file with the training statistics for this dataset/request type.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    """
+    return 'statistics/QoSNet-{}-{}.stat'.format(dataset, request_type)
+
+
+
+def TrainingSplitHash(dataset, request_type):
+    """
+    Returns a digest of the training filenames, the size and modification time
+    of every training trace, and the signature of its motifs for this
+    dataset/request type. Regenerated traces or motifs change the digest
+    without reading any trace.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    """
+    digest = hashlib.sha256()
+    for trace_filename in ReadTrainingFilenames(dataset, request_type):
+        base_id = os.path.splitext(os.path.basename(trace_filename))[0]
+        stat = os.stat(trace_filename)
+        motif_size, motif_mtime = MotifSourceSignature(dataset, base_id, 'fuzzy-collapsed-complete')
+
+        digest.update(trace_filename.encode())
+        digest.update(struct.pack('qqqq', stat.st_size, stat.st_mtime_ns, motif_size, motif_mtime))
+
+    return digest.digest()
+
+
+
+def WriteStatistics(dataset, request_type, split_hash, trace_statistics):
+    """
+    Write the training statistics for this dataset/request type with the digest
+    of the training split that produced them.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    @param split_hash: the digest from TrainingSplitHash
+    @param trace_statistics: the statistics from GenerateStatistics
+    """
+    if not os.path.exists('statistics'):
+        os.mkdir('statistics')
+
+    average_time_until_node = np.asarray(trace_statistics['average-time-until-node'], dtype=np.float64)
+    stddev_time_until_node = np.asarray(trace_statistics['stddev-time-until-node'], dtype=np.float64)
+
+    motif_indices = np.array(sorted(trace_statistics['average-duration-per-motif']), dtype=np.int64)
+    average_motif_durations = np.array([trace_statistics['average-duration-per-motif'][motif_index] for motif_index in motif_indices.tolist()], dtype=np.float64)
+    stddev_motif_durations = np.array([trace_statistics['stddev-duration-per-motif'][motif_index] for motif_index in motif_indices.tolist()], dtype=np.float64)
+
+    with open(StatisticsFilename(dataset, request_type), 'wb') as fd:
+        fd.write(struct.pack('q32s', STATISTICS_VERSION, split_hash))
+        fd.write(struct.pack('dddd', trace_statistics['average-duration'], trace_statistics['stddev-duration'], trace_statistics['average-nnodes'], trace_statistics['stddev-nnodes']))
+        fd.write(struct.pack('qq', average_time_until_node.size, motif_indices.size))
+
+        for array in [average_time_until_node, stddev_time_until_node, motif_indices, average_motif_durations, stddev_motif_durations]:
+            array.tofile(fd)
+
+
+
+def ReadStatistics(dataset, request_type, split_hash):
+    """
+    Read the training statistics for this dataset/request type, or return None
+    if the file does not exist, was written by an older version, or was
+    computed from a different training split.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    @param split_hash: the digest from TrainingSplitHash
+    """
+    statistics_filename = StatisticsFilename(dataset, request_type)
+    if not os.path.exists(statistics_filename): return None
+
+    with open(statistics_filename, 'rb') as fd:
+        version, file_hash, = struct.unpack('q32s', fd.read(40))
+        if not version == STATISTICS_VERSION or not file_hash == split_hash: return None
+
+        trace_statistics = {}
+        trace_statistics['average-duration'], trace_statistics['stddev-duration'], trace_statistics['average-nnodes'], trace_statistics['stddev-nnodes'], = struct.unpack('dddd', fd.read(32))
+        max_nodes, nmotifs, = struct.unpack('qq', fd.read(16))
+
+        trace_statistics['average-time-until-node'] = np.fromfile(fd, dtype=np.float64, count=max_nodes).tolist()
+        trace_statistics['stddev-time-until-node'] = np.fromfile(fd, dtype=np.float64, count=max_nodes).tolist()
+
+        motif_indices = np.fromfile(fd, dtype=np.int64, count=nmotifs).tolist()
+        trace_statistics['average-duration-per-motif'] = dict(zip(motif_indices, np.fromfile(fd, dtype=np.float64, count=nmotifs).tolist()))
+        trace_statistics['stddev-duration-per-motif'] = dict(zip(motif_indices, np.fromfile(fd, dtype=np.float64, count=nmotifs).tolist()))
+
+    return trace_statistics
+
+
+
+def LoadStatistics(dataset, request_type):
+    """
+    Returns the training statistics for this dataset/request type. The
+    training traces are only read and summarized again when the training split,
+    the training traces, or their motifs changed since the statistics were saved.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    """
+    split_hash = TrainingSplitHash(dataset, request_type)
+
+    trace_statistics = ReadStatistics(dataset, request_type, split_hash)
+    if trace_statistics == None:
+        trace_statistics = GenerateStatistics(dataset, ReadTrainingTraces(dataset, request_type))
+        WriteStatistics(dataset, request_type, split_hash, trace_statistics)
+
+    return trace_statistics
+
+
+
+# six node features and nine motif features per node
+nfeatures_per_node = 6 + 9
+
+
+
+def MotifFeatures(motif_arrays, timestamps, node_timestamps, trace_statistics):
+    """
+    Returns the fraction of completed motifs per size and duration bucket for
+    every node as a (nnodes, 9) array. A motif counts once it and every motif
+    before it in the file completed at or before the node.
+    @param motif_arrays: the MotifArrays object for the pruned motifs of the trace
+    @param timestamps: the timestamp of every node in the trace (by node index)
+    @param node_timestamps: the timestamp of every node in timestamp order
+    @param trace_statistics: the statistics from GenerateStatistics
+    """
+    nnodes = node_timestamps.size
+    nmotifs = motif_arrays.NMotifs()
+    if not nmotifs: return np.zeros((nnodes, 9), dtype=np.float64)
+
+    minimum_timestamps, maximum_timestamps = motif_arrays.TimestampExtremes(timestamps)
+    durations = maximum_timestamps - minimum_timestamps
+
+    motif_indices = motif_arrays.motif_indices.tolist()
+    average_durations = np.array([trace_statistics['average-duration-per-motif'][motif_index] for motif_index in motif_indices], dtype=np.float64)
+    stddev_durations = np.array([trace_statistics['stddev-duration-per-motif'][motif_index] for motif_index in motif_indices], dtype=np.float64)
+
+    # motifs with no variation in duration are average
+    zscores = np.zeros(nmotifs, dtype=np.float64)
+    varies = stddev_durations != 0.0
+    zscores[varies] = (durations[varies] - average_durations[varies]) / stddev_durations[varies]
+
+    # divide into three sizes (small, medium, large) and three durations (below, mid, above)
+    size_indices = (motif_arrays.counts >= 6).astype(np.int64) + (motif_arrays.counts >= 9)
+    zscore_indices = np.where(zscores < -2, 0, np.where(zscores < 2, 1, 2))
+
+    buckets = np.zeros((nmotifs + 1, 9), dtype=np.int64)
+    buckets[np.arange(1, nmotifs + 1), 3 * size_indices + zscore_indices] = 1
+    cumulative_buckets = np.cumsum(buckets, axis=0)
+
+    # motifs are consumed in file order so a later motif waits for earlier ones
+    ncompleted = np.searchsorted(np.maximum.accumulate(maximum_timestamps), node_timestamps, side='right')
+    completed_buckets = cumulative_buckets[ncompleted].reshape(nnodes, 3, 3)
+
+    # convert counts to fractions within each motif size
+    totals = completed_buckets.sum(axis=2, keepdims=True)
+
+    return (completed_buckets / np.maximum(totals, 1)).reshape(nnodes, 9)
+
+
+
+def TraceFeatures(dataset, trace, trace_statistics):
+    """
+    Returns the features and label of every node in timestamp order as a
+    (nnodes, nfeatures_per_node + 1) float32 matrix with the label last.
+    @param dataset: the dataset that contains this trace
+    @param trace: the trace to create features for
+    @param trace_statistics: the statistics from GenerateStatistics
+    """
+    motif_arrays = ReadMotifs(dataset, trace, 'fuzzy-collapsed-pruned', arrays=True)
 
     average_duration = trace_statistics['average-duration']
     stddev_duration = trace_statistics['stddev-duration']
@@ -97,126 +287,286 @@ def PopulateFeatureVectors(dataset, trace, trace_statistics):
     # zscore is what we are trying to predict
     completion_time = 10 * (trace.duration - average_duration) / stddev_duration
 
+    nnodes = len(trace.ordered_nodes)
+    timestamps = np.array([node.timestamp for node in trace.nodes], dtype=np.int64)
+    node_timestamps = np.array([node.timestamp for node in trace.ordered_nodes], dtype=np.int64)
+
+    features = np.zeros((nnodes, nfeatures_per_node + 1), dtype=np.float64)
+
+    # the average and stddev number of nodes per this request
+    average_nnodes = trace_statistics['average-nnodes']
+    stddev_nodes = trace_statistics['stddev-nnodes']
+    features[:,0] = average_nnodes
+    features[:,1] = stddev_nodes
+
+    # the index of this node
+    indices = np.arange(nnodes, dtype=np.float64)
+    features[:,2] = indices
+    features[:,3] = indices / average_nnodes
+    features[:,4] = (indices - average_nnodes) / stddev_nodes
+
+    # the zscore of the time until this node against the same index in training
+    current_durations = (node_timestamps - trace.minimum_timestamp).astype(np.float64)
+    nindices = min(nnodes, len(trace_statistics['average-time-until-node']))
+    stddev_durations_to_index = np.zeros(nnodes, dtype=np.float64)
+    average_durations_to_index = current_durations.copy()
+    average_durations_to_index[:nindices] = trace_statistics['average-time-until-node'][:nindices]
+    stddev_durations_to_index[:nindices] = trace_statistics['stddev-time-until-node'][:nindices]
+
+    varies = stddev_durations_to_index != 0.0
+    features[varies,5] = (current_durations[varies] - average_durations_to_index[varies]) / stddev_durations_to_index[varies]
+
+    # the stats for motifs of each size
+    features[:,6:15] = MotifFeatures(motif_arrays, timestamps, node_timestamps, trace_statistics)
+
+    # the label we are trying to predict
+    features[:,15] = completion_time
+
+    return features.astype(np.float32)
+
+
+
+def PopulateFeatureVectors(dataset, trace, trace_statistics):
+    """
+    Write the features of every node of this trace to its feature file.
+    @param dataset: the dataset that contains this trace
+    @param trace: the trace to create features for
+    @param trace_statistics: the statistics from GenerateStatistics
+    """
+    features = TraceFeatures(dataset, trace, trace_statistics)
+
     # create a feature filename for writing
     feature_filename = 'networks/QoSNet/features/{}/{}.features'.format(dataset, trace.base_id)
 
-    fd = open(feature_filename, 'wb')
-    nnodes = len(trace.ordered_nodes)
-    fd.write(struct.pack('i', nnodes))
-    nfeatures_per_node = 6 + 9
-    fd.write(struct.pack('i', nfeatures_per_node))
-
-    # keep track of the index for motifs
-    motif_index = 0
-    motif_stddev_below = [0 for iv in range(3)]
-    motif_stddev_mid = [0 for iv in range(3)]
-    motif_stddev_above = [0 for iv in range(3)]
-
-    # go through all of the nodes and create a feature
-    for index, node in enumerate(trace.ordered_nodes):
-        # how many motifs are completed before this node
-        while motif_index < len(motifs) and motifs[motif_index].maximum_timestamp <= node.timestamp:
-            # keep track of those whose durations are less than average, average, or more than average
-            motif = motifs[motif_index]
-
-            average_duration = trace_statistics['average-duration-per-motif'][motif.motif_index]
-            stddev_duration = trace_statistics['stddev-duration-per-motif'][motif.motif_index]
-            if stddev_duration == 0.0:
-                zscore = 0.0
-            else:
-                zscore = (motif.duration - average_duration) / stddev_duration
-            motif_size = motifs[motif_index].size()
-
-            # divide into three sizes, small, medium, large
-            if motif_size < 6:
-                motif_size_index = 0
-            elif motif_size < 9:
-                motif_size_index = 1
-            else:
-                motif_size_index = 2
-
-            if zscore < -2:
-                motif_stddev_below[motif_size_index] += 1
-            elif zscore < 2:
-                motif_stddev_mid[motif_size_index] += 1
-            else:
-                motif_stddev_above[motif_size_index] += 1
-
-            motif_index += 1
-
-        # write the average and stddev number of nodes per this request
-        average_nnodes = trace_statistics['average-nnodes']
-        stddev_nodes = trace_statistics['stddev-nnodes']
-
-        fd.write(struct.pack('ff', average_nnodes, stddev_nodes))
-        # write the index of this node
-        ratio_to_average = index / average_nnodes
-        index_zscore = (index - average_nnodes) / stddev_nodes
-        fd.write(struct.pack('fff', index, ratio_to_average, index_zscore))
-        # write the time until the start, the average time, stddev, and zscore
-        current_duration = node.timestamp - trace.minimum_timestamp
-        if index >= len(trace_statistics['average-time-until-node']):
-            average_duration_to_index = current_duration
-            stddev_duration_to_index = 0.0
-        else:
-            average_duration_to_index = trace_statistics['average-time-until-node'][index]
-            stddev_duration_to_index = trace_statistics['stddev-time-until-node'][index]
-        if stddev_duration_to_index == 0.0: duration_zscore = 0.0
-        else: duration_zscore = (current_duration - average_duration_to_index) / stddev_duration_to_index
-        #fd.write(struct.pack('ffff', average_duration_to_index, stddev_duration_to_index, current_duration, duration_zscore))
-        fd.write(struct.pack('f', duration_zscore))
-
-        # write the stats for motifs of size k
-        for k in range(3):
-            nbelow = motif_stddev_below[k]
-            nmid = motif_stddev_mid[k]
-            nabove = motif_stddev_above[k]
-            total_motifs = nbelow + nmid + nabove
-
-            if total_motifs == 0:
-                fd.write(struct.pack('fff', nbelow, nmid, nabove))
-            else:
-                fd.write(struct.pack('fff', nbelow / total_motifs, nmid / total_motifs, nabove / total_motifs))
-
-        # write the label we are trying to predict
-        fd.write(struct.pack('f', completion_time))
+    with open(feature_filename, 'wb') as fd:
+        fd.write(struct.pack('ii', features.shape[0], nfeatures_per_node))
+        features.tofile(fd)
+
+
+
+def TraceFeatureFilename(dataset, trace_filename):
+    """
+    Returns the feature file for this trace.
+    @param dataset: the dataset that contains this trace
+    @param trace_filename: the filename of the trace
+    """
+    base_id = trace_filename.split('/')[-1].split('.')[0]
+
+    return 'networks/QoSNet/features/{}/{}.features'.format(dataset, base_id)
+
+
+
+def ReadTraceFeatures(dataset, trace_filename):
+    """
+    Returns the (nnodes, nfeatures_per_node + 1) float32 matrix of features
+    and labels in the feature file of this trace.
+    @param dataset: the dataset that contains this trace
+    @param trace_filename: the filename of the trace
+    """
+    with open(TraceFeatureFilename(dataset, trace_filename), 'rb') as fd:
+        nnodes, nfeatures, = struct.unpack('ii', fd.read(8))
+
+        return np.fromfile(fd, dtype=np.float32, count=nnodes * (nfeatures + 1)).reshape(nnodes, nfeatures + 1)
 
 
 
 def ReadFeatures(dataset, trace_filenames):
-    # create the list of features
-    dataset_features = []
-    dataset_labels = []
+    """
+    Returns the features, labels, and the number of nodes in the trace of every
+    node in these traces as arrays.
+    @param dataset: the dataset that contains these traces
+    @param trace_filenames: the filenames of the traces
+    """
+    matrices = [ReadTraceFeatures(dataset, trace_filename) for trace_filename in trace_filenames]
+    if not len(matrices): return np.zeros((0, nfeatures_per_node), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+    matrix = np.concatenate(matrices)
+    nnodes = np.array([features.shape[0] for features in matrices], dtype=np.int64)
+
+    return matrix[:,:-1], matrix[:,-1], np.repeat(nnodes, nnodes)
+
+
+
+# first value of every feature matrix file to identify the layout (2 adds the digest of the feature files)
+FEATURE_MATRIX_VERSION = 2
+
+# the functions that return the trace filenames for every split
+filenames_per_split = {
+    'training': ReadTrainingFilenames,
+    'validation': ReadValidationFilenames,
+    'testing': ReadTestingFilenames,
+}
+
+
+
+def FeatureMatrixFilename(dataset, request_type, split):
+    """
+    Returns the consolidated feature file for this dataset/request type/split.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    @param split: training, validation, or testing
+    """
+    return 'networks/QoSNet/features/{}/{}-{}.matrix'.format(dataset, request_type, split)
 
-    nnodes_per_feature = []
 
+
+def FeatureSourceHash(dataset, trace_filenames):
+    """
+    Returns a digest of the trace filenames of a split and the size and
+    modification time of the feature file of every trace.
+    @param dataset: the dataset that contains the traces
+    @param trace_filenames: the filenames of the traces in the split
+    """
+    digest = hashlib.sha256()
     for trace_filename in trace_filenames:
-        base_id = trace_filename.split('/')[-1].split('.')[0]
+        stat = os.stat(TraceFeatureFilename(dataset, trace_filename))
+
+        digest.update(trace_filename.encode())
+        digest.update(struct.pack('qq', stat.st_size, stat.st_mtime_ns))
+
+    return digest.digest()
+
+
+
+def WriteFeatureMatrix(dataset, request_type, split):
+    """
+    Consolidate the feature files of every trace in this split into one file
+    that can be memory mapped. The file has a header of 8-byte integers and
+    the digest of the feature files, the trace offsets, the float32 features
+    of every node, and the labels. The matrix is sized from the 'ii' headers
+    and the features of every file are only read when they are written.
+    Returns the digest of the feature files (see FeatureSourceHash).
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    @param split: training, validation, or testing
+    """
+    trace_filenames = filenames_per_split[split](dataset, request_type)
+    source_hash = FeatureSourceHash(dataset, trace_filenames)
+
+    # only the 'ii' header of each feature file is needed to size the matrix
+    nnodes = np.zeros(len(trace_filenames), dtype=np.int64)
+    for iv, trace_filename in enumerate(trace_filenames):
+        with open(TraceFeatureFilename(dataset, trace_filename), 'rb') as fd:
+            nnodes[iv], nfeatures, = struct.unpack('ii', fd.read(8))
+            assert (nfeatures == nfeatures_per_node)
+
+    trace_offsets = np.zeros(nnodes.size + 1, dtype=np.int64)
+    np.cumsum(nnodes, out=trace_offsets[1:])
+
+    with open(FeatureMatrixFilename(dataset, request_type, split), 'wb') as fd:
+        fd.write(struct.pack('qqqq32s', FEATURE_MATRIX_VERSION, nnodes.size, trace_offsets[-1], nfeatures_per_node, source_hash))
+        trace_offsets.tofile(fd)
+
+        # the labels are written after all of the features
+        labels = np.zeros(trace_offsets[-1], dtype=np.float32)
+        for iv, trace_filename in enumerate(trace_filenames):
+            matrix = ReadTraceFeatures(dataset, trace_filename)
+            matrix[:,:-1].tofile(fd)
+            labels[trace_offsets[iv]:trace_offsets[iv + 1]] = matrix[:,-1]
+        labels.tofile(fd)
+
+    return source_hash
+
+
+
+def ReadFeatureMatrix(dataset, request_type, split, source_hash):
+    """
+    Open the consolidated features for this dataset/request type/split with
+    every array memory mapped from disk. Returns the features, the labels, and
+    the offsets of every trace, or None if the file does not exist, was
+    written by an older version, or was consolidated from other feature files.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    @param split: training, validation, or testing
+    @param source_hash: the digest from FeatureSourceHash for the current feature files
+    """
+    matrix_filename = FeatureMatrixFilename(dataset, request_type, split)
+    if not os.path.exists(matrix_filename): return None
+
+    # older versions have a shorter header so only the version is read first
+    with open(matrix_filename, 'rb') as fd:
+        version, = struct.unpack('q', fd.read(8))
+        if not version == FEATURE_MATRIX_VERSION: return None
+
+        header_size = 4 * 8 + 32
+        fd.seek(0)
+        _, ntraces, nexamples, nfeatures, file_hash, = struct.unpack('qqqq32s', fd.read(header_size))
+
+    # matrices of regenerated feature files or a changed split are consolidated again
+    if not file_hash == source_hash: return None
+
+    # numpy cannot memory map empty arrays
+    if not nexamples: return np.zeros((0, nfeatures), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(ntraces + 1, dtype=np.int64)
 
-        feature_filename = 'networks/QoSNet/features/{}/{}.features'.format(dataset, base_id)
+    features_offset = header_size + 8 * (ntraces + 1)
+    labels_offset = features_offset + 4 * nexamples * nfeatures
 
+    trace_offsets = np.memmap(matrix_filename, dtype=np.int64, mode='r', offset=header_size, shape=(ntraces + 1,))
+    features = np.memmap(matrix_filename, dtype=np.float32, mode='r', offset=features_offset, shape=(nexamples, nfeatures))
+    labels = np.memmap(matrix_filename, dtype=np.float32, mode='r', offset=labels_offset, shape=(nexamples,))
 
-        with open(feature_filename, 'rb') as fd:
-            nnodes, nfeatures_per_node, = struct.unpack('ii', fd.read(8))
+    return features, labels, trace_offsets
 
-            for iv in range(nnodes):
-                features = np.zeros(nfeatures_per_node, dtype=np.float32)
-                for ii in range(nfeatures_per_node):
-                    features[ii], = struct.unpack('f', fd.read(4))
 
-                # read the label we are trying to predict
-                label, = struct.unpack('f', fd.read(4))
 
-                dataset_features.append(features)
-                dataset_labels.append(label)
-                nnodes_per_feature.append(nnodes)
+def LoadFeatureMatrix(dataset, request_type, split):
+    """
+    Returns the memory mapped features, labels, and trace offsets for this
+    dataset/request type/split, consolidating the feature files first if the
+    matrix is missing or out of date.
+    @param dataset: the dataset that contains the traces
+    @param request_type: the request type for this set of traces
+    @param split: training, validation, or testing
+    """
+    source_hash = FeatureSourceHash(dataset, filenames_per_split[split](dataset, request_type))
 
-    # return the features and labels
-    return dataset_features, dataset_labels, nnodes_per_feature
+    feature_matrix = ReadFeatureMatrix(dataset, request_type, split, source_hash)
+    if feature_matrix == None:
+        source_hash = WriteFeatureMatrix(dataset, request_type, split)
+        feature_matrix = ReadFeatureMatrix(dataset, request_type, split, source_hash)
 
+    return feature_matrix
 
 
-def Generate(datasets):
+
+# the statistics of every request type in each feature worker
+statistics_per_request_type = None
+
+
+
+def InitializeFeatureWorker(trace_statistics_per_request_type):
+    """
+    Give a worker process the training statistics once instead of with every trace.
+    @param trace_statistics_per_request_type: the statistics for every request type
+    """
+    global statistics_per_request_type
+    statistics_per_request_type = trace_statistics_per_request_type
+
+
+
+def PopulateTraceFeatures(arguments):
+    """
+    Read one trace and write its features. Runs in a worker process.
+    Returns the request type of the trace.
+    @params arguments: tuple of (dataset, request_type, trace_filename)
+    """
+    dataset, request_type, trace_filename = arguments
+
+    trace = ReadTrace(dataset, trace_filename)
+    PopulateFeatureVectors(dataset, trace, statistics_per_request_type[request_type])
+
+    return request_type
+
+
+
+def Generate(datasets, nprocesses = None):
+    """
+    Generate the features of every trace for these datasets. The statistics
+    for all request types are computed first and the traces of every request
+    type are then streamed through one process pool.
+    @param datasets: the datasets to generate features for
+    @param nprocesses: the number of worker processes (None for all cores)
+    """
     # create directory structure if it does not exist
     if not os.path.exists('networks'):
         os.mkdir('networks')
@@ -230,25 +580,41 @@ def Generate(datasets):
     for dataset in datasets:
         if not os.path.exists('networks/QoSNet/features/{}'.format(dataset)):
             os.mkdir('networks/QoSNet/features/{}'.format(dataset))
-        for request_type in request_types_per_dataset[dataset]:
-            # start statistics
-            start_time = time.time()
 
-            training_traces = ReadTrainingTraces(dataset, request_type)
+        # start statistics
+        start_time = time.time()
+
+        request_types = request_types_per_dataset[dataset]
+
+        # only use the training set to get statistics
+        trace_statistics_per_request_type = {}
+        for request_type in request_types:
+            trace_statistics_per_request_type[request_type] = LoadStatistics(dataset, request_type)
 
-            validation_traces = ReadValidationTraces(dataset, request_type)
+        # every trace of every split is independent once the statistics are known
+        arguments = []
+        ntraces_per_request_type = {}
+        for request_type in request_types:
+            trace_filenames = [trace_filename for split in filenames_per_split for trace_filename in filenames_per_split[split](dataset, request_type)]
+            arguments += [(dataset, request_type, trace_filename) for trace_filename in trace_filenames]
+            ntraces_per_request_type[request_type] = len(trace_filenames)
 
-            testing_traces = ReadTestingTraces(dataset, request_type)
+            # request types without traces still get empty matrices
+            if not len(trace_filenames):
+                for split in filenames_per_split:
+                    WriteFeatureMatrix(dataset, request_type, split)
 
-            # only use the training and validation sets(?) to get statistics
-            print ('{} {}'.format(dataset, request_type))
-            trace_statistics = GenerateStatistics(dataset, training_traces)
+        with multiprocessing.Pool(nprocesses, initializer=InitializeFeatureWorker, initargs=(trace_statistics_per_request_type,)) as pool:
+            for request_type in pool.imap_unordered(PopulateTraceFeatures, arguments, chunksize=16):
+                ntraces_per_request_type[request_type] -= 1
+                if ntraces_per_request_type[request_type]: continue
 
-            traces = training_traces + validation_traces + testing_traces
+                # consolidate each split into one memory mapped matrix
+                for split in filenames_per_split:
+                    WriteFeatureMatrix(dataset, request_type, split)
 
-            for trace in traces:
-                # populate feature vectors both with and without motif features
-                PopulateFeatureVectors(dataset, trace, trace_statistics)
+                # print statistics
+                print ('Generated features for {} {} in {:0.2f} seconds'.format(dataset, request_type, time.time() - start_time))
 
-            # print statistics
-            print('Generated features for {} {} in {:0.2f} seconds'.format(dataset, request_type, time.time() - start_time))
+        # print statistics
+        print ('Generated features for {} traces of {} in {:0.2f} seconds'.format(len(arguments), dataset, time.time() - start_time))
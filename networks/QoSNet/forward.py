@@ -1,5 +1,4 @@
 import os
-import math
 import struct
 
 
@@ -12,14 +11,13 @@ from keras.models import model_from_json
 
 
 
-from network_motifs.utilities import dataIO
 from network_motifs.utilities.constants import human_readable, request_types_per_dataset
-from network_motifs.networks.QoSNet.features import ReadFeatures
+from network_motifs.networks.QoSNet.features import LoadFeatureMatrix
 from network_motifs.visualization.network_results import VisualizeNetworkDurations
 
 
 
-def CalculateResults(dataset, request_type, model, features, labels, parameters, nnodes):
+def CalculateResults(dataset, request_type, model, features, labels, parameters, nnodes, inference_batch_size = 1 << 16):
     # read in critical statistics
     statistics_filename = 'statistics/QoS-{}-{}.stat'.format(dataset, request_type)
     with open(statistics_filename, 'rb') as fd:
@@ -27,47 +25,44 @@ def CalculateResults(dataset, request_type, model, features, labels, parameters,
 
     # create method to visualize results
     nbins = 20
-    binned_duration_errors = [0.0 for iv in range(nbins)]
-    binned_correct_qos_detection = [0 for iv in range(nbins)]
-    binned_occurrences = [0 for iv in range(nbins)]
 
     nexamples = len(features)
-    predictions = model.predict(np.array(features))
-
-    mae = 0.0
-    mae_baseline = 0.0
-    mae_duration = 0.0
-
-    correct = 0
-
-    TP, TN, FP, FN = 0, 0, 0, 0
-    for iv in range(nexamples):
-        prediction = predictions[iv][0] / 10
-        label = labels[iv] / 10
-
-        mae += abs(prediction - label)
-        # actual duration of this process
-        actual_duration = label * stddev_duration + avg_duration
-        predicted_duration = prediction * stddev_duration + avg_duration
-        mae_duration += abs(predicted_duration - actual_duration)
-        mae_baseline += abs(avg_duration - actual_duration)
-        qos_ground_truth = actual_duration > qos_threshold
-        qos_prediction = predicted_duration > qos_threshold
-        if qos_ground_truth == qos_prediction: correct += 1
-
-        # where in the matrix is this prediction
-        if qos_prediction and qos_ground_truth: TP += 1
-        elif qos_prediction and not qos_ground_truth: FP += 1
-        elif not qos_prediction and qos_ground_truth: FN += 1
-        elif not qos_prediction and not qos_ground_truth: TN += 1
-        else: assert (False)
-
-        # how close to the end is this node
-        bin = int(math.floor(features[iv][2] / nnodes[iv] * nbins))
-        binned_duration_errors[bin] += abs(predicted_duration - actual_duration)
-        if (prediction > 1 and label > 1) or (prediction < 1 and label < 1):
-            binned_correct_qos_detection[bin] += 1
-        binned_occurrences[bin] += 1
+
+    # run inference in batches so the memory mapped features are never all in memory
+    predictions = np.zeros(nexamples, dtype=np.float32)
+    for start in range(0, nexamples, inference_batch_size):
+        end = min(start + inference_batch_size, nexamples)
+        predictions[start:end] = model.predict(np.asarray(features[start:end], dtype=np.float32), batch_size=parameters['batch_size']).reshape(end - start)
+
+    predictions = predictions / np.float32(10)
+    labels = np.asarray(labels, dtype=np.float32) / np.float32(10)
+
+    # actual duration of this process
+    actual_durations = labels * stddev_duration + avg_duration
+    predicted_durations = predictions * stddev_duration + avg_duration
+    duration_errors = np.abs(predicted_durations - actual_durations).astype(np.float64)
+
+    mae = float(np.sum(np.abs(predictions - labels), dtype=np.float64))
+    mae_duration = float(np.sum(duration_errors))
+    mae_baseline = float(np.sum(np.abs(avg_duration - actual_durations), dtype=np.float64))
+
+    qos_ground_truth = actual_durations > qos_threshold
+    qos_prediction = predicted_durations > qos_threshold
+    correct = int(np.count_nonzero(qos_ground_truth == qos_prediction))
+
+    # where in the matrix is each prediction
+    TP = int(np.count_nonzero(qos_prediction & qos_ground_truth))
+    FP = int(np.count_nonzero(qos_prediction & ~qos_ground_truth))
+    FN = int(np.count_nonzero(~qos_prediction & qos_ground_truth))
+    TN = int(np.count_nonzero(~qos_prediction & ~qos_ground_truth))
+
+    # how close to the end is each node
+    bins = np.floor(np.asarray(features[:,2]) / np.asarray(nnodes) * nbins).astype(np.int64)
+    correct_qos_detection = ((predictions > 1) & (labels > 1)) | ((predictions < 1) & (labels < 1))
+
+    binned_occurrences = np.bincount(bins, minlength=nbins)
+    binned_duration_errors = np.bincount(bins, weights=duration_errors, minlength=nbins)
+    binned_correct_qos_detection = np.bincount(bins, weights=correct_qos_detection, minlength=nbins)
 
     mae /= nexamples
     mae_duration /= nexamples
@@ -93,11 +88,14 @@ def CalculateResults(dataset, request_type, model, features, labels, parameters,
     print ('  Accuracy: {:0.2f}'.format(correct / nexamples))
 
     # update the results for each bin based on number of occurrences
-    for bin in range(nbins):
-        if binned_occurrences[bin]:
-            binned_duration_errors[bin] /= binned_occurrences[bin]
-            binned_correct_qos_detection[bin] /= binned_occurrences[bin]
-            binned_correct_qos_detection[bin] *= 100.0
+    occurred = binned_occurrences > 0
+    binned_duration_errors[occurred] /= binned_occurrences[occurred]
+    binned_correct_qos_detection[occurred] /= binned_occurrences[occurred]
+    binned_correct_qos_detection[occurred] *= 100.0
+
+    binned_duration_errors = binned_duration_errors.tolist()
+    binned_correct_qos_detection = binned_correct_qos_detection.tolist()
+    binned_occurrences = binned_occurrences.tolist()
 
     return binned_correct_qos_detection, binned_duration_errors, binned_occurrences
 
@@ -105,16 +103,18 @@ def CalculateResults(dataset, request_type, model, features, labels, parameters,
 def Forward(dataset):
     # create a new model for every request type
     for request_type in request_types_per_dataset[dataset]:
-        testing_filenames = dataIO.ReadTestingFilenames(dataset, request_type)
+        testing_features, testing_labels, trace_offsets = LoadFeatureMatrix(dataset, request_type, 'testing')
 
-        testing_features, testing_labels, nnodes = ReadFeatures(dataset, testing_filenames)
+        # the number of nodes in the trace of every example
+        nnodes_per_trace = np.diff(trace_offsets)
+        nnodes = np.repeat(nnodes_per_trace, nnodes_per_trace)
 
         parameters = {}
         parameters['first-layer'] = 512
         parameters['second-layer'] = 256
         parameters['third-layer'] = 128
         parameters['batch_size'] = 1000
-        parameters['nfeatures'] = testing_features[0].size
+        parameters['nfeatures'] = testing_features.shape[1]
 
         # get the prefix for where this model is saved
         model_prefix = 'networks/QoSNet/architectures/{}-request-type-{}-params-{}-{}-{}-batch-size-{}'.format(dataset, request_type, parameters['first-layer'], parameters['second-layer'], parameters['third-layer'], parameters['batch_size'])
@@ -0,0 +1,332 @@
+import time
+import collections
+
+
+
+import numpy as np
+
+
+
+from network_motifs.motifs.motif import ReadMotifs
+from network_motifs.networks.QoSNet.features import TraceFeatures, nfeatures_per_node
+
+
+
+class StreamingQoSScorer(object):
+    def __init__(self, model, trace_statistics, qos_threshold, batch_size = 256):
+        """
+        Score requests that are still running with a trained QoSNet. Each
+        request keeps the state needed for the features of its next node: the
+        first timestamp, the number of nodes so far, and the completed motifs
+        per size and duration bucket. Every new node queues one feature vector
+        and the model is called once per batch of queued nodes across all
+        requests.
+        @param model: the trained QoSNet keras model
+        @param trace_statistics: the training statistics from LoadStatistics
+        @param qos_threshold: durations above this threshold violate QoS
+        @param batch_size: the number of queued nodes that triggers a model call
+        """
+        self.model = model
+        self.trace_statistics = trace_statistics
+        self.qos_threshold = qos_threshold
+        self.batch_size = batch_size
+
+        # the statistics used for every node
+        self.average_nnodes = trace_statistics['average-nnodes']
+        self.stddev_nnodes = trace_statistics['stddev-nnodes']
+        self.average_time_until_node = trace_statistics['average-time-until-node']
+        self.stddev_time_until_node = trace_statistics['stddev-time-until-node']
+
+        # the first timestamp, number of nodes, and motif buckets of every request in flight
+        self.states = {}
+
+        # the queued nodes waiting for the next model call
+        self.request_ids = []
+        self.arrival_times = []
+        self.features = np.zeros((batch_size, nfeatures_per_node), dtype=np.float32)
+
+    def NRequests(self):
+        """
+        Returns the number of requests in flight.
+        """
+        return len(self.states)
+
+    def NQueued(self):
+        """
+        Returns the number of nodes waiting for a model call.
+        """
+        return len(self.request_ids)
+
+    def Start(self, request_id):
+        """
+        Start tracking a new request.
+        @param request_id: unique identifier of the request
+        """
+        self.states[request_id] = [None, 0, np.zeros(9, dtype=np.int64)]
+
+    def Finish(self, request_id):
+        """
+        Stop tracking a request that completed. Its queued nodes are still scored.
+        @param request_id: unique identifier of the request
+        """
+        del self.states[request_id]
+
+    def ObserveMotif(self, request_id, motif_index, motif_size, motif_duration):
+        """
+        Add a motif of this request that just completed.
+        @param request_id: unique identifier of the request
+        @param motif_index: the subgraph type of the motif
+        @param motif_size: the number of nodes in the motif
+        @param motif_duration: the time between the first and last node of the motif
+        """
+        average_duration = self.trace_statistics['average-duration-per-motif'][motif_index]
+        stddev_duration = self.trace_statistics['stddev-duration-per-motif'][motif_index]
+        if stddev_duration == 0.0: zscore = 0.0
+        else: zscore = (motif_duration - average_duration) / stddev_duration
+
+        # divide into three sizes (small, medium, large) and three durations (below, mid, above)
+        if motif_size < 6: motif_size_index = 0
+        elif motif_size < 9: motif_size_index = 1
+        else: motif_size_index = 2
+
+        if zscore < -2: zscore_index = 0
+        elif zscore < 2: zscore_index = 1
+        else: zscore_index = 2
+
+        self.states[request_id][2][3 * motif_size_index + zscore_index] += 1
+
+    def ObserveNode(self, request_id, timestamp):
+        """
+        Add the newest node of a request and queue its features for scoring.
+        Returns the scores from a model call if the queue filled up (see Flush).
+        @param request_id: unique identifier of the request
+        @param timestamp: the timestamp of the node
+        """
+        state = self.states[request_id]
+        if state[0] == None: state[0] = timestamp
+        index = state[1]
+        state[1] += 1
+
+        features = self.features[len(self.request_ids)]
+
+        # the average and stddev number of nodes per this request
+        features[0] = self.average_nnodes
+        features[1] = self.stddev_nnodes
+
+        # the index of this node
+        features[2] = index
+        features[3] = index / self.average_nnodes
+        features[4] = (index - self.average_nnodes) / self.stddev_nnodes
+
+        # the zscore of the time until this node against the same index in training
+        if index < len(self.average_time_until_node) and not self.stddev_time_until_node[index] == 0.0:
+            features[5] = (timestamp - state[0] - self.average_time_until_node[index]) / self.stddev_time_until_node[index]
+        else:
+            features[5] = 0.0
+
+        # the fraction of completed motifs in each bucket within each motif size
+        buckets = state[2].reshape(3, 3)
+        features[6:15] = (buckets / np.maximum(buckets.sum(axis=1, keepdims=True), 1)).reshape(9)
+
+        self.request_ids.append(request_id)
+        self.arrival_times.append(time.perf_counter())
+
+        if len(self.request_ids) == self.batch_size: return self.Flush()
+        else: return []
+
+    def Flush(self):
+        """
+        Score every queued node with one model call. Returns a list of
+        (request_id, predicted duration, violates QoS, arrival time) for every
+        queued node in arrival order.
+        """
+        nqueued = len(self.request_ids)
+        if not nqueued: return []
+
+        # the network predicts ten times the zscore of the duration
+        predictions = self.model.predict_on_batch(self.features[:nqueued])
+        predicted_zscores = np.asarray(predictions, dtype=np.float64).reshape(nqueued) / 10
+        predicted_durations = predicted_zscores * self.trace_statistics['stddev-duration'] + self.trace_statistics['average-duration']
+
+        scores = list(zip(self.request_ids, predicted_durations.tolist(), (predicted_durations > self.qos_threshold).tolist(), self.arrival_times))
+
+        self.request_ids = []
+        self.arrival_times = []
+
+        return scores
+
+
+
+def StreamingWorkload(dataset, trace):
+    """
+    Returns the node timestamps in arrival order and the motifs of this trace
+    as a list of (arrival timestamp, motif index, motif size, motif duration).
+    Motifs stay in file order and a motif arrives once it and every motif
+    before it completed, the same as MotifFeatures.
+    @param dataset: the dataset that contains the trace
+    @param trace: the trace to replay
+    """
+    node_timestamps = [node.timestamp for node in trace.ordered_nodes]
+
+    motif_arrays = ReadMotifs(dataset, trace, 'fuzzy-collapsed-pruned', arrays=True)
+    minimum_timestamps, maximum_timestamps = motif_arrays.TimestampExtremes(np.array([node.timestamp for node in trace.nodes], dtype=np.int64))
+    arrival_timestamps = np.maximum.accumulate(maximum_timestamps)
+    motifs = list(zip(arrival_timestamps.tolist(), motif_arrays.motif_indices.tolist(), motif_arrays.counts.tolist(), (maximum_timestamps - minimum_timestamps).tolist()))
+
+    return node_timestamps, motifs
+
+
+
+def ReplayRequests(scorer, workloads, nconcurrent, Record):
+    """
+    Replay the workloads as concurrent requests whose nodes arrive interleaved.
+    Every batch of scores is passed to Record. Returns the number of events.
+    @param scorer: the StreamingQoSScorer to feed
+    @param workloads: list of (request_id, node_timestamps, motifs) from StreamingWorkload
+    @param nconcurrent: the number of requests in flight at once
+    @param Record: function called with the output of every model call
+    """
+    pending = collections.deque(workloads)
+    in_flight = collections.deque()
+
+    nevents = 0
+
+    while len(pending) or len(in_flight):
+        # keep nconcurrent requests in flight
+        while len(pending) and len(in_flight) < nconcurrent:
+            request_id, node_timestamps, motifs = pending.popleft()
+            scorer.Start(request_id)
+            in_flight.append((request_id, node_timestamps, motifs, 0, 0))
+
+        # the next node of the oldest request arrives with the motifs it completes
+        request_id, node_timestamps, motifs, index, motif_index = in_flight.popleft()
+        timestamp = node_timestamps[index]
+        while motif_index < len(motifs) and motifs[motif_index][0] <= timestamp:
+            _, subgraph_index, motif_size, motif_duration = motifs[motif_index]
+            scorer.ObserveMotif(request_id, subgraph_index, motif_size, motif_duration)
+            motif_index += 1
+            nevents += 1
+
+        Record(scorer.ObserveNode(request_id, timestamp))
+        nevents += 1
+
+        if index + 1 < len(node_timestamps): in_flight.append((request_id, node_timestamps, motifs, index + 1, motif_index))
+        else: scorer.Finish(request_id)
+
+    Record(scorer.Flush())
+
+    return nevents
+
+
+
+def BenchmarkStreamingQoSScorer(model, trace_statistics, qos_threshold, dataset, traces, nconcurrent = 1000, batch_size = 256):
+    """
+    Replay the traces as concurrent requests whose nodes arrive interleaved.
+    Motifs arrive as in StreamingWorkload and every node is scored. Prints
+    the events per second, the latency percentiles from arrival to score, and
+    how many violations were flagged. Returns the latencies in seconds.
+    @param model: the trained QoSNet keras model
+    @param trace_statistics: the training statistics from LoadStatistics
+    @param qos_threshold: durations above this threshold violate QoS
+    @param dataset: the dataset that contains the traces
+    @param traces: the traces to replay
+    @param nconcurrent: the number of requests in flight at once
+    @param batch_size: the number of queued nodes that triggers a model call
+    """
+    scorer = StreamingQoSScorer(model, trace_statistics, qos_threshold, batch_size)
+
+    # the node timestamps and the motifs of every trace
+    workloads = []
+    for iv, trace in enumerate(traces):
+        workloads.append((iv,) + StreamingWorkload(dataset, trace))
+
+    latencies = []
+    flagged_requests = set()
+
+    def Record(scores):
+        completion_time = time.perf_counter()
+        for request_id, _, violation, arrival_time in scores:
+            latencies.append(completion_time - arrival_time)
+            if violation: flagged_requests.add(request_id)
+
+    start_time = time.time()
+
+    nevents = ReplayRequests(scorer, workloads, nconcurrent, Record)
+
+    total_time = time.time() - start_time
+    latencies = np.array(latencies, dtype=np.float64)
+
+    # how many requests that violated QoS were flagged before they completed
+    violations = [iv for iv, trace in enumerate(traces) if trace.duration > qos_threshold]
+    nflagged = sum(1 for iv in violations if iv in flagged_requests)
+
+    # print statistics
+    print ('Streamed {} events ({} scored nodes) for {} requests ({} concurrent) in {:0.2f} seconds.'.format(nevents, latencies.size, len(traces), nconcurrent, total_time))
+    if latencies.size:
+        print ('  Events per second: {:0.2f}'.format(nevents / total_time))
+        print ('  Median latency: {:0.2f} ms'.format(1e3 * np.percentile(latencies, 50)))
+        print ('  P99 latency: {:0.2f} ms'.format(1e3 * np.percentile(latencies, 99)))
+    print ('  Flagged QoS violations: {} of {}'.format(nflagged, len(violations)))
+
+    return latencies
+
+
+
+class FeatureRecorder(object):
+    def __init__(self):
+        """
+        Stands in for the model in a StreamingQoSScorer and keeps a copy of
+        every batch of features it is asked to score.
+        """
+        self.batches = []
+
+    def predict_on_batch(self, features):
+        """
+        Record the features and predict a zscore of zero for every node.
+        @param features: the (nqueued, nfeatures_per_node) features of the batch
+        """
+        self.batches.append(np.array(features))
+
+        return np.zeros((features.shape[0], 1), dtype=np.float32)
+
+
+
+def CheckStreamingFeatures(dataset, traces, trace_statistics, nconcurrent = 1000, batch_size = 256):
+    """
+    Replay the traces interleaved as in BenchmarkStreamingQoSScorer and check
+    that once a request finished the streamed features of its nodes equal the
+    rows of TraceFeatures. Prints the number of matching traces and returns
+    the base ids of the traces that do not match.
+    @param dataset: the dataset that contains the traces
+    @param traces: the traces to replay
+    @param trace_statistics: the training statistics from LoadStatistics
+    @param nconcurrent: the number of requests in flight at once
+    @param batch_size: the number of queued nodes that triggers a model call
+    """
+    recorder = FeatureRecorder()
+    scorer = StreamingQoSScorer(recorder, trace_statistics, 0.0, batch_size)
+
+    workloads = []
+    for iv, trace in enumerate(traces):
+        workloads.append((iv,) + StreamingWorkload(dataset, trace))
+
+    # the streamed rows of every request in arrival order
+    streamed_features = [[] for _ in traces]
+
+    def Record(scores):
+        if not len(scores): return
+        for (request_id, _, _, _), features in zip(scores, recorder.batches.pop()):
+            streamed_features[request_id].append(features)
+
+    ReplayRequests(scorer, workloads, nconcurrent, Record)
+
+    mismatches = []
+    for iv, trace in enumerate(traces):
+        expected_features = TraceFeatures(dataset, trace, trace_statistics)[:,:nfeatures_per_node]
+        if not np.array_equal(np.array(streamed_features[iv], dtype=np.float32).reshape(-1, nfeatures_per_node), expected_features):
+            mismatches.append(trace.base_id)
+
+    # print statistics
+    print ('Streamed features match TraceFeatures for {} of {} traces in {}.'.format(len(traces) - len(mismatches), len(traces), dataset))
+
+    return mismatches
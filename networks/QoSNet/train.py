@@ -1,7 +1,8 @@
 import os
 import time
-import random
+import queue
 import keras
+import threading
 
 
 
@@ -15,9 +16,8 @@ from keras.layers.advanced_activations import LeakyReLU
 
 
 
-from network_motifs.utilities import dataIO
 from network_motifs.utilities.constants import request_types_per_dataset
-from network_motifs.networks.QoSNet.features import ReadFeatures
+from network_motifs.networks.QoSNet.features import LoadFeatureMatrix
 
 
 
@@ -45,35 +45,94 @@ def QoSNet(parameters):
 
 
 
-def GenerateExamples(dataset_features, dataset_labels, parameters):
-    # get stats about the learning process
-    ndata_points = len(dataset_features)
-    batch_size = parameters['batch_size']
-    nfeatures = parameters['nfeatures']
-
-    input_features = np.zeros((batch_size, nfeatures), dtype=np.float32)
-    input_labels = np.zeros(batch_size, dtype=np.float32)
+def BatchIndices(ndata_points, batch_size, rng):
+    """
+    Yields the indices of every batch from a shuffled order of the data points.
+    The order is shuffled again once every data point was used and a batch
+    continues into the new order.
+    @param ndata_points: the number of examples
+    @param batch_size: the number of examples per batch
+    @param rng: the numpy random generator
+    """
+    # an empty data set would never fill a batch
+    assert (ndata_points > 0)
 
-    indices = [iv for iv in range(ndata_points)]
-    random.shuffle(indices)
+    indices = rng.permutation(ndata_points)
 
-    # current index in features/labels lists
+    # current index in the shuffled order
     index = 0
     while True:
-        for iv in range(batch_size):
-            # put into format for learning
-            input_features[iv,:] = dataset_features[indices[index]]
-            input_labels[iv] = dataset_labels[indices[index]]
+        batch_indices = np.zeros(batch_size, dtype=np.int64)
+
+        nfilled = 0
+        while nfilled < batch_size:
+            nindices = min(batch_size - nfilled, ndata_points - index)
+            batch_indices[nfilled:nfilled + nindices] = indices[index:index + nindices]
+            nfilled += nindices
+            index += nindices
 
             # reset the index if overflow
-            index += 1
             if index == ndata_points:
                 index = 0
-                random.shuffle(indices)
+                indices = rng.permutation(ndata_points)
+
+        yield batch_indices
+
+
+
+def GenerateExamples(dataset_features, dataset_labels, parameters, nprefetch = 8, seed = None):
+    """
+    Yields shuffled batches of features and labels forever. Batches are
+    gathered from the feature matrix on a background thread and every batch
+    is a new pair of arrays so keras can queue them safely. An error on the
+    background thread is raised by the generator.
+    @param dataset_features: the (nexamples, nfeatures) feature matrix (may be memory mapped)
+    @param dataset_labels: the label of every example
+    @param parameters: the network parameters with the batch size
+    @param nprefetch: the number of batches to prepare ahead of the trainer
+    @param seed: seed for the random number generator (None for a random seed)
+    """
+    ndata_points = dataset_features.shape[0]
+    batch_size = parameters['batch_size']
 
-        # yield the created features and labels
-        yield (input_features, input_labels)
+    batches = queue.Queue(maxsize=nprefetch)
+    stop = threading.Event()
 
+    def Put(item):
+        # wait for space in the queue until the generator is closed
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def PrefetchBatches():
+        try:
+            for batch_indices in BatchIndices(ndata_points, batch_size, np.random.default_rng(seed)):
+                # the order within a batch does not matter and sorted reads are faster from disk
+                batch_indices.sort()
+                batch = (np.asarray(dataset_features[batch_indices], dtype=np.float32), np.asarray(dataset_labels[batch_indices], dtype=np.float32))
+
+                if not Put(batch): return
+        except BaseException as exception:
+            # hand the error to the trainer instead of leaving it waiting for a batch
+            Put(exception)
+
+    prefetch_thread = threading.Thread(target=PrefetchBatches, daemon=True)
+    prefetch_thread.start()
+
+    try:
+        while True:
+            batch = batches.get()
+            if isinstance(batch, BaseException): raise batch
+
+            # yield the created features and labels
+            yield batch
+    finally:
+        stop.set()
 
 
 
@@ -86,19 +145,16 @@ def Train(dataset):
         # start statistics
         start_time = time.time()
 
-        # read the training and validation features from disk
-        training_filenames = dataIO.ReadTrainingFilenames(dataset, request_type)
-        validation_filenames = dataIO.ReadValidationFilenames(dataset, request_type)
-
-        training_features, training_labels, _ = ReadFeatures(dataset, training_filenames)
-        validation_features, validation_labels, _ = ReadFeatures(dataset, validation_filenames)
+        # memory map the training and validation features from disk
+        training_features, training_labels, _ = LoadFeatureMatrix(dataset, request_type, 'training')
+        validation_features, validation_labels, _ = LoadFeatureMatrix(dataset, request_type, 'validation')
 
         parameters = {}
         parameters['first-layer'] = 512
         parameters['second-layer'] = 256
         parameters['third-layer'] = 128
         parameters['batch_size'] = 1000
-        parameters['nfeatures'] = training_features[0].size
+        parameters['nfeatures'] = training_features.shape[1]
 
         # create the simple model
         model = QoSNet(parameters)
@@ -2,6 +2,10 @@ import statistics
 
 
 
+import numpy as np
+
+
+
 from network_motifs.motifs.motif import ReadMotifs
 from network_motifs.motifs.query import IdentifyFrequentSubgraphs
 from network_motifs.utilities.dataIO import ReadTraces
@@ -39,20 +43,18 @@ def CompareMotifMethods(dataset):
         coverages = []
         for trace in traces:
             # read the motifs for this trace
-            motifs = ReadMotifs(dataset, trace, suffix)
+            motifs = ReadMotifs(dataset, trace, suffix, arrays=True)
             nnodes = len(trace.nodes)
 
-            nodes_covered = [False for _ in range(nnodes)]
+            nodes_covered = np.zeros(nnodes, dtype=bool)
 
             # add all of the relevant stats
-            motifs_per_trace.append(len(motifs))
-            for motif in motifs:
-                unique_motifs.add(motif.motif_index)
-                motif_sizes.append(motif.size())
-                for node in motif.nodes:
-                    nodes_covered[node.index] = True
-
-            coverages.append(100 * sum(nodes_covered) / nnodes)
+            motifs_per_trace.append(motifs.NMotifs())
+            unique_motifs.update(motifs.motif_indices.tolist())
+            motif_sizes += motifs.counts.tolist()
+            nodes_covered[motifs.nodes] = True
+
+            coverages.append(100 * int(np.count_nonzero(nodes_covered)) / nnodes)
 
         if not len(motif_sizes): continue
         max_motif_size = max(motif_sizes)
@@ -1,3 +1,4 @@
+import os
 import glob
 import struct
 
@@ -144,6 +145,115 @@ def ReadTraces(dataset, request_type, trace_filenames):
 
 
 
+class TraceIndexEntry(object):
+    def __init__(self, base_id, request_type, nnodes, nedges, duration, signature=(-1, -1)):
+        """
+        Summary of a trace that can be used without reading the trace file.
+        @param base_id: unique identifier for this trace
+        @param request_type: the request that started this execution trace
+        @param nnodes: the number of nodes in the trace
+        @param nedges: the number of edges in the trace
+        @param duration: the total running time for this trace
+        @param signature: the (size, modification time in ns) of the trace file that was summarized
+        """
+        self.base_id = base_id
+        self.request_type = request_type
+        self.nnodes = nnodes
+        self.nedges = nedges
+        self.duration = duration
+        self.signature = signature
+
+
+
+def TraceFilename(dataset, base_id):
+    """
+    Returns the binary trace file for this trace.
+    @param dataset: the trace dataset
+    @param base_id: unique identifier for this trace
+    """
+    return 'traces/{}/{}.trace'.format(dataset, base_id)
+
+
+
+def TraceSignatures(dataset):
+    """
+    Returns a dictionary from base id to the (size, modification time in ns)
+    of every trace file in this dataset. The directory is scanned once.
+    @param dataset: the trace dataset
+    """
+    signatures = {}
+    with os.scandir('traces/{}'.format(dataset)) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.trace'): continue
+            stat = entry.stat()
+            signatures[entry.name[:-len('.trace')]] = (stat.st_size, stat.st_mtime_ns)
+
+    return signatures
+
+
+
+def GenerateTraceIndex(dataset, trace_index=None):
+    """
+    Summarize the traces in this dataset and save the index. Entries of
+    trace_index whose trace file did not change are kept and only the new or
+    modified traces are read. Entries for removed trace files are dropped.
+    Returns the new dictionary from base id to TraceIndexEntry.
+    @param dataset: the trace dataset
+    @param trace_index: the previous index (None to read every trace)
+    """
+    if trace_index == None: trace_index = {}
+
+    signatures = TraceSignatures(dataset)
+
+    updated_trace_index = {}
+    for base_id, signature in signatures.items():
+        if base_id in trace_index and trace_index[base_id].signature == signature:
+            updated_trace_index[base_id] = trace_index[base_id]
+        else:
+            trace = ReadTrace(dataset, TraceFilename(dataset, base_id))
+            updated_trace_index[base_id] = TraceIndexEntry(trace.base_id, trace.request_type, len(trace.nodes), len(trace.edges), trace.duration, signature)
+
+    # readers never see a partially written index
+    index_filename = 'traces/{}/trace-index.txt'.format(dataset)
+    temporary_index_filename = '{}.tmp'.format(index_filename)
+    with open(temporary_index_filename, 'w') as fd:
+        for entry in updated_trace_index.values():
+            fd.write('{} {} {} {} {} {} {}\n'.format(entry.base_id, entry.request_type, entry.nnodes, entry.nedges, entry.duration, entry.signature[0], entry.signature[1]))
+    os.replace(temporary_index_filename, index_filename)
+
+    return updated_trace_index
+
+
+
+def ReadTraceIndex(dataset):
+    """
+    Returns a dictionary from base id to TraceIndexEntry for every trace in
+    this dataset. The index is generated if it does not exist and updated if
+    trace files were added, removed, or modified since it was written.
+    @param dataset: the trace dataset
+    """
+    index_filename = 'traces/{}/trace-index.txt'.format(dataset)
+
+    trace_index = {}
+    if os.path.exists(index_filename):
+        with open(index_filename, 'r') as fd:
+            for line in fd:
+                fields = line.split()
+                base_id, request_type, nnodes, nedges, duration = fields[:5]
+                # indices from before the signatures were stored are always out of date
+                if len(fields) == 7: signature = (int(fields[5]), int(fields[6]))
+                else: signature = (-1, -1)
+                trace_index[base_id] = TraceIndexEntry(base_id, request_type, int(nnodes), int(nedges), int(duration), signature)
+
+    # compare against the trace files on disk
+    signatures = TraceSignatures(dataset)
+    if not len(signatures) == len(trace_index) or any(not base_id in trace_index or not trace_index[base_id].signature == signature for base_id, signature in signatures.items()):
+        trace_index = GenerateTraceIndex(dataset, trace_index)
+
+    return trace_index
+
+
+
 def ReadOpenStackTrace(trace_filename):
     """
     Returns the trace for this OpenStack dataset.